@@ -48,21 +48,33 @@ class Cleaner():
                         logging.info(f'目标文件夹 {dst} 不存在，即将自动创建.')
                         os.makedirs(dst)
                 
+                moved = None
                 if method == 'move':
                     from .move import move
-                    move.move(src, dst)
+                    moved = move.move(src, dst)
                 elif method == 'copy':
                     from .copy import copy
                     copy.copy(src, dst)
                 elif method == 'delete':
                     from .delete import delete
                     delete.delete(src)
+                if method in ['move', 'delete']:
+                    self._evict_render_cache(src, moved)
                 self.pipeSend(src, 'info', desc=f'{method} {src} -> {dst}.')
                 
             except Exception as e:
                 logging.exception(e)
                 self.pipeSend(src, 'error', desc=e)
 
+    @staticmethod
+    def _evict_render_cache(src, dst=None):
+        # 文件被移动或者删除后更新渲染缓存的记录
+        try:
+            from DMR.Render.rendercache import RenderCache
+            RenderCache().evict(src, dst if isinstance(dst, str) else None)
+        except Exception as e:
+            logging.debug(f'render cache evict failed: {e}')
+
     def add(self, videos, group=None, video_info=None, clean_configs=None, **kwargs):
         for clean_config in clean_configs:
             if isinstance(videos, str):
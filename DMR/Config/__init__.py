@@ -159,6 +159,13 @@ class Config():
             if replace_invalid_chars(output_name) != output_name:
                 raise ValueError(f'自定义录制文件名称不合法: {output_name}')
 
+            # check emoticon: 图片表情（Picture事件）只有python渲染器支持，libass会忽略
+            dm_args = rep.get('advanced_dm_args') or {}
+            engine = rep.get('render', {}).get('engine')
+            if dm_args.get('dm_emoticon') == 'image' and engine != 'python':
+                warnings.warn(f'{name} 的表情弹幕设置为image，但是渲染引擎{engine}不支持图片表情，将改为写入表情的文字描述.')
+                dm_args['dm_emoticon'] = 'text'
+
         # check bilibili config
         for name, rep_conf in self.config['replay'].items():
             for vtype, upd_confs in rep_conf.get('upload', {}).items():
@@ -47,6 +47,9 @@ class Downloader():
         self.end_cnt = end_cnt
         self.advanced_video_args = advanced_video_args if advanced_video_args else {}
         self.advanced_dm_args = advanced_dm_args if advanced_dm_args else {}
+        render_config = self.kwargs.get('render') or {}
+        self.live_render = bool(self.danmaku and self.video and self.kwargs.get('auto_render')
+                                and (render_config.get('advanced_render_args') or {}).get('live_render'))
         self.output_name = join(self.output_dir, output_name+f'.{vid_format}')
 
         self.engine = engine
@@ -99,12 +102,33 @@ class Downloader():
             if self.danmaku:
                 newdmfile = splitext(newfile)[0]+'.ass'
                 self.dmw.split(newdmfile)
-        self.pipeSend(newfile,'split',video_info=video_info)
+        self.pipeSend(newfile,'split',video_info=video_info,raw_file=filename)
         new_segment_info = self.liveapi.GetStreamerInfo()
         if new_segment_info:
             self.segment_info = new_segment_info
         self.segment_start_time = datetime.now()
 
+    def segment_start_callback(self, filename:str):
+        """开始录制新的分段，用于边录边渲染和实时转推"""
+        if not (self.live_render or self.restream):
+            return
+        # 在录制进程的日志读取线程中调用，等待弹幕文件时不能阻塞日志读取
+        threading.Thread(target=self._segment_start, args=(filename,), daemon=True).start()
+
+    def _segment_start(self, filename:str):
+        dm_file = None
+        if self.danmaku:
+            # 弹幕录制和视频录制同时启动，第一个分段开始时弹幕文件可能还没有创建
+            for _ in range(20):
+                if getattr(self, 'dmw', None) and getattr(self.dmw, 'dm_file', None):
+                    dm_file = self.dmw.dm_file
+                    break
+                time.sleep(0.5)
+        if self.restream:
+            self.restream.add_segment(filename, dm_file)
+        if self.live_render:
+            self.pipeSend(filename,'segment_start',danmaku=dm_file)
+
     def start_once(self):
         self.stoped = False
 
@@ -134,6 +158,16 @@ class Downloader():
         self.downloader = None
         self.dmw = None
 
+        # 实时转推带弹幕的直播流
+        self.restream = None
+        restream_config = self.kwargs.get('restream')
+        if isinstance(restream_config, str):
+            restream_config = {'url': restream_config}
+        if self.video and restream_config and restream_config.get('url'):
+            from DMR.Render.restream import RestreamSink
+            self.restream = RestreamSink(render_config=self.kwargs.get('render'), debug=self.debug, **restream_config)
+            self.restream.start()
+
         def danmaku_thread():
             description = f'{self.output_name}的弹幕文件, {self.url}, Powered by DanmakuRender: https://github.com/SmallPeaches/DanmakuRender.'
             danmu_output = join(self.output_dir, f'[正在录制]{self.taskname}-{time.strftime("%Y%m%d-%H%M%S",time.localtime())}-Part%03d.ass')
@@ -145,6 +179,12 @@ class Downloader():
                                      height=self.height,
                                      advanced_dm_args=self.advanced_dm_args,
                                      **self.kwargs)
+            if self.restream:
+                ass_writer = self.dmw.dmwriter.sinks.get('ass')
+                if ass_writer:
+                    ass_writer.add_listener(self.restream)
+                else:
+                    logging.warning(f'{self.taskname} 没有录制ass格式的弹幕，转推的直播流将没有弹幕.')
             self.dmw.start(self_segment=not self.video)
 
         def video_thread():
@@ -157,6 +197,7 @@ class Downloader():
                 taskname=self.taskname,
                 advanced_video_args=self.advanced_video_args,
                 segment_callback=self.segment_callback,
+                segment_start_callback=self.segment_start_callback,
                 stable_callback=self.stable_callback,
                 debug=self.debug,
                 **self.kwargs
@@ -242,6 +283,11 @@ class Downloader():
 
     def stop_once(self):
         self.stoped = True
+        if getattr(self, 'restream', None):
+            try:
+                self.restream.stop()
+            except Exception as e:
+                logging.exception(e)
         if self.danmaku and hasattr(self, 'dmw'):
             try:
                 self.dmw.stop()
@@ -1,7 +1,10 @@
 from datetime import datetime
+import os
 import threading
+import logging
 from DMR.danmaku import SimpleDanmaku
 from DMR.utils import *
+from .tracks import TrackAllocator, TextMeasurer
 
 __all__ = ['AssWriter']
 
@@ -24,6 +27,10 @@ class AssWriter():
                  auto_fontsize:bool,
                  outlinecolor:str,
                  outlinesize:int,
+                 flush_size:int=64*1024,
+                 flush_interval:float=1,
+                 fsync:str='never',
+                 font_file:str=None,
                  **kwargs) -> None:
         self.description = description
         self.height = height
@@ -42,12 +49,27 @@ class AssWriter():
         self.opacity = hex(255-int(opacity*255))[2:].zfill(2)
         self.outlinecolor = str(outlinecolor).zfill(6)
         self.outlinesize = outlinesize
+        # 写入缓冲：缓冲内容超过flush_size个字符或者距离上次写入超过flush_interval秒时在后台线程写入文件
+        # fsync: never（不主动同步到磁盘），flush（每次写入后同步），close（关闭文件时同步）
+        self.flush_size = flush_size
+        self.flush_interval = flush_interval
+        self.fsync = fsync
         self.kwargs = kwargs
 
         self._lock = threading.Lock()
+        self._io_lock = threading.Lock()
+        self._file = None
+        self._filename = None
+        self._tracks = None
+        self._buffer = []
+        self._buffered = 0
+        self._wakeup = threading.Event()
+        self._flusher = None
         self._super_chat_tails = []  # 初始化 _super_chat_tails 属性
         self._super_chat_state = 0
         self._latest_end_time = 0
+        # 实时获取写入内容的监听器（例如实时转推），需要实现ass_open(filename, header)和ass_event(filename, text)
+        self._listeners = []
         self._ntracks = int(((self.height - self.dst) * self.dmrate) / (self.fontsize + self.margin_h))
 
         self.meta_info = [
@@ -68,52 +90,97 @@ class AssWriter():
             'Format: Layer, Start, End, Style, Name, MarginL, MarginR, MarginV, Effect, Text',
         ]
 
+        # 弹幕宽度：优先使用字体文件（font_file或者font）的实际字宽
+        self._measurer = TextMeasurer(self.fontsize, [font_file, self.font])
+
     def _get_length(self, string:str):
-        length = 0
-        for s in string:
-            if len(s.encode('utf-8')) == 1:
-                length += 0.5*self.fontsize
-            else:
-                length += self.fontsize
-        return int(length)
+        return self._measurer.width(string)
 
     def open(self, filename):
-        with self._lock, open(filename,'w',encoding='utf-8') as f:
+        with self._io_lock:
+            self._close_file()
+            self._file = open(filename, 'w', encoding='utf-8', buffering=1024*1024)
             self._filename = filename
-            self._track_tails = [None for _ in range(self._ntracks)]
-            for info in self.meta_info:
-                f.write(info+'\n')
+            self._tracks = TrackAllocator(
+                self._ntracks,
+                width=self.width,
+                dmduration=self.dmduration,
+                gap=max(0.2 * self.width, self.margin_w),
+                margin=self.margin_w,
+            )
+            self._file.write('\n'.join(self.meta_info) + '\n')
+            self._file.flush()
+        for listener in list(self._listeners):
+            listener.ass_open(filename, list(self.meta_info))
+        if self._flusher is None:
+            self._flusher = threading.Thread(target=self._flush_loop, daemon=True)
+            self._flusher.start()
+
+    def _write(self, text:str) -> bool:
+        """将内容放入写入缓冲，实际的文件写入在后台线程中进行"""
+        with self._lock:
+            if self._file is None:
+                return False
+            self._buffer.append(text)
+            self._buffered += len(text)
+            full = self._buffered >= self.flush_size
+            filename = self._filename
+        if full:
+            self._wakeup.set()
+        for listener in list(self._listeners):
+            try:
+                listener.ass_event(filename, text)
+            except Exception as e:
+                logging.debug(f'ASS listener error: {e}')
+        return True
+
+    def add_listener(self, listener):
+        """添加监听器，已经打开文件时立即通知当前的文件"""
+        self._listeners.append(listener)
+        if self._filename is not None:
+            listener.ass_open(self._filename, list(self.meta_info))
+
+    def remove_listener(self, listener):
+        if listener in self._listeners:
+            self._listeners.remove(listener)
+
+    def _flush_loop(self):
+        while self._flusher is not None:
+            self._wakeup.wait(self.flush_interval)
+            self._wakeup.clear()
+            try:
+                self.flush()
+            except Exception as e:
+                logging.error(f'弹幕文件 {self._filename} 写入失败: {e}')
+
+    def _flush_file(self):
+        # 调用前需要获取_io_lock
+        with self._lock:
+            lines, self._buffer, self._buffered = self._buffer, [], 0
+        if self._file is None or not lines:
+            return
+        self._file.write(''.join(lines))
+        self._file.flush()
+        if self.fsync == 'flush':
+            os.fsync(self._file.fileno())
+
+    def _close_file(self):
+        # 调用前需要获取_io_lock
+        if self._file is None:
+            return
+        self._flush_file()
+        if self.fsync in ['flush', 'close']:
+            os.fsync(self._file.fileno())
+        with self._lock:
+            self._file.close()
+            self._file = None
+
+    def flush(self):
+        """将缓冲的内容写入文件"""
+        with self._io_lock:
+            self._flush_file()
     
-    def add(self, danmu:SimpleDanmaku, calc_collision=True):
-        """
-        添加弹幕到ASS文件 
-        danmu: 待添加弹幕
-        calc_collision: 是否计算冲突，冲突的弹幕将会被自动忽略
-        """
-        tid, max_dist = 0, -1e5
-        
-        # 计算给出弹幕到指定弹幕的距离
-        def tail_dist(tail_dm:SimpleDanmaku, tic:float):
-            if not tail_dm:
-                return 1e5
-            dm_length = self._get_length(tail_dm.content)
-            dist = (tic - tail_dm.time) * (dm_length + self.width) / self.dmduration - dm_length 
-            return dist
-        
-        for i, tail_dm in enumerate(self._track_tails):
-            dist = tail_dist(tail_dm, danmu.time)
-            if dist > 0.2 * self.width and dist > self.margin_w:
-                tid = i
-                max_dist = dist
-                break
-            if dist > max_dist:
-                max_dist = dist
-                tid = i
-        
-        if calc_collision and max_dist < self.margin_w:
-            return False
-        
-        dm_length = self._get_length(danmu.content)
+    def _write_event(self, event_type:str, danmu:SimpleDanmaku, dm_length:int, tid:int, text:str):
         x0 = self.width
         x1 = -dm_length
         y = self.fontsize + (self.fontsize + self.margin_h) * tid
@@ -123,68 +190,102 @@ class AssWriter():
 
         t0 = '%02d:%02d:%05.2f'%sec2hms(t0)
         t1 = '%02d:%02d:%05.2f'%sec2hms(t1)
-        
+
         # set ass Dialogue
-        dm_info = f'Dialogue: 0,{t0},{t1},R2L,,0,0,0,,'
+        dm_info = f'{event_type}: 0,{t0},{t1},R2L,,0,0,0,,'
         dm_info += '{\move(%d,%d,%d,%d)}'%(x0, y + self.dst, x1, y + self.dst)
-        dm_info += '{\\alpha&H%s\\1c%s&}'%(self.opacity, RGB2BGR(danmu.color))
-        content = danmu.content.replace('\n',' ').replace('\r',' ')
-        dm_info += content
-
-        with self._lock, open(self._filename, 'a', encoding='utf-8') as f:
-            f.write(dm_info + '\n')
-        
-        self._track_tails[tid] = danmu
+        dm_info += text
+
+        if not self._write(dm_info + '\n'):
+            return False
+        self._tracks.place(tid, danmu.time, dm_length)
         return True
 
+    def add(self, danmu:SimpleDanmaku, calc_collision=True):
+        """
+        添加弹幕到ASS文件 
+        danmu: 待添加弹幕
+        calc_collision: 是否计算冲突，冲突的弹幕将会被自动忽略
+        """
+        if not self._tracks:
+            return False
+        tid, ok = self._tracks.find(danmu.time)
+        if calc_collision and not ok:
+            return False
+
+        dm_length = self._get_length(danmu.content)
+        text = '{\\alpha&H%s\\1c%s&}'%(self.opacity, RGB2BGR(danmu.color))
+        text += danmu.content.replace('\n',' ').replace('\r',' ')
+        return self._write_event('Dialogue', danmu, dm_length, tid, text)
+
+    def add_image(self, danmu:SimpleDanmaku, image:str, ratio:float=1, calc_collision=True):
+        """
+        添加图片弹幕（表情）到ASS文件，使用Picture事件，只有python渲染器支持
+        image: 图片路径
+        ratio: 图片的宽高比，图片高度与弹幕字体大小相同
+        """
+        if not self._tracks:
+            return False
+        tid, ok = self._tracks.find(danmu.time)
+        if calc_collision and not ok:
+            return False
+
+        dm_length = int(self.fontsize * ratio)
+        return self._write_event('Picture', danmu, dm_length, tid, image.replace('\n', ''))
+
     def add_super_chat(self, super_chat: SimpleDanmaku):
-        with self._lock:
-            if not self._filename:
-                raise RuntimeError("ASS file is not open.")
-
-            # 格式化超级弹幕内容
-            content_lines = []
-            for i in range(0, len(super_chat.content), 15):
-                content_lines.append(super_chat.content[i:i + 15])
-            formatted_content = '\\N'.join(content_lines)
-
-            # 计算当前超级弹幕数量和更新最晚结束时间
-            current_time = super_chat.time
-            if current_time > self._latest_end_time:
-                self._super_chat_state = 0  # 重置状态
-            self._super_chat_state += 1
-            self._latest_end_time = current_time + 20  # 每个超级弹幕持续20秒
-
-            # 根据当前状态计算 y 坐标
-            base_y = 100
-            y_offset = 120
-            y = base_y + (self._super_chat_state - 1) * y_offset
-
-            t0 = current_time
-            t1 = t0 + 20  # Super Chat 持续时间固定为20秒
-
-            t0_display = '%02d:%02d:%05.2f' %sec2hms(t0)
-            t1_display = '%02d:%02d:%05.2f' %sec2hms(t1)
-
-            # 构建 ASS 格式的弹幕信息
-            dm_info = (
-                f'Dialogue: 0,{t0_display},{t1_display},message_box,,0000,0000,0000,,'
-                f'{{\\pos(0,{y})\\c&HFF6600\\shad0\\p1}}m 0 0 l 250 0 l 250 81 l 0 81\n'
-                f'Dialogue: 0,{t0_display},{t1_display},message_box,,0000,0000,0000,,'
-                f'{{\\pos(0,{y + 40})\\shad0\\p1\\c&HCC0000}}m 0 0 l 250 0 l 250 80 l 0 80\n'
-                f'Dialogue: 1,{t0_display},{t1_display},message_box,,0000,0000,0000,,'
-                f'{{\\pos(6,{y + 5})\\c&HFFFFFF\\fs15\\b1\\q2}}{super_chat.uname}\n'
-                f'Dialogue: 1,{t0_display},{t1_display},message_box,,0000,0000,0000,,'
-                f'{{\\pos(6,{y + 20})\\c&HFFFFFF\\fs15\\q2}}SuperChat CNY {super_chat.price}\n'
-                f'Dialogue: 1,{t0_display},{t1_display},message_box,,0000,0000,0000,,'
-                f'{{\\pos(6,{y + 40})\\c&HFFFFFF\\q2}}{formatted_content}\n'
-            )
+        if not self._filename:
+            raise RuntimeError("ASS file is not open.")
+        self._write(self.format_super_chat(super_chat))
+        self._super_chat_tails.append(super_chat)
+
+    def format_super_chat(self, super_chat: SimpleDanmaku) -> str:
+        """生成超级弹幕的ASS事件（多行），同时更新超级弹幕的排列状态"""
+        # 格式化超级弹幕内容
+        content_lines = []
+        for i in range(0, len(super_chat.content), 15):
+            content_lines.append(super_chat.content[i:i + 15])
+        formatted_content = '\\N'.join(content_lines)
+
+        # 计算当前超级弹幕数量和更新最晚结束时间
+        current_time = super_chat.time
+        if current_time > self._latest_end_time:
+            self._super_chat_state = 0  # 重置状态
+        self._super_chat_state += 1
+        self._latest_end_time = current_time + 20  # 每个超级弹幕持续20秒
+
+        # 根据当前状态计算 y 坐标
+        base_y = 100
+        y_offset = 120
+        y = base_y + (self._super_chat_state - 1) * y_offset
+
+        t0 = current_time
+        t1 = t0 + 20  # Super Chat 持续时间固定为20秒
 
-            with open(self._filename, 'a', encoding='utf-8') as f:
-                f.write(dm_info)
+        t0_display = '%02d:%02d:%05.2f' %sec2hms(t0)
+        t1_display = '%02d:%02d:%05.2f' %sec2hms(t1)
 
-            self._super_chat_tails.append(super_chat)
+        # 构建 ASS 格式的弹幕信息
+        dm_info = (
+            f'Dialogue: 0,{t0_display},{t1_display},message_box,,0000,0000,0000,,'
+            f'{{\\pos(0,{y})\\c&HFF6600\\shad0\\p1}}m 0 0 l 250 0 l 250 81 l 0 81\n'
+            f'Dialogue: 0,{t0_display},{t1_display},message_box,,0000,0000,0000,,'
+            f'{{\\pos(0,{y + 40})\\shad0\\p1\\c&HCC0000}}m 0 0 l 250 0 l 250 80 l 0 80\n'
+            f'Dialogue: 1,{t0_display},{t1_display},message_box,,0000,0000,0000,,'
+            f'{{\\pos(6,{y + 5})\\c&HFFFFFF\\fs15\\b1\\q2}}{super_chat.uname}\n'
+            f'Dialogue: 1,{t0_display},{t1_display},message_box,,0000,0000,0000,,'
+            f'{{\\pos(6,{y + 20})\\c&HFFFFFF\\fs15\\q2}}SuperChat CNY {super_chat.price}\n'
+            f'Dialogue: 1,{t0_display},{t1_display},message_box,,0000,0000,0000,,'
+            f'{{\\pos(6,{y + 40})\\c&HFFFFFF\\q2}}{formatted_content}\n'
+        )
+        return dm_info
 
     def close(self):
-        del self._filename
-        del self._track_tails
+        flusher, self._flusher = self._flusher, None
+        if flusher is not None:
+            self._wakeup.set()
+            flusher.join()
+        with self._io_lock:
+            self._close_file()
+        self._filename = None
+        self._tracks = None
@@ -1,16 +1,23 @@
 import asyncio
+import json
 import logging
 import os
 import re
 import time
 import threading
 import platform
+import heapq
 from datetime import datetime
 from os.path import *
 
-from DMR.LiveAPI.danmaku import DanmakuClient
-from DMR.utils import sec2hms, hms2sec, BGR2RGB
+from DMR.LiveAPI.utils import split_url
+from DMR.utils import sec2hms, hms2sec, BGR2RGB, LatencyHistogram
 from DMR.danmaku import SimpleDanmaku
+from .dmqueue import QUEUE_POLICIES
+from .dmsource import DanmakuSource
+from .dedup import DanmakuDeduplicator, DEDUP_MODES
+from .dmfilter import DanmakuFilter
+from .dmsink import DanmakuSinks, parse_formats
 
 class DanmakuWriter():
     def __init__(self,
@@ -26,21 +33,52 @@ class DanmakuWriter():
         self.url = url
         self.output = output
         self.segment = segment
-        self.dm_format = dm_format
+        self.dm_format = parse_formats(dm_format)
+        if 'ass' not in self.dm_format:
+            logging.warning(f'弹幕录制格式{self.dm_format}中没有ass格式，将无法渲染弹幕视频.')
         self.advanced_dm_args = advanced_dm_args
         self.dm_delay_fixed = self.advanced_dm_args.get('dm_delay_fixed', 6)
-        self.dm_auto_restart = self.advanced_dm_args.get('dm_auto_restart', 300)
-        try:
-            if not dm_filter:
-                self.dm_filter = []
-            elif isinstance(dm_filter, str):
-                self.dm_filter = [dm_filter]
-            else:
-                self.dm_filter = dm_filter
-            self.dm_filter = [re.compile(str(x)) for x in self.dm_filter]
-        except Exception as e:
-            logging.warn(f'弹幕屏蔽词{dm_filter}设置错误:{e}，此功能将不会生效.')
-            self.dm_filter = []
+        self.dm_auto_restart = self.advanced_dm_args.get('dm_auto_restart', 120)
+        self.dm_reconnect_delay = float(self.advanced_dm_args.get('dm_reconnect_delay', 2))
+        self.dm_reconnect_max_delay = float(self.advanced_dm_args.get('dm_reconnect_max_delay', 60))
+        self.dm_queue_size = int(self.advanced_dm_args.get('dm_queue_size', 10000))
+        self.dm_queue_policy = self.advanced_dm_args.get('dm_queue_policy', 'drop_type')
+        if self.dm_queue_policy not in QUEUE_POLICIES:
+            logging.warning(f'弹幕队列策略{self.dm_queue_policy}设置错误，将使用默认策略drop_type.')
+            self.dm_queue_policy = 'drop_type'
+        self.dm_queue = None
+        # 同时录制的其他直播间（例如多平台同时直播），弹幕合并写入同一个弹幕文件
+        self.dm_extra_sources = self._parse_sources(self.advanced_dm_args.get('dm_extra_sources'))
+        self.dm_merge_window = float(self.advanced_dm_args.get('dm_merge_window', 1))
+        self.sources = []
+        # 弹幕延迟统计：socket读取->解码完成，解码完成->写入器取出，socket读取->写入弹幕文件
+        self.latency = {
+            'decode': LatencyHistogram(),
+            'queue': LatencyHistogram(),
+            'total': LatencyHistogram(),
+        }
+        # 断线空白时长：断开前最后一帧到重连后第一帧之间的时间
+        self.reconnect_gaps = LatencyHistogram((1, 2, 5, 10, 20, 30, 60, 120, 300, 600))
+        self.dm_journal = self.advanced_dm_args.get('dm_journal', False)
+        self.dm_dedup = self.advanced_dm_args.get('dm_dedup')
+        if self.dm_dedup and self.dm_dedup not in DEDUP_MODES:
+            logging.warning(f'弹幕去重模式{self.dm_dedup}设置错误，此功能将不会生效.')
+            self.dm_dedup = None
+        # 表情弹幕：~（丢弃），text（写入表情的文字描述），image（下载表情图片并写入图片弹幕，只有python渲染器支持）
+        self.dm_emoticon = self.advanced_dm_args.get('dm_emoticon')
+        if self.dm_emoticon and self.dm_emoticon not in ['text', 'image']:
+            logging.warning(f'表情弹幕设置{self.dm_emoticon}错误，此功能将不会生效.')
+            self.dm_emoticon = None
+        self.emoticons = None
+        if self.dm_emoticon == 'image':
+            from .emoticon import EmoticonFetcher
+            self.emoticons = EmoticonFetcher.get(self.advanced_dm_args.get('dm_emoticon_cache', '.temp/emoticons'))
+        self.dm_filter = DanmakuFilter(
+            dm_filter,
+            users=self.advanced_dm_args.get('dm_filter_users'),
+            uids=self.advanced_dm_args.get('dm_filter_uids'),
+            rule_file=self.advanced_dm_args.get('dm_filter_file'),
+        )
         self.kwargs = kwargs
 
         self.part = 0
@@ -48,20 +86,64 @@ class DanmakuWriter():
         if platform.system()=='Windows':
             asyncio.set_event_loop_policy(asyncio.WindowsSelectorEventLoopPolicy())
         
-        if dm_format == 'ass':
-            from .asswriter import AssWriter
-            self.dmwriter = AssWriter(**self.kwargs)
-        else:
-            raise NotImplementedError(f"unsupported danmaku format {dm_format}")
+        # 同一份弹幕同时写入所有设置的格式
+        self.dm_fsync = self.advanced_dm_args.get('dm_fsync', 'never')
+        if self.dm_fsync not in ['never', 'flush', 'close']:
+            logging.warning(f'弹幕文件同步设置{self.dm_fsync}错误，将使用默认设置never.')
+            self.dm_fsync = 'never'
+        self.dmwriter = DanmakuSinks(
+            self.dm_format,
+            flush_size=int(self.advanced_dm_args.get('dm_flush_size', 64*1024)),
+            flush_interval=float(self.advanced_dm_args.get('dm_flush_interval', 1)),
+            fsync=self.dm_fsync,
+            font_file=self.advanced_dm_args.get('dm_font_file'),
+            **self.kwargs,
+        )
+
+        self.journal = None
+        if self.dm_journal:
+            from .journal import JournalWriter
+            self.journal = JournalWriter()
+
+        self.dedup = None
+        if self.dm_dedup:
+            self.dedup = DanmakuDeduplicator(
+                self.dm_dedup,
+                window=self.advanced_dm_args.get('dm_dedup_window', 10),
+                threshold=self.advanced_dm_args.get('dm_dedup_threshold', 2),
+            )
+
+    @staticmethod
+    def journal_name(dm_file:str) -> str:
+        return splitext(dm_file)[0] + '.dmj'
+
+    def output_files(self, dm_file:str) -> list:
+        """分段对应的全部弹幕输出文件（所有格式的弹幕文件和弹幕日志）"""
+        files = self.dmwriter.filenames(dm_file)
+        if self.journal:
+            files.append(self.journal_name(dm_file))
+        return files
 
     def time_fix(self, time_error):
         self.part_start_time -= time_error
+        self.part_start_mono -= time_error
+
+    def part_time(self, mono:float=None) -> float:
+        """
+        计算单调时钟时间mono（默认为当前时间）在当前分段中的弹幕时间
+        """
+        if mono is None:
+            mono = time.monotonic()
+        return mono - self.part_start_mono - self.dm_delay_fixed
 
     def start(self, self_segment=False):
         self.start_time = datetime.now().timestamp()
         self.part_start_time = self.start_time
+        self.part_start_mono = time.monotonic()
         self.dm_file = self.output.replace(f'%03d','%03d'%self.part)
         self.dmwriter.open(self.dm_file)
+        if self.journal:
+            self.journal.open(self.journal_name(self.dm_file))
 
         def monitor():
             while not self.stoped:
@@ -74,122 +156,246 @@ class DanmakuWriter():
         
         return self.start_dmc()
     
+    def write_folded(self, tic:float, flush:bool=False):
+        if not self.dedup:
+            return
+        for danmu in self.dedup.expire(tic, flush=flush):
+            self.dmwriter.add(danmu)
+
     def split(self, filename=None):
+        self.write_folded(self.part_time(), flush=True)
         self.part += 1
         self.part_start_time = datetime.now().timestamp()
+        self.part_start_mono = time.monotonic()
         # self.dmwriter.close()
         old_dm_file = self.dm_file
         if not self.stoped:
             new_dm_file = self.output.replace(f'%03d','%03d'%self.part)
             logging.debug(f'New DMfile: {new_dm_file}')
+            logging.debug(f'Danmaku stats: {self.stats()}')
             self.dmwriter.open(new_dm_file)
+            if self.journal:
+                self.journal.open(self.journal_name(new_dm_file))
             self.dm_file = new_dm_file
         if filename:
-            try:
-                os.rename(old_dm_file, filename)
-            except Exception as e:
-                logging.error(e)
-                logging.error(f'弹幕 {old_dm_file} 分段失败.')
+            for src, dst in zip(self.output_files(old_dm_file), self.output_files(filename)):
+                try:
+                    os.rename(src, dst)
+                except Exception as e:
+                    logging.error(e)
+                    logging.error(f'弹幕 {src} 分段失败.')
 
     def dm_available(self, dm) -> bool:
         if dm.get('msg_type') not in ['danmaku', 'super_chat']:
-            return False
+            if not (self.dm_emoticon and dm.get('msg_type') == 'emoticon'):
+                return False
         if not dm.get('name'):
             return False
-        if self.dm_filter:
-            for dmf in self.dm_filter:
-                if dmf.search(dm.get('content', '')):
-                    return False
+        if self.dm_filter and self.dm_filter.match(dm):
+            return False
         return True
 
+    def stats(self) -> dict:
+        stats = {}
+        if self.dm_queue is not None:
+            stats['queue'] = self.dm_queue.stats()
+        if self.dedup is not None:
+            stats['dedup'] = self.dedup.stats()
+        if self.emoticons is not None:
+            stats['emoticon'] = self.emoticons.stats()
+        stats['latency'] = {k: v.stats() for k, v in self.latency.items()}
+        reconnects = {'error': 0, 'timeout': 0}
+        for source in self.sources:
+            for k, v in source.reconnects.items():
+                reconnects[k] += v
+        stats['connection'] = {
+            'reconnects': reconnects,
+            'gaps': self.reconnect_gaps.stats(),
+        }
+        if len(self.sources) > 1:
+            stats['sources'] = {source.url: source.stats() for source in self.sources}
+        return stats
+
+    def _parse_sources(self, extra_sources) -> list:
+        """解析额外的弹幕来源设置，每个来源可以是直播间地址或者包含url, delay, prefix, color的字典"""
+        sources = []
+        for src in extra_sources or []:
+            if isinstance(src, str):
+                src = {'url': src}
+            if not isinstance(src, dict) or not src.get('url'):
+                logging.warning(f'额外弹幕来源{src}设置错误，此来源将不会生效.')
+                continue
+            src = src.copy()
+            try:
+                platform, _ = split_url(src['url'])
+            except Exception:
+                logging.warning(f'额外弹幕来源{src["url"]}不是支持的直播间地址，此来源将不会生效.')
+                continue
+            if src.get('prefix') is None:
+                src['prefix'] = f'[{platform}]'
+            sources.append(src)
+        return sources
+
+    def _new_source(self, url:str, **kwargs) -> DanmakuSource:
+        return DanmakuSource(
+            url,
+            queue_size=self.dm_queue_size,
+            queue_policy=self.dm_queue_policy,
+            auto_restart=self.dm_auto_restart,
+            reconnect_delay=self.dm_reconnect_delay,
+            reconnect_max_delay=self.dm_reconnect_max_delay,
+            **kwargs,
+        )
+
     def start_dmc(self):
         async def danmu_monitor():
-            q = asyncio.Queue()
+            self.sources = [self._new_source(self.url)]
+            for src in self.dm_extra_sources:
+                self.sources.append(self._new_source(
+                    src['url'],
+                    delay=src.get('delay', 0),
+                    prefix=src.get('prefix'),
+                    color=src.get('color'),
+                ))
+            self.dm_queue = self.sources[0].queue
 
-            async def dmc_task():
-                dmc = DanmakuClient(self.url, q)
-                try:
-                    await dmc.start()
-                except asyncio.CancelledError:
-                    await dmc.stop()
-                    logging.debug('Cancel the future.')
-                except Exception as e:
-                    await dmc.stop()
-                    logging.exception(e)
+            # 多个来源时按补偿后的接收时间做k路归并，消息最多等待window秒以便其他来源中更早的消息排在前面
+            window = 0
+            if len(self.sources) > 1:
+                window = self.dm_merge_window + max(0, max(source.delay for source in self.sources))
+            heap = []
+            seq = 0
+            last_check = 0
 
-            task = asyncio.create_task(dmc_task())
-            last_dm_time = datetime.now().timestamp()
-            retry = 0
+            for source in self.sources:
+                source.connect()
 
             while not self.stoped:
-                try:
-                    dm = q.get_nowait()
-                    dm['time'] = datetime.now().timestamp() - self.part_start_time - self.dm_delay_fixed
-                    if dm['time'] > 0 and self.dm_available(dm):
-                        if dm.get('msg_type') == 'danmaku':
-                            danmu = SimpleDanmaku(
-                                time=dm['time'],
-                                dtype='danmaku',
-                                uname=dm['name'],
-                                color=dm['color'],
-                                content=dm['content']
-                            )
-                            if self.dmwriter.add(danmu):
-                                last_dm_time = datetime.now().timestamp()
-                        elif dm.get('msg_type') == 'super_chat':
-                            danmu = SimpleDanmaku(
-                                time=dm['time'],
-                                dtype='super_chat',
-                                uname=dm['name'],
-                                color=dm['color'],
-                                content=dm['content'],
-                                price = dm['price']  # 传入 price 参数
-                            )
-                            self.dmwriter.add_super_chat(danmu)
-                            last_dm_time = datetime.now().timestamp()
-                        retry = 0
-                    continue
-                except asyncio.QueueEmpty:
-                    pass
-
-                if task.done():
-                    logging.error('弹幕下载线程异常退出，正在重试...')
-                    try:
-                        logging.debug(task.result())
-                    except:
-                        logging.exception(task.exception())
-                    task.cancel()
-                    retry += 1
-                    last_dm_time = datetime.now().timestamp()
-                    await asyncio.sleep(min(15 * retry, 60))
-                    task = asyncio.create_task(dmc_task())
-                    continue
-
-                if self.dm_auto_restart and datetime.now().timestamp() - last_dm_time > self.dm_auto_restart:
-                    logging.error('获取弹幕超时，正在重试...')
-                    task.cancel()
-                    last_dm_time = datetime.now().timestamp()
-                    task = asyncio.create_task(dmc_task())
-                    continue
-
-                await asyncio.sleep(0.1)
-            task.cancel()
-            try:
-                await task
-            except asyncio.CancelledError:
-                logging.debug("DMC task cancelled.")
+                now_mono = time.monotonic()
+                for source in self.sources:
+                    q = source.queue
+                    while True:
+                        try:
+                            dm = q.get_nowait()
+                        except asyncio.QueueEmpty:
+                            break
+                        recv_mono = dm.setdefault('recv_mono', now_mono)
+                        heapq.heappush(heap, (recv_mono - source.delay, seq, source, dm))
+                        seq += 1
+
+                ready = heap and heap[0][0] <= now_mono - window
+                while heap and heap[0][0] <= now_mono - window:
+                    mono, _, source, dm = heapq.heappop(heap)
+                    self.handle(dm, mono, source)
+
+                if not ready:
+                    self.write_folded(self.part_time(now_mono - window))
+                if not ready or now_mono - last_check > 1:
+                    last_check = now_mono
+                    for source in self.sources:
+                        source.check(self.reconnect_gaps)
+                if not ready:
+                    await asyncio.sleep(0.1)
+
+            for source in self.sources:
+                await source.stop()
 
         new_loop = asyncio.new_event_loop()
         asyncio.set_event_loop(new_loop)
         asyncio.get_event_loop().run_until_complete(danmu_monitor())
 
+    def handle(self, dm:dict, mono:float, source:DanmakuSource):
+        """
+        处理一条消息，mono为补偿延迟后的接收时间（单调时钟）
+        """
+        # 弹幕时间以socket读取到数据的时间为准，不受排队时间影响
+        now_mono = time.monotonic()
+        recv_mono = dm['recv_mono']
+        recv_time = dm.get('recv_time') or datetime.now().timestamp()
+        server_time = dm.get('server_time', -1)
+        if 'decode_mono' in dm:
+            self.latency['decode'].record(dm['decode_mono'] - recv_mono)
+            self.latency['queue'].record(now_mono - dm['decode_mono'])
+        dm['time'] = self.part_time(mono)
+        emoticon = None
+        if self.dm_emoticon and dm.get('msg_type') == 'emoticon':
+            try:
+                emoticon = json.loads(dm['content'])
+            except (TypeError, ValueError):
+                return
+            dm['content'] = emoticon.get('desc') or ''
+            if self.dm_emoticon == 'text':
+                dm['msg_type'] = 'danmaku'
+        if not (dm['time'] > 0 and self.dm_available(dm)):
+            return
+        source.tag(dm)
+        if dm.get('msg_type') == 'danmaku':
+            danmu = SimpleDanmaku(
+                time=dm['time'],
+                dtype='danmaku',
+                uname=dm['name'],
+                color=dm['color'],
+                content=dm['content'],
+                recv_time=recv_time,
+                server_time=server_time,
+            )
+            self.write_folded(danmu.time)
+            if (not self.dedup or self.dedup.add(danmu)) and self.dmwriter.add(danmu):
+                self.latency['total'].record(time.monotonic() - recv_mono)
+        elif dm.get('msg_type') == 'emoticon':
+            danmu = SimpleDanmaku(
+                time=dm['time'],
+                dtype='emoticon',
+                uname=dm['name'],
+                color=dm['color'],
+                content=dm['content'],
+                recv_time=recv_time,
+                server_time=server_time,
+            )
+            image = self.emoticons.fetch(emoticon['url'])
+            ratio = emoticon['width'] / emoticon['height'] if emoticon.get('width') and emoticon.get('height') else 1
+            if self.dmwriter.add_image(danmu, image, ratio):
+                self.latency['total'].record(time.monotonic() - recv_mono)
+        elif dm.get('msg_type') == 'super_chat':
+            danmu = SimpleDanmaku(
+                time=dm['time'],
+                dtype='super_chat',
+                uname=dm['name'],
+                color=dm['color'],
+                content=dm['content'],
+                price = dm['price'],  # 传入 price 参数
+                recv_time=recv_time,
+                server_time=server_time,
+            )
+            self.dmwriter.add_super_chat(danmu)
+            self.latency['total'].record(time.monotonic() - recv_mono)
+        else:
+            return
+        if self.journal:
+            if danmu.dtype == 'emoticon':
+                # 日志中保存完整的表情信息（图片地址和大小），重新生成时可以使用图片
+                danmu = SimpleDanmaku(
+                    time=danmu.time,
+                    dtype='emoticon',
+                    uname=danmu.uname,
+                    color=danmu.color,
+                    content=json.dumps(emoticon, ensure_ascii=False),
+                    recv_time=danmu.recv_time,
+                    server_time=danmu.server_time,
+                )
+            self.journal.add(danmu)
+
     def stop(self):
         self.stoped = True
         logging.debug('danmaku writer stoped.')
+        self.dmwriter.close()
+        if self.journal:
+            self.journal.close()
         if datetime.now().timestamp() - self.part_start_time < 10: # duration < 10s
-            try:
-                os.remove(self.dm_file)
-            except Exception as e:
-                logging.debug(e)
+            for file in self.output_files(self.dm_file):
+                try:
+                    os.remove(file)
+                except Exception as e:
+                    logging.debug(e)
         return True
 
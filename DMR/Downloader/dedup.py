@@ -0,0 +1,96 @@
+import re
+import threading
+from collections import deque
+from DMR.danmaku import SimpleDanmaku
+
+__all__ = ['DanmakuDeduplicator', 'DEDUP_MODES']
+
+DEDUP_MODES = ['fold', 'thin']
+
+class DanmakuDeduplicator():
+    """
+    重复弹幕去重器，统计时间窗口内内容相同的弹幕，超过阈值的重复弹幕不再写入
+    mode:
+        fold: 窗口结束时将被去除的重复弹幕合并为一条“内容×N”的弹幕，N只统计被去除的弹幕，不包括已经写入的前threshold条
+        thin: 直接丢弃被去除的重复弹幕
+    window: 时间窗口（秒），从第一次出现开始计时
+    threshold: 每个窗口内允许写入的相同弹幕数量
+    """
+    # 连续重复的字符视为相同内容，例如“哈哈哈哈”和“哈哈哈”
+    _squash = re.compile(r'(.)\1{2,}')
+
+    def __init__(self, mode:str='fold', window:float=10, threshold:int=2) -> None:
+        if mode not in DEDUP_MODES:
+            raise ValueError(f'unsupported dedup mode {mode}')
+        self.mode = mode
+        self.window = float(window)
+        self.threshold = max(int(threshold), 1)
+
+        self._lock = threading.Lock()
+        self._entries = {}      # key -> [窗口开始时间, 出现次数, 第一条弹幕]
+        self._order = deque()   # (窗口开始时间, key)，按开始时间排序
+        self.received = 0
+        self.suppressed = 0
+        self.folded = 0
+
+    def _key(self, content:str) -> str:
+        return self._squash.sub(r'\1\1\1', content.strip().lower())
+
+    def add(self, danmu:SimpleDanmaku) -> bool:
+        """
+        记录一条弹幕，返回True表示这条弹幕应该被写入
+        调用前应该先调用expire清理已经结束的窗口
+        """
+        key = self._key(danmu.content)
+        with self._lock:
+            self.received += 1
+            entry = self._entries.get(key)
+            if entry is None:
+                self._entries[key] = [danmu.time, 1, danmu]
+                self._order.append((danmu.time, key))
+                return True
+            entry[1] += 1
+            if entry[1] <= self.threshold:
+                return True
+            self.suppressed += 1
+            return False
+
+    def expire(self, tic:float, flush:bool=False) -> list:
+        """
+        结束所有在tic之前到期的窗口（flush=True时结束全部窗口）
+        fold模式下返回需要补充写入的合并弹幕
+        """
+        folded = []
+        with self._lock:
+            order, entries = self._order, self._entries
+            while order and (flush or order[0][0] + self.window <= tic):
+                start, key = order.popleft()
+                _, cnt, danmu = entries.pop(key)
+                dropped = cnt - self.threshold
+                if self.mode == 'fold' and dropped > 0:
+                    folded.append(SimpleDanmaku(
+                        time=min(tic, start + self.window),
+                        dtype=danmu.dtype,
+                        uname=danmu.uname,
+                        color=danmu.color,
+                        content=f'{danmu.content}×{dropped}',
+                    ))
+            self.folded += len(folded)
+        return folded
+
+    def stats(self) -> dict:
+        """
+        written: 实际写入的弹幕数量（包括合并弹幕）
+        saved: 比不去重时少写入的弹幕数量
+        reduction: 写入（渲染）弹幕数量的减少比例
+        """
+        saved = self.suppressed - self.folded
+        return {
+            'mode': self.mode,
+            'received': self.received,
+            'suppressed': self.suppressed,
+            'folded': self.folded,
+            'written': self.received - saved,
+            'saved': saved,
+            'reduction': round(saved / self.received, 4) if self.received else 0.,
+        }
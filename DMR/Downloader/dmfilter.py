@@ -0,0 +1,183 @@
+import logging
+import os
+import re
+import time
+import threading
+from collections import deque
+
+__all__ = ['KeywordAutomaton', 'DanmakuFilter']
+
+_REGEX_CHARS = set('.^$*+?{}[]\\|()')
+# 数字反向引用（\1）和命名反向引用（(?P=name)）
+_BACKREF = re.compile(r'\\[1-9]|\(\?P=')
+
+class KeywordAutomaton():
+    """
+    Aho-Corasick自动机，一次扫描即可判断文本中是否包含任意一个关键词
+    """
+    def __init__(self, keywords) -> None:
+        self._goto = [{}]
+        self._fail = [0]
+        self._out = [False]
+        self.size = 0
+        for kw in keywords:
+            self._insert(kw)
+        self._build()
+
+    def _insert(self, keyword:str):
+        if not keyword:
+            return
+        state = 0
+        for ch in keyword:
+            nxt = self._goto[state].get(ch)
+            if nxt is None:
+                nxt = len(self._goto)
+                self._goto.append({})
+                self._fail.append(0)
+                self._out.append(False)
+                self._goto[state][ch] = nxt
+            state = nxt
+        self._out[state] = True
+        self.size += 1
+
+    def _build(self):
+        goto, fail, out = self._goto, self._fail, self._out
+        q = deque(goto[0].values())
+        while q:
+            state = q.popleft()
+            for ch, nxt in goto[state].items():
+                q.append(nxt)
+                f = fail[state]
+                while f and ch not in goto[f]:
+                    f = fail[f]
+                fail[nxt] = goto[f].get(ch, 0)
+                out[nxt] = out[nxt] or out[fail[nxt]]
+
+    def search(self, text:str) -> bool:
+        goto, fail, out = self._goto, self._fail, self._out
+        state = 0
+        for ch in text:
+            while state and ch not in goto[state]:
+                state = fail[state]
+            state = goto[state].get(ch, 0)
+            if out[state]:
+                return True
+        return False
+
+    def __bool__(self):
+        return self.size > 0
+
+class DanmakuFilter():
+    """
+    弹幕过滤器，满足以下任意条件的弹幕将被过滤：
+    1. 内容包含任意一个关键词（使用Aho-Corasick自动机匹配）
+    2. 内容符合任意一个正则表达式（合并为一个正则表达式匹配）
+    3. 用户名或者用户uid在屏蔽列表中
+    规则文件中每行一条规则，以 user: 或者 uid: 开头的规则表示屏蔽用户，以 # 开头的行将被忽略
+    规则文件修改后会自动重新加载
+    """
+    def __init__(self, rules=None, users=None, uids=None, rule_file:str=None, reload_interval:float=5) -> None:
+        self.rules = self._as_list(rules)
+        self.users = self._as_list(users)
+        self.uids = self._as_list(uids)
+        self.rule_file = rule_file
+        self.reload_interval = reload_interval
+
+        self._lock = threading.Lock()
+        self._file_mtime = None
+        self._last_check = 0
+        self._compile(self.rules, self.users, self.uids)
+        if self.rule_file:
+            self.reload()
+
+    @staticmethod
+    def _as_list(x) -> list:
+        if not x:
+            return []
+        if isinstance(x, (str, int)):
+            return [str(x)]
+        return [str(i) for i in x]
+
+    def _compile(self, rules, users, uids):
+        keywords, regexes = [], []
+        for rule in rules:
+            if _REGEX_CHARS.isdisjoint(rule):
+                keywords.append(rule)
+                continue
+            try:
+                re.compile(rule)
+                regexes.append(rule)
+            except re.error as e:
+                logging.warning(f'弹幕屏蔽词{rule}设置错误:{e}，此规则将不会生效.')
+
+        automaton = KeywordAutomaton(keywords)
+        # 含有反向引用的正则表达式合并后组号会改变，需要单独匹配
+        merged = [r for r in regexes if not _BACKREF.search(r)]
+        regex = [re.compile(r) for r in regexes if _BACKREF.search(r)]
+        if merged:
+            try:
+                regex.insert(0, re.compile('|'.join(f'(?:{r})' for r in merged)))
+            except re.error:
+                regex += [re.compile(r) for r in merged]
+
+        with self._lock:
+            self._automaton = automaton
+            self._regex = regex
+            self._users = set(users)
+            self._uids = set(uids)
+
+    def reload(self):
+        """重新读取规则文件（文件未修改时不做任何操作）"""
+        self._last_check = time.time()
+        try:
+            mtime = os.path.getmtime(self.rule_file)
+        except OSError as e:
+            logging.debug(f'弹幕屏蔽规则文件读取失败: {e}')
+            return
+        if mtime == self._file_mtime:
+            return
+        self._file_mtime = mtime
+
+        rules, users, uids = self.rules.copy(), self.users.copy(), self.uids.copy()
+        try:
+            with open(self.rule_file, 'r', encoding='utf-8') as f:
+                for line in f:
+                    line = line.strip()
+                    if not line or line.startswith('#'):
+                        continue
+                    if line.startswith('user:'):
+                        users.append(line[5:].strip())
+                    elif line.startswith('uid:'):
+                        uids.append(line[4:].strip())
+                    else:
+                        rules.append(line)
+        except (OSError, UnicodeDecodeError) as e:
+            # 文件编码不是UTF-8（例如GBK）或者读取时被删除，继续使用之前的规则
+            logging.warning(f'弹幕屏蔽规则文件 {self.rule_file} 读取失败，将继续使用之前的规则（请使用UTF-8编码保存）: {e}')
+            return
+        self._compile(rules, users, uids)
+        logging.info(f'已加载弹幕屏蔽规则文件 {self.rule_file}.')
+
+    def match(self, dm:dict) -> bool:
+        """返回True表示弹幕应该被过滤"""
+        if self.rule_file and time.time() - self._last_check > self.reload_interval:
+            self.reload()
+
+        with self._lock:
+            automaton, regex, users, uids = self._automaton, self._regex, self._users, self._uids
+        if users and dm.get('name') in users:
+            return True
+        if uids and str(dm.get('uid')) in uids:
+            return True
+        content = dm.get('content', '')
+        if not isinstance(content, str):
+            return False
+        if automaton and automaton.search(content):
+            return True
+        for r in regex:
+            if r.search(content):
+                return True
+        return False
+
+    def __bool__(self):
+        return bool(self.rules or self.users or self.uids or self.rule_file)
@@ -0,0 +1,89 @@
+import asyncio
+from collections import deque
+
+__all__ = ['DanmakuQueue', 'QUEUE_POLICIES']
+
+QUEUE_POLICIES = ['block', 'drop_oldest', 'drop_type']
+
+class DanmakuQueue(asyncio.Queue):
+    """
+    有界弹幕队列，队列满时按照指定策略处理新消息
+    policy:
+        block: 阻塞写入方（即暂停读取websocket，直到队列有空位）
+        drop_oldest: 丢弃队列中最早的消息
+        drop_type: 优先丢弃非弹幕消息（进场、礼物等），没有可丢弃的非弹幕消息时丢弃最早的弹幕
+    """
+    PRIORITY_TYPES = ('danmaku', 'super_chat')
+
+    def __init__(self, maxsize:int=0, policy:str='block') -> None:
+        if policy not in QUEUE_POLICIES:
+            raise ValueError(f'unsupported queue policy {policy}')
+        self.policy = policy
+        self.dropped = {}
+        self.high_water = 0
+        super().__init__(maxsize)
+
+    def _init(self, maxsize):
+        # 弹幕和其他消息分开存放，这样按类型丢弃时不需要遍历队列
+        self._queue = deque()
+        self._low = deque()
+
+    def _is_priority(self, item) -> bool:
+        return self.policy != 'drop_type' or item.get('msg_type') in self.PRIORITY_TYPES
+
+    def _put(self, item):
+        if self._is_priority(item):
+            self._queue.append(item)
+        else:
+            self._low.append(item)
+        size = self.qsize()
+        if size > self.high_water:
+            self.high_water = size
+
+    def _get(self):
+        if self._queue:
+            return self._queue.popleft()
+        return self._low.popleft()
+
+    def _drop(self, item):
+        msg_type = item.get('msg_type', 'other')
+        self.dropped[msg_type] = self.dropped.get(msg_type, 0) + 1
+
+    def _evict(self, item) -> bool:
+        """为新消息腾出一个位置，返回False表示应该丢弃新消息"""
+        if self.policy == 'drop_type':
+            if not self._is_priority(item):
+                return False
+            victim = self._low.popleft() if self._low else self._queue.popleft()
+        else:
+            victim = self._queue.popleft()
+        self._drop(victim)
+        self.task_done()
+        return True
+
+    def qsize(self) -> int:
+        return len(self._queue) + len(self._low)
+
+    def empty(self) -> bool:
+        return not (self._queue or self._low)
+
+    def put_nowait(self, item):
+        if self.policy != 'block' and self.full():
+            if not self._evict(item):
+                self._drop(item)
+                return
+        return super().put_nowait(item)
+
+    async def put(self, item):
+        if self.policy != 'block':
+            return self.put_nowait(item)
+        return await super().put(item)
+
+    def stats(self) -> dict:
+        return {
+            'size': self.qsize(),
+            'maxsize': self.maxsize,
+            'policy': self.policy,
+            'high_water': self.high_water,
+            'dropped': self.dropped.copy(),
+        }
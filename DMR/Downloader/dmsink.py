@@ -0,0 +1,116 @@
+import logging
+import threading
+from os.path import splitext
+from DMR.danmaku import SimpleDanmaku
+
+__all__ = ['DanmakuSinks', 'SINK_FORMATS', 'parse_formats', 'sink_filename']
+
+# 弹幕格式 -> 文件后缀
+SINK_FORMATS = {
+    'ass': '.ass',
+    'xml': '.xml',
+    'jsonl': '.jsonl',
+}
+
+def parse_formats(dm_format) -> list:
+    """
+    解析弹幕格式设置，支持单个格式、逗号分隔的字符串或者列表，例如 ass, "ass,xml", [ass, jsonl]
+    """
+    if isinstance(dm_format, (list, tuple)):
+        formats = dm_format
+    else:
+        formats = str(dm_format).split(',')
+    result = []
+    for fmt in formats:
+        fmt = str(fmt).strip().lower()
+        if not fmt or fmt in result:
+            continue
+        if fmt not in SINK_FORMATS:
+            raise NotImplementedError(f"unsupported danmaku format {fmt}")
+        result.append(fmt)
+    if not result:
+        raise NotImplementedError(f"unsupported danmaku format {dm_format}")
+    return result
+
+def sink_filename(filename:str, fmt:str) -> str:
+    return splitext(filename)[0] + SINK_FORMATS[fmt]
+
+class DanmakuSinks():
+    """
+    多格式弹幕写入器，同一条弹幕同时写入多个格式的弹幕文件
+    每个格式的写入器各自保存文件句柄，打开新文件（分段）时同时切换所有格式的文件
+    add在任意一个格式写入成功时返回True（例如ASS因为弹幕重叠而丢弃的弹幕仍会写入其他格式）
+    """
+    def __init__(self, formats:list, **kwargs) -> None:
+        self.formats = formats
+        self.sinks = {}
+        for fmt in formats:
+            if fmt == 'ass':
+                from .asswriter import AssWriter
+                self.sinks[fmt] = AssWriter(**kwargs)
+            elif fmt == 'xml':
+                from .xmlwriter import XmlWriter
+                self.sinks[fmt] = XmlWriter(**kwargs)
+            elif fmt == 'jsonl':
+                from .jsonlwriter import JsonlWriter
+                self.sinks[fmt] = JsonlWriter(**kwargs)
+        self._lock = threading.Lock()
+        self._opened = False
+
+    def filenames(self, filename:str) -> list:
+        return [sink_filename(filename, fmt) for fmt in self.formats]
+
+    def open(self, filename):
+        with self._lock:
+            for fmt, sink in self.sinks.items():
+                sink.open(sink_filename(filename, fmt))
+            self._opened = True
+
+    def add(self, danmu:SimpleDanmaku) -> bool:
+        with self._lock:
+            if not self._opened:
+                return False
+            ret = False
+            for fmt in self.formats:
+                try:
+                    ret = bool(self.sinks[fmt].add(danmu)) or ret
+                except Exception as e:
+                    logging.debug(f'{fmt}弹幕写入失败: {e}')
+            return ret
+
+    def add_image(self, danmu:SimpleDanmaku, image:str, ratio:float=1) -> bool:
+        """
+        添加图片弹幕，支持图片的格式写入图片，其他格式写入弹幕的文字内容（表情的描述）
+        """
+        with self._lock:
+            if not self._opened:
+                return False
+            ret = False
+            for fmt in self.formats:
+                sink = self.sinks[fmt]
+                try:
+                    if hasattr(sink, 'add_image'):
+                        ret = bool(sink.add_image(danmu, image, ratio)) or ret
+                    else:
+                        ret = bool(sink.add(danmu)) or ret
+                except Exception as e:
+                    logging.debug(f'{fmt}弹幕写入失败: {e}')
+            return ret
+
+    def add_super_chat(self, super_chat:SimpleDanmaku):
+        with self._lock:
+            if not self._opened:
+                return
+            for fmt in self.formats:
+                try:
+                    self.sinks[fmt].add_super_chat(super_chat)
+                except Exception as e:
+                    logging.debug(f'{fmt}弹幕写入失败: {e}')
+
+    def close(self):
+        with self._lock:
+            if not self._opened:
+                return
+            self._opened = False
+            for sink in self.sinks.values():
+                sink.close()
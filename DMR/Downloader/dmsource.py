@@ -0,0 +1,133 @@
+import asyncio
+import logging
+import random
+import time
+
+from DMR.LiveAPI.danmaku import DanmakuClient
+from DMR.LiveAPI.utils import split_url
+from .dmqueue import DanmakuQueue
+
+__all__ = ['DanmakuSource']
+
+class DanmakuSource():
+    """
+    弹幕来源，负责一个直播间的弹幕连接、断线检测和重连，收到的消息放入自己的队列
+    delay: 这个直播间的弹幕相对于录制的视频慢多少秒，合并弹幕时用于补偿
+    prefix: 写入弹幕时在内容前面加上的标记，例如“[斗鱼]”
+    color: 写入弹幕时使用的颜色（RGB），为空时保持原有颜色
+    """
+    def __init__(self,
+                 url:str,
+                 queue_size:int=10000,
+                 queue_policy:str='drop_type',
+                 delay:float=0,
+                 prefix:str='',
+                 color:str=None,
+                 auto_restart:float=120,
+                 reconnect_delay:float=2,
+                 reconnect_max_delay:float=60,
+                 ) -> None:
+        self.url = url
+        self.plat, self.rid = split_url(url)
+        self.queue = DanmakuQueue(queue_size, queue_policy)
+        self.delay = float(delay or 0)
+        self.prefix = prefix or ''
+        self.color = color
+        self.auto_restart = auto_restart
+        self.reconnect_delay = reconnect_delay
+        self.reconnect_max_delay = reconnect_max_delay
+
+        self.dmc = None
+        self.task = None
+        self.retry = 0
+        self.gap_start = None
+        self.next_connect = 0
+        self.reconnects = {'error': 0, 'timeout': 0}
+
+    async def _run(self):
+        self.dmc = dmc = DanmakuClient(self.url, self.queue)
+        try:
+            await dmc.start()
+        except asyncio.CancelledError:
+            await dmc.stop()
+            logging.debug('Cancel the future.')
+        except Exception as e:
+            await dmc.stop()
+            logging.exception(e)
+
+    def connect(self):
+        self.dmc = None
+        self.task = asyncio.create_task(self._run())
+
+    def backoff(self) -> float:
+        """指数退避，并加入随机抖动避免多个房间同时重连"""
+        backoff = min(self.reconnect_max_delay, self.reconnect_delay * 2 ** min(self.retry, 16))
+        return backoff / 2 + random.uniform(0, backoff / 2)
+
+    def check(self, gaps=None) -> bool:
+        """
+        检查连接状态，连接异常时安排重连（不会阻塞），返回连接是否正常
+        gaps: 记录断线空白时长的直方图
+        """
+        now = time.monotonic()
+        if self.task is None:
+            if now >= self.next_connect:
+                self.connect()
+            return False
+
+        dmc = self.dmc
+        if dmc is not None and dmc.first_active is not None:
+            # 新连接收到了数据，重置退避次数并记录断线空白时长
+            self.retry = 0
+            if self.gap_start is not None:
+                if gaps is not None:
+                    gaps.record(dmc.first_active - self.gap_start)
+                self.gap_start = None
+
+        reason = None
+        if self.task.done():
+            logging.error(f'弹幕下载线程异常退出，正在重试... ({self.url})')
+            try:
+                logging.debug(self.task.result())
+            except:
+                logging.exception(self.task.exception())
+            reason = 'error'
+        elif self.auto_restart and dmc is not None and now - dmc.last_active > self.auto_restart:
+            # 以websocket层面的数据（包括心跳回复）判断连接是否存活，而不是弹幕写入时间
+            logging.error(f'弹幕连接超过{self.auto_restart}秒没有收到数据，正在重试... ({self.url})')
+            reason = 'timeout'
+
+        if reason is None:
+            return True
+        self.task.cancel()
+        self.task = None
+        self.reconnects[reason] += 1
+        if self.gap_start is None and dmc is not None:
+            self.gap_start = dmc.last_active
+        delay = self.backoff()
+        self.retry += 1
+        self.next_connect = now + delay
+        logging.debug(f'弹幕将在{delay:.1f}秒后重连（第{self.retry}次）.')
+        return False
+
+    def tag(self, dm:dict):
+        if self.prefix:
+            dm['content'] = f"{self.prefix}{dm.get('content', '')}"
+        if self.color:
+            dm['color'] = self.color
+
+    async def stop(self):
+        if self.task is None:
+            return
+        self.task.cancel()
+        try:
+            await self.task
+        except asyncio.CancelledError:
+            logging.debug("DMC task cancelled.")
+        self.task = None
+
+    def stats(self) -> dict:
+        return {
+            'queue': self.queue.stats(),
+            'reconnects': self.reconnects.copy(),
+        }
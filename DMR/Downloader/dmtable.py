@@ -0,0 +1,178 @@
+import json
+import os
+import struct
+from array import array
+from os.path import exists, getmtime, splitext
+
+import numpy as np
+
+from DMR.danmaku import SimpleDanmaku
+from .journal import DTYPES, read_journal
+
+__all__ = ['DanmakuTable']
+
+MAGIC = b'DMT2'
+_HEADER = struct.Struct('<I')
+_ALIGN = 8
+_DTYPE_CODES = {dtype: code for code, dtype in enumerate(DTYPES)}
+
+class DanmakuTable():
+    """
+    列式弹幕表，用于批量处理（重新排版、统计等）大量弹幕
+    每条弹幕是结构化数组中的一行，用户名和颜色保存为去重列表的下标，弹幕内容保存在一段连续的UTF-8字节中
+    可以保存为二进制文件（.dmt），读取时使用内存映射，不会把整个文件读入内存
+    """
+    RECORD = np.dtype([
+        ('time', '<f8'),
+        ('recv_time', '<f8'),
+        ('server_time', '<f8'),
+        ('price', '<f8'),
+        ('dtype', 'u1'),
+        ('uname', '<i4'),
+        ('color', '<i4'),
+        ('offset', '<i8'),
+        ('length', '<i4'),
+    ])
+
+    def __init__(self, records:np.ndarray, blob:np.ndarray, names:list, colors:list) -> None:
+        self.records = records
+        self.blob = blob
+        self.names = names
+        self.colors = colors
+
+    @staticmethod
+    def sidecar_name(filename:str) -> str:
+        return splitext(filename)[0] + '.dmt'
+
+    @classmethod
+    def from_danmakus(cls, danmakus) -> 'DanmakuTable':
+        """由SimpleDanmaku的可迭代对象生成弹幕表"""
+        cols = {name: array(code) for name, code in (
+            ('time', 'd'), ('recv_time', 'd'), ('server_time', 'd'), ('price', 'd'),
+            ('dtype', 'B'), ('uname', 'i'), ('color', 'i'), ('offset', 'q'), ('length', 'i'),
+        )}
+        blob = bytearray()
+        names, colors = {}, {}
+        for danmu in danmakus:
+            content = str(danmu.content if danmu.content is not None else '').encode('utf-8')
+            cols['time'].append(danmu.time)
+            cols['recv_time'].append(danmu.recv_time)
+            cols['server_time'].append(danmu.server_time)
+            cols['price'].append(float(danmu.price or 0))
+            cols['dtype'].append(_DTYPE_CODES.get(danmu.dtype, _DTYPE_CODES['other']))
+            cols['uname'].append(names.setdefault(danmu.uname or '', len(names)))
+            cols['color'].append(colors.setdefault(danmu.color or 'ffffff', len(colors)))
+            cols['offset'].append(len(blob))
+            cols['length'].append(len(content))
+            blob += content
+
+        records = np.empty(len(cols['time']), dtype=cls.RECORD)
+        for name, col in cols.items():
+            records[name] = np.frombuffer(col, dtype=col.typecode) if len(col) else 0
+        return cls(records, np.frombuffer(bytes(blob), dtype=np.uint8), list(names), list(colors))
+
+    @classmethod
+    def from_journal(cls, filename:str) -> 'DanmakuTable':
+        return cls.from_danmakus(read_journal(filename))
+
+    @classmethod
+    def open(cls, journal:str) -> 'DanmakuTable':
+        """
+        读取弹幕日志对应的弹幕表，优先使用已有的.dmt文件（比日志新时），否则由日志生成并保存
+        """
+        sidecar = cls.sidecar_name(journal)
+        if exists(sidecar) and getmtime(sidecar) >= getmtime(journal):
+            try:
+                return cls.load(sidecar)
+            except ValueError:
+                pass
+        table = cls.from_journal(journal)
+        table.save(sidecar)
+        return table
+
+    def save(self, filename:str):
+        """
+        保存为二进制文件：MAGIC，JSON头的长度和内容，按8字节对齐的记录数组，弹幕内容
+        """
+        header = {
+            'count': len(self.records),
+            'names': self.names,
+            'colors': self.colors,
+            'blob_size': int(self.blob.nbytes),
+        }
+        data = json.dumps(header, ensure_ascii=False).encode('utf-8')
+        pos = len(MAGIC) + _HEADER.size + len(data)
+        pad = -pos % _ALIGN
+        records = np.ascontiguousarray(self.records, dtype=self.RECORD)
+        tmp = filename + '.tmp'
+        with open(tmp, 'wb') as f:
+            f.write(MAGIC)
+            f.write(_HEADER.pack(len(data)))
+            f.write(data)
+            f.write(b'\0' * pad)
+            f.write(records.tobytes())
+            f.write(self.blob.tobytes())
+        os.replace(tmp, filename)
+
+    @classmethod
+    def load(cls, filename:str, mmap:bool=True) -> 'DanmakuTable':
+        with open(filename, 'rb') as f:
+            if f.read(len(MAGIC)) != MAGIC:
+                raise ValueError(f'{filename} is not a danmaku table.')
+            size, = _HEADER.unpack(f.read(_HEADER.size))
+            header = json.loads(f.read(size).decode('utf-8'))
+        offset = len(MAGIC) + _HEADER.size + size
+        offset += -offset % _ALIGN
+        count, blob_size = header['count'], header['blob_size']
+        blob_offset = offset + count * cls.RECORD.itemsize
+        if os.path.getsize(filename) < blob_offset + blob_size:
+            raise ValueError(f'{filename} is truncated.')
+
+        if mmap:
+            records = np.memmap(filename, dtype=cls.RECORD, mode='r', offset=offset, shape=(count,)) if count else np.empty(0, cls.RECORD)
+            blob = np.memmap(filename, dtype=np.uint8, mode='r', offset=blob_offset, shape=(blob_size,)) if blob_size else np.empty(0, np.uint8)
+        else:
+            with open(filename, 'rb') as f:
+                f.seek(offset)
+                records = np.fromfile(f, dtype=cls.RECORD, count=count)
+                blob = np.fromfile(f, dtype=np.uint8, count=blob_size)
+        return cls(records, blob, header['names'], header['colors'])
+
+    def __len__(self):
+        return len(self.records)
+
+    def content(self, i:int) -> str:
+        offset, length = int(self.records['offset'][i]), int(self.records['length'][i])
+        return self.blob[offset:offset+length].tobytes().decode('utf-8', errors='ignore')
+
+    def contents(self) -> list:
+        data = self.blob.tobytes()
+        offsets, lengths = self.records['offset'].tolist(), self.records['length'].tolist()
+        return [data[o:o+n].decode('utf-8', errors='ignore') for o, n in zip(offsets, lengths)]
+
+    def select(self, index) -> 'DanmakuTable':
+        """按下标、切片或者布尔数组选取部分弹幕，弹幕内容和去重列表与原表共用"""
+        return DanmakuTable(self.records[index], self.blob, self.names, self.colors)
+
+    def sort(self) -> 'DanmakuTable':
+        return self.select(np.argsort(self.records['time'], kind='stable'))
+
+    def __getitem__(self, i):
+        if not isinstance(i, (int, np.integer)):
+            return self.select(i)
+        r = self.records[i]
+        code = int(r['dtype'])
+        return SimpleDanmaku(
+            time=float(r['time']),
+            dtype=DTYPES[code] if code < len(DTYPES) else 'other',
+            uname=self.names[int(r['uname'])],
+            color=self.colors[int(r['color'])],
+            content=self.content(i),
+            price=float(r['price']),
+            recv_time=float(r['recv_time']),
+            server_time=float(r['server_time']),
+        )
+
+    def __iter__(self):
+        for i in range(len(self)):
+            yield self[i]
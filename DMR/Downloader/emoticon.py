@@ -0,0 +1,123 @@
+import asyncio
+import hashlib
+import logging
+import os
+import threading
+import time
+from os.path import exists, join, splitext
+from urllib.parse import urlparse
+
+import aiohttp
+
+__all__ = ['EmoticonFetcher']
+
+class EmoticonFetcher():
+    """
+    表情图片下载器，图片按URL的哈希保存在缓存文件夹中，同一个表情只会下载一次（所有直播间和分段共用）
+    下载在后台线程的事件循环中使用aiohttp异步进行（共用一个连接池，最多同时下载max_workers个），
+    fetch会立即返回图片的保存路径，不会阻塞弹幕的接收，渲染时再读取图片
+    """
+    headers = {
+        'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/110.0.0.0 Safari/537.36',
+    }
+    # 下载失败后重试的间隔（秒）
+    retry_interval = 60
+
+    _instances = {}
+    _instances_lock = threading.Lock()
+
+    def __init__(self, cache_dir:str='.temp/emoticons', max_workers:int=4, timeout:float=10) -> None:
+        self.cache_dir = os.path.abspath(cache_dir)
+        self.timeout = timeout
+        os.makedirs(self.cache_dir, exist_ok=True)
+
+        self.max_workers = max_workers
+        self._lock = threading.Lock()
+        self._loop = None
+        self._session = None
+        self._semaphore = None
+        self._pending = {}  # 保存路径 -> Future
+        self._failed = {}   # URL -> 上次失败的时间
+        self.hits = 0
+        self.downloaded = 0
+        self.failed = 0
+
+    @classmethod
+    def get(cls, cache_dir:str='.temp/emoticons') -> 'EmoticonFetcher':
+        """获取指定缓存文件夹的下载器，同一个进程中的所有直播间共用"""
+        key = os.path.abspath(cache_dir)
+        with cls._instances_lock:
+            if key not in cls._instances:
+                cls._instances[key] = cls(key)
+            return cls._instances[key]
+
+    def path(self, url:str) -> str:
+        digest = hashlib.sha1(url.encode('utf-8')).hexdigest()
+        ext = splitext(urlparse(url).path)[1] or '.png'
+        return join(self.cache_dir, digest[:2], digest + ext)
+
+    def fetch(self, url:str) -> str:
+        """返回表情图片的保存路径，图片不存在时在后台下载"""
+        path = self.path(url)
+        with self._lock:
+            if path in self._pending or exists(path):
+                self.hits += 1
+                return path
+            if time.time() - self._failed.get(url, 0) < self.retry_interval:
+                return path
+            future = asyncio.run_coroutine_threadsafe(self._download(url, path), self._get_loop())
+            self._pending[path] = future
+        future.add_done_callback(lambda _: self._done(path))
+        return path
+
+    def _done(self, path:str):
+        with self._lock:
+            self._pending.pop(path, None)
+
+    def _get_loop(self) -> asyncio.AbstractEventLoop:
+        """第一次下载时启动后台事件循环"""
+        if self._loop is None:
+            self._loop = asyncio.new_event_loop()
+            threading.Thread(target=self._loop.run_forever, name='emoticon', daemon=True).start()
+        return self._loop
+
+    async def _download(self, url:str, path:str):
+        if self._session is None:
+            self._semaphore = asyncio.Semaphore(self.max_workers)
+            self._session = aiohttp.ClientSession(headers=self.headers, timeout=aiohttp.ClientTimeout(total=self.timeout))
+        try:
+            async with self._semaphore:
+                async with self._session.get(url) as resp:
+                    resp.raise_for_status()
+                    content = await resp.read()
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            tmp = path + '.tmp'
+            with open(tmp, 'wb') as f:
+                f.write(content)
+            os.replace(tmp, path)
+            with self._lock:
+                self.downloaded += 1
+                self._failed.pop(url, None)
+        except Exception as e:
+            logging.debug(f'表情 {url} 下载失败: {e}')
+            with self._lock:
+                self.failed += 1
+                self._failed[url] = time.time()
+
+    def wait(self, timeout:float=None):
+        """等待当前所有下载完成"""
+        with self._lock:
+            futures = list(self._pending.values())
+        for future in futures:
+            try:
+                future.result(timeout=timeout)
+            except Exception:
+                pass
+
+    def stats(self) -> dict:
+        return {
+            'hits': self.hits,
+            'downloaded': self.downloaded,
+            'failed': self.failed,
+            'pending': len(self._pending),
+        }
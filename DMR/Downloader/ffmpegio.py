@@ -30,6 +30,7 @@ class FFmpegDownloader():
                  debug=False,
                  header:dict=None,
                  segment_callback=None,
+                 segment_start_callback=None,
                  stable_callback=None,
                  advanced_video_args:dict=None,
                  **kwargs):
@@ -42,6 +43,7 @@ class FFmpegDownloader():
         self.taskname = taskname
         self.url = url
         self.segment_callback = segment_callback
+        self.segment_start_callback = segment_start_callback
         self.stable_callback = stable_callback
         self.advanced_video_args = advanced_video_args if advanced_video_args else {}
         self.kwargs = kwargs
@@ -207,6 +209,8 @@ class FFmpegDownloader():
                     if self.thisfile:
                         self.segment_callback(self.thisfile)
                     self.thisfile = fname
+                    if self.segment_start_callback:
+                        self.segment_start_callback(fname)
 
             if 'dropping it' in line or 'Invalid NAL unit size' in line:
                 raise RuntimeError(f'{self.taskname} 直播流读取错误, 即将重试, 如果此问题多次出现请反馈.')
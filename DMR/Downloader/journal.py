@@ -0,0 +1,173 @@
+import json
+import struct
+import threading
+from DMR.danmaku import SimpleDanmaku
+
+__all__ = ['JournalWriter', 'read_journal', 'replay_journal', 'journal2ass']
+
+MAGIC = b'DMJ2'
+# 记录头：片段内时间，接收时间戳，平台时间戳，类型，价格，用户名/颜色/内容的字节长度
+_RECORD = struct.Struct('<dddBdHHH')
+# 旧版本（DMJ1）的价格为单精度浮点数
+_RECORDS = {b'DMJ1': struct.Struct('<dddBfHHH'), MAGIC: _RECORD}
+_LENGTH = struct.Struct('<I')
+
+# 新的类型只能添加在最后，已有日志中的类型编号不变
+DTYPES = ['danmaku', 'super_chat', 'gift', 'enter', 'like', 'other', 'emoticon']
+_DTYPE_CODES = {dtype: code for code, dtype in enumerate(DTYPES)}
+
+def _encode(s) -> bytes:
+    return str(s if s is not None else '').encode('utf-8')[:0xffff]
+
+class JournalWriter():
+    """
+    弹幕日志写入器，以追加的方式保存原始弹幕，用于重新生成弹幕文件
+    每条记录由4字节的长度和记录内容组成，文件以缓冲的方式写入
+    """
+    def __init__(self, bufsize:int=64*1024) -> None:
+        self.bufsize = bufsize
+        self._lock = threading.Lock()
+        self._file = None
+        self._filename = None
+
+    def open(self, filename):
+        with self._lock:
+            if self._file:
+                self._file.close()
+            self._filename = filename
+            self._file = open(filename, 'wb', buffering=self.bufsize)
+            self._file.write(MAGIC)
+
+    def add(self, danmu:SimpleDanmaku):
+        uname, color, content = _encode(danmu.uname), _encode(danmu.color), _encode(danmu.content)
+        record = _RECORD.pack(
+            danmu.time,
+            danmu.recv_time,
+            danmu.server_time,
+            _DTYPE_CODES.get(danmu.dtype, _DTYPE_CODES['other']),
+            float(danmu.price or 0),
+            len(uname), len(color), len(content),
+        ) + uname + color + content
+        with self._lock:
+            if not self._file:
+                return False
+            self._file.write(_LENGTH.pack(len(record)) + record)
+        return True
+
+    def flush(self):
+        with self._lock:
+            if self._file:
+                self._file.flush()
+
+    def close(self):
+        with self._lock:
+            if self._file:
+                self._file.close()
+            self._file = None
+
+def read_journal(filename):
+    """
+    逐条读取弹幕日志，返回SimpleDanmaku的生成器
+    文件末尾不完整的记录（例如程序异常退出）将被忽略
+    """
+    with open(filename, 'rb') as f:
+        record = _RECORDS.get(f.read(len(MAGIC)))
+        if record is None:
+            raise ValueError(f'{filename} is not a danmaku journal.')
+        while True:
+            head = f.read(_LENGTH.size)
+            if len(head) < _LENGTH.size:
+                break
+            length, = _LENGTH.unpack(head)
+            data = f.read(length)
+            if len(data) < length:
+                break
+            time, recv_time, server_time, code, price, nu, nc, nt = record.unpack_from(data)
+            p = record.size
+            uname = data[p:p+nu].decode('utf-8', errors='ignore')
+            p += nu
+            color = data[p:p+nc].decode('utf-8', errors='ignore')
+            p += nc
+            content = data[p:p+nt].decode('utf-8', errors='ignore')
+            yield SimpleDanmaku(
+                time=time,
+                dtype=DTYPES[code] if code < len(DTYPES) else 'other',
+                uname=uname,
+                color=color,
+                content=content,
+                price=price,
+                recv_time=recv_time,
+                server_time=server_time,
+            )
+
+def _emoticon_text(danmu:SimpleDanmaku):
+    """表情弹幕在日志中保存的是表情信息（JSON），返回表情信息和文字（描述）弹幕"""
+    try:
+        emoticon = json.loads(danmu.content)
+    except (TypeError, ValueError):
+        return None, None
+    if not isinstance(emoticon, dict):
+        return None, None
+    text = SimpleDanmaku(
+        time=danmu.time,
+        dtype='danmaku',
+        uname=danmu.uname,
+        color=danmu.color,
+        content=emoticon.get('desc') or '',
+        recv_time=danmu.recv_time,
+        server_time=danmu.server_time,
+    )
+    return emoticon, text
+
+def replay_journal(filename, writer, dedup=None, emoticons=None) -> int:
+    """
+    将弹幕日志中的弹幕按顺序写入指定的弹幕写入器（不按实际时间等待），返回写入的弹幕数量
+    日志中保存的是去重之前的原始弹幕，dedup为DanmakuDeduplicator时按录制时的方式重新去重（包括合并的“内容×N”弹幕）
+    表情弹幕在提供了emoticons（EmoticonFetcher）并且写入器支持图片时写入图片，否则写入表情的文字描述
+    """
+    cnt = 0
+    for danmu in read_journal(filename):
+        if dedup is not None:
+            for folded in dedup.expire(danmu.time):
+                if writer.add(folded):
+                    cnt += 1
+        if danmu.dtype == 'danmaku':
+            if (dedup is None or dedup.add(danmu)) and writer.add(danmu):
+                cnt += 1
+        elif danmu.dtype == 'emoticon':
+            emoticon, text = _emoticon_text(danmu)
+            if emoticon is None:
+                continue
+            if emoticons is not None and emoticon.get('url') and hasattr(writer, 'add_image'):
+                text.dtype = 'emoticon'
+                ratio = emoticon['width'] / emoticon['height'] if emoticon.get('width') and emoticon.get('height') else 1
+                ok = writer.add_image(text, emoticons.fetch(emoticon['url']), ratio)
+            else:
+                ok = text.content and writer.add(text)
+            if ok:
+                cnt += 1
+        elif danmu.dtype == 'super_chat' and hasattr(writer, 'add_super_chat'):
+            writer.add_super_chat(danmu)
+            cnt += 1
+    if dedup is not None:
+        for folded in dedup.expire(0, flush=True):
+            if writer.add(folded):
+                cnt += 1
+    return cnt
+
+def journal2ass(filename, output, dedup:str=None, dedup_window:float=10, dedup_threshold:int=2, **kwargs) -> int:
+    """
+    使用弹幕日志重新生成ASS弹幕文件，kwargs为AssWriter的参数（例如fontsize, dmduration, dmrate）
+    dedup为去重方式（fold/thin，与录制时的dm_dedup相同），为空时不去重
+    """
+    from .asswriter import AssWriter
+    writer = AssWriter(**kwargs)
+    writer.open(output)
+    deduplicator = None
+    if dedup:
+        from .dedup import DanmakuDeduplicator
+        deduplicator = DanmakuDeduplicator(dedup, window=dedup_window, threshold=dedup_threshold)
+    try:
+        return replay_journal(filename, writer, dedup=deduplicator)
+    finally:
+        writer.close()
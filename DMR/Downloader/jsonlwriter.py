@@ -0,0 +1,38 @@
+import json
+import threading
+from DMR.danmaku import SimpleDanmaku
+
+__all__ = ['JsonlWriter']
+
+class JsonlWriter():
+    """
+    JSONL弹幕写入器，每行一条弹幕（SimpleDanmaku.todict的结果），用于弹幕统计分析
+    """
+    def __init__(self, bufsize:int=64*1024, **kwargs) -> None:
+        self.bufsize = bufsize
+        self.kwargs = kwargs
+        self._lock = threading.Lock()
+        self._file = None
+
+    def open(self, filename):
+        with self._lock:
+            if self._file:
+                self._file.close()
+            self._file = open(filename, 'w', encoding='utf-8', buffering=self.bufsize)
+
+    def add(self, danmu:SimpleDanmaku) -> bool:
+        line = json.dumps(danmu.todict(), ensure_ascii=False) + '\n'
+        with self._lock:
+            if not self._file:
+                return False
+            self._file.write(line)
+        return True
+
+    def add_super_chat(self, super_chat:SimpleDanmaku):
+        self.add(super_chat)
+
+    def close(self):
+        with self._lock:
+            if self._file:
+                self._file.close()
+            self._file = None
@@ -0,0 +1,212 @@
+import logging
+import re
+from os.path import splitext
+
+import numpy as np
+
+from DMR.utils import *
+from .asswriter import AssWriter
+from .tracks import TrackAllocator
+
+__all__ = ['relayout', 'load_ass_events']
+
+# 与configs/default.yml中的弹幕参数一致
+DEFAULT_STYLE = {
+    'dst': 20,
+    'dmrate': 0.4,
+    'font': 'Microsoft YaHei',
+    'fontsize': 36,
+    'margin_h': 6,
+    'margin_w': 0.05,
+    'dmduration': 16,
+    'opacity': 0.8,
+    'auto_fontsize': True,
+    'outlinecolor': '000000',
+    'outlinesize': 1.0,
+}
+
+_MOVE = re.compile(r'\{\\move\((-?\d+),(-?\d+),(-?\d+),(-?\d+)\)\}')
+_COLOR = re.compile(r'\\1c(?:&H)?([0-9a-fA-F]{6})&')
+
+def _parse_time(t:str) -> float:
+    return hms2sec(*t.split(':'))
+
+def load_ass_events(filename:str) -> dict:
+    """
+    读取AssWriter生成的ASS弹幕文件
+    滚动弹幕（R2L样式的Dialogue和Picture）解析为时间、内容、颜色和图片宽高比，其他事件（例如醒目留言）原样保留
+    """
+    info = {
+        'width': 0,
+        'height': 0,
+        'fontsize': 0,
+        'times': [],
+        'contents': [],
+        'colors': [],
+        'ratios': [],
+        'others': [],
+    }
+    with open(filename, encoding='utf-8') as f:
+        for row in f:
+            row = row.rstrip('\r\n')
+            if row.startswith('PlayResX:'):
+                info['width'] = int(row.split(':')[-1].strip())
+            elif row.startswith('PlayResY:'):
+                info['height'] = int(row.split(':')[-1].strip())
+            elif row.startswith('Style: R2L,'):
+                info['fontsize'] = int(row.split(',')[2])
+            elif row.startswith('Dialogue:') or row.startswith('Picture:'):
+                event_type, _, rest = row.partition(':')
+                fields = rest.strip().split(',', 9)
+                if len(fields) < 10:
+                    continue
+                try:
+                    st = _parse_time(fields[1])
+                except ValueError:
+                    continue
+                if fields[3] != 'R2L':
+                    info['others'].append((st, row))
+                    continue
+                text = fields[9]
+                move = _MOVE.search(text)
+                if event_type == 'Picture':
+                    # 图片弹幕的宽度 = 字体大小 * 宽高比，终点横坐标为负的宽度
+                    x1 = int(move.group(3)) if move else 0
+                    info['ratios'].append(-x1 / info['fontsize'] if info['fontsize'] else 1)
+                    info['colors'].append('ffffff')
+                    info['contents'].append(_MOVE.sub('', text))
+                else:
+                    color = _COLOR.search(text)
+                    info['ratios'].append(0)
+                    info['colors'].append(BGR2RGB(color.group(1)) if color else 'ffffff')
+                    # 只去掉AssWriter加入的坐标和颜色标签，保留弹幕内容中的其他字符
+                    text = _MOVE.sub('', text, count=1)
+                    if text.startswith('{\\alpha'):
+                        text = text[text.index('}') + 1:]
+                    info['contents'].append(text)
+                info['times'].append(st)
+    return info
+
+def _hms(times:np.ndarray) -> list:
+    # 与sec2hms相同的计算，批量处理
+    m, s = np.divmod(times.astype(np.float64), 60)
+    h, m = np.divmod(m, 60)
+    return ['%02d:%02d:%05.2f' % x for x in zip(h.tolist(), m.tolist(), s.tolist())]
+
+def _assign_tracks(writer:AssWriter, times:np.ndarray, lengths:np.ndarray, calc_collision:bool) -> np.ndarray:
+    """按时间顺序为每条弹幕分配轨道，返回轨道编号（-1表示因为冲突被丢弃）"""
+    tracks = TrackAllocator(
+        writer._ntracks,
+        width=writer.width,
+        dmduration=writer.dmduration,
+        gap=max(0.2 * writer.width, writer.margin_w),
+        margin=writer.margin_w,
+    )
+    tids = np.full(len(times), -1, dtype=np.int32)
+    find, place = tracks.find, tracks.place
+    for i, (tic, length) in enumerate(zip(times.tolist(), lengths.tolist())):
+        tid, ok = find(tic)
+        if tid < 0 or (calc_collision and not ok):
+            continue
+        place(tid, tic, length)
+        tids[i] = tid
+    return tids
+
+def relayout(src:str, output:str, width:int=None, height:int=None, calc_collision:bool=True, **kwargs) -> dict:
+    """
+    使用新的分辨率和弹幕参数重新排版弹幕，生成新的ASS文件，返回统计信息
+    src: AssWriter生成的ASS文件或者弹幕日志（.dmj）
+    width, height: 目标分辨率，为空时使用原ASS文件的分辨率（使用弹幕日志时必须指定）
+    kwargs: 弹幕参数（fontsize, dmrate, dmduration, margin_h, margin_w等，与录制设置相同），未指定的参数使用默认值
+    弹幕宽度、坐标和时间使用numpy批量计算，只有轨道分配需要逐条进行
+    """
+    super_chats = []
+    if splitext(src)[1].lower() == '.dmj':
+        from .dmtable import DanmakuTable
+        from .journal import DTYPES
+        table = DanmakuTable.open(src).sort()
+        dtype = table.records['dtype']
+        super_chats = list(table.select(dtype == DTYPES.index('super_chat')))
+        table = table.select(dtype == DTYPES.index('danmaku'))
+        times = np.asarray(table.records['time'], dtype=np.float64)
+        contents = table.contents()
+        colors = [table.colors[i] for i in table.records['color'].tolist()]
+        ratios = np.zeros(len(times))
+        others = []
+    else:
+        info = load_ass_events(src)
+        width = width or info['width']
+        height = height or info['height']
+        times = np.asarray(info['times'], dtype=np.float64)
+        order = np.argsort(times, kind='stable')
+        times = times[order]
+        contents = [info['contents'][i] for i in order.tolist()]
+        colors = [info['colors'][i] for i in order.tolist()]
+        ratios = np.asarray(info['ratios'], dtype=np.float64)[order] if len(order) else np.zeros(0)
+        others = info['others']
+    if not (width and height):
+        raise ValueError(f'无法确定{src}的分辨率，请指定width和height.')
+
+    style = {**DEFAULT_STYLE, **kwargs}
+    style.pop('description', None)
+    writer = AssWriter(description=f'{output}的弹幕文件, 由{src}重新排版', width=int(width), height=int(height), **style)
+
+    images = ratios > 0
+    lengths = np.fromiter((writer._get_length(c) for c in contents), dtype=np.int64, count=len(contents))
+    lengths[images] = (writer.fontsize * ratios[images]).astype(np.int64)
+    tids = _assign_tracks(writer, times, lengths, calc_collision)
+
+    keep = np.flatnonzero(tids >= 0)
+    t0 = times[keep]
+    y = (writer.fontsize + (writer.fontsize + writer.margin_h) * tids[keep] + writer.dst).tolist()
+    x1 = (-lengths[keep]).tolist()
+    start, end = _hms(t0), _hms(t0 + writer.dmduration)
+    t0 = t0.tolist()
+
+    events = []
+    for k, i in enumerate(keep.tolist()):
+        move = '{\\move(%d,%d,%d,%d)}' % (writer.width, y[k], x1[k], y[k])
+        if images[i]:
+            line = f'Picture: 0,{start[k]},{end[k]},R2L,,0,0,0,,{move}{contents[i]}'
+        else:
+            text = contents[i].replace('\n', ' ').replace('\r', ' ')
+            line = f'Dialogue: 0,{start[k]},{end[k]},R2L,,0,0,0,,{move}' + '{\\alpha&H%s\\1c%s&}' % (writer.opacity, RGB2BGR(colors[i])) + text
+        events.append((t0[k], line + '\n'))
+    for danmu in super_chats:
+        events.append((danmu.time, writer.format_super_chat(danmu)))
+    for st, line in others:
+        events.append((st, line + '\n'))
+    events.sort(key=lambda x: x[0])
+
+    with open(output, 'w', encoding='utf-8') as f:
+        f.write('\n'.join(writer.meta_info) + '\n')
+        f.writelines(line for _, line in events)
+
+    stats = {
+        'total': len(times),
+        'written': len(keep),
+        'dropped': len(times) - len(keep),
+        'super_chat': len(super_chats),
+        'others': len(others),
+    }
+    logging.debug(f'弹幕重新排版完成 {src} -> {output}: {stats}')
+    return stats
+
+if __name__ == '__main__':
+    import argparse
+    import json
+    parser = argparse.ArgumentParser(description='使用新的分辨率和弹幕参数重新排版ASS弹幕文件或者弹幕日志')
+    parser.add_argument('src')
+    parser.add_argument('output')
+    parser.add_argument('--width', type=int)
+    parser.add_argument('--height', type=int)
+    for key, value in DEFAULT_STYLE.items():
+        if isinstance(value, bool):
+            parser.add_argument(f'--{key}', type=lambda x: x.lower() in ('1', 'true', 'yes'))
+        else:
+            parser.add_argument(f'--{key}', type=type(value))
+    parser.add_argument('--font_file')
+    args = vars(parser.parse_args())
+    src, output = args.pop('src'), args.pop('output')
+    style = {k: v for k, v in args.items() if v is not None}
+    print(json.dumps(relayout(src, output, **style), ensure_ascii=False))
@@ -26,6 +26,7 @@ class StreamgearsDownloader():
                  debug=False,
                  header:dict=None,
                  segment_callback=None,
+                 segment_start_callback=None,
                  stable_callback=None,
                  **kwargs):
         self.stream_url = stream_url
@@ -36,6 +37,7 @@ class StreamgearsDownloader():
         self.taskname = taskname
         self.url = url
         self.segment_callback = segment_callback
+        self.segment_start_callback = segment_start_callback
         self.stable_callback = stable_callback
         self.kwargs = kwargs
 
@@ -98,11 +100,14 @@ class StreamgearsDownloader():
 
             if 'create flv file' in line:
                 fname = line.split('create flv file ')[-1]
+                part_file = fname
                 if fname.endswith('.part'):
                     fname = fname[:-5]
                 if self.thisfile and self.thisfile != fname:
                     time.sleep(5)
                     self.segment_callback(self.thisfile)
+                if self.thisfile != fname and self.segment_start_callback:
+                    self.segment_start_callback(part_file)
                 self.thisfile = fname
             logging.debug(f'{self.taskname} streamgears: {line}')
 
@@ -0,0 +1,209 @@
+import logging
+import os
+import shutil
+import subprocess
+import sys
+import unicodedata
+from functools import lru_cache
+from os.path import exists, isfile, join
+
+__all__ = ['TrackAllocator', 'TextMeasurer', 'find_font']
+
+_INF = float('inf')
+_FONT_EXTS = ('.ttf', '.ttc', '.otf')
+
+def _font_dirs() -> list:
+    if sys.platform == 'win32':
+        return [join(os.environ.get('WINDIR', 'C:\\Windows'), 'Fonts'),
+                join(os.environ.get('LOCALAPPDATA', ''), 'Microsoft', 'Windows', 'Fonts')]
+    if sys.platform == 'darwin':
+        return ['/System/Library/Fonts', '/Library/Fonts', os.path.expanduser('~/Library/Fonts')]
+    return ['/usr/share/fonts', '/usr/local/share/fonts', os.path.expanduser('~/.local/share/fonts'),
+            os.path.expanduser('~/.fonts')]
+
+def _registry_font(name:str) -> str:
+    # Windows注册表中的字体：名称为“Microsoft YaHei & Microsoft YaHei UI (TrueType)”，值为字体文件名
+    import winreg
+    key_path = r'Software\Microsoft\Windows NT\CurrentVersion\Fonts'
+    for root in (winreg.HKEY_LOCAL_MACHINE, winreg.HKEY_CURRENT_USER):
+        try:
+            key = winreg.OpenKey(root, key_path)
+        except OSError:
+            continue
+        with key:
+            i = 0
+            while True:
+                try:
+                    value_name, value, _ = winreg.EnumValue(key, i)
+                except OSError:
+                    break
+                i += 1
+                families = value_name.rsplit(' (', 1)[0].split(' & ')
+                if any(f.strip().lower() == name.lower() for f in families):
+                    path = value if os.path.isabs(value) else join(_font_dirs()[0], value)
+                    if isfile(path):
+                        return path
+    return None
+
+def _fc_match(name:str) -> str:
+    # 与libass在Linux下使用相同的fontconfig匹配规则
+    try:
+        out = subprocess.run(['fc-match', '-f', '%{file}', name], capture_output=True, timeout=5)
+    except (OSError, subprocess.SubprocessError):
+        return None
+    path = out.stdout.decode('utf-8', errors='ignore').strip()
+    return path if path and isfile(path) else None
+
+def _scan_fonts(name:str, dirs:list) -> str:
+    from PIL import ImageFont
+    for font_dir in dirs:
+        for root, _, files in os.walk(font_dir):
+            for filename in files:
+                if not filename.lower().endswith(_FONT_EXTS):
+                    continue
+                path = join(root, filename)
+                try:
+                    family = ImageFont.truetype(path, 10).getname()[0]
+                except Exception:
+                    continue
+                if family and family.lower() == name.lower():
+                    return path
+    return None
+
+@lru_cache(maxsize=None)
+def find_font(name:str, dirs:tuple=None) -> str:
+    """
+    查找字体文件，name可以是字体文件路径、系统字体目录中的文件名（例如msyh.ttc）或者字体名称（例如Microsoft YaHei）
+    字体名称依次使用Windows注册表、fontconfig（fc-match）和扫描字体目录（dirs，默认为系统字体目录）查找，找不到时返回None
+    """
+    if not name:
+        return None
+    if isfile(name):
+        return name
+    try:
+        from PIL import ImageFont
+    except ImportError:
+        return None
+    try:
+        # PIL会在系统字体目录中查找文件名
+        ImageFont.truetype(name, 10)
+        return name
+    except OSError:
+        pass
+    path = None
+    if dirs is None:
+        if sys.platform == 'win32':
+            path = _registry_font(name)
+        if not path and shutil.which('fc-match'):
+            path = _fc_match(name)
+        dirs = _font_dirs()
+    return path or _scan_fonts(name, [d for d in dirs if d and exists(d)])
+
+class TrackAllocator():
+    """
+    滚动弹幕轨道分配器
+    每个轨道只记录最后一条弹幕空出足够间距的时间，使用两棵最小值线段树：
+    gap树：距离超过gap（正常间距）的时间，用于找编号最小的空闲轨道
+    margin树：距离超过margin（最小间距）的时间，没有空闲轨道时选择最早满足最小间距的轨道
+    两种查询都是O(log n)
+    """
+    def __init__(self, ntracks:int, width:float, dmduration:float, gap:float, margin:float) -> None:
+        self.ntracks = max(int(ntracks), 0)
+        self.width = width
+        self.dmduration = dmduration
+        self.gap = gap
+        self.margin = margin
+        size = 1
+        while size < max(self.ntracks, 1):
+            size *= 2
+        self._size = size
+        # 空轨道为-inf，不存在的轨道为inf
+        self._gap = [_INF] * (2 * size)
+        self._margin = [_INF] * (2 * size)
+        for i in range(self.ntracks):
+            self._gap[size + i] = -_INF
+            self._margin[size + i] = -_INF
+        for tree in (self._gap, self._margin):
+            for i in range(size - 1, 0, -1):
+                tree[i] = min(tree[2 * i], tree[2 * i + 1])
+
+    def __len__(self):
+        return self.ntracks
+
+    def _ready_time(self, tic:float, length:float, dist:float) -> float:
+        # 弹幕在tic时刻从屏幕右侧出现，计算它的尾部离开右侧dist距离的时间
+        return tic + (dist + length) * self.dmduration / (length + self.width)
+
+    @staticmethod
+    def _update(tree:list, pos:int, value:float):
+        tree[pos] = value
+        pos //= 2
+        while pos:
+            tree[pos] = min(tree[2 * pos], tree[2 * pos + 1])
+            pos //= 2
+
+    def find(self, tic:float):
+        """
+        找到在tic时刻放入新弹幕的轨道，返回(轨道编号, 是否满足最小间距)，没有轨道时返回(-1, False)
+        """
+        if not self.ntracks:
+            return -1, False
+        tree = self._gap
+        if tree[1] < tic:
+            pos = 1
+            while pos < self._size:
+                pos = 2 * pos if tree[2 * pos] < tic else 2 * pos + 1
+            return pos - self._size, True
+
+        tree = self._margin
+        pos = 1
+        while pos < self._size:
+            pos = 2 * pos if tree[2 * pos] <= tree[2 * pos + 1] else 2 * pos + 1
+        return pos - self._size, tree[pos] <= tic
+
+    def place(self, tid:int, tic:float, length:float):
+        """在轨道tid上放入一条出现时间为tic，宽度为length的弹幕"""
+        pos = self._size + tid
+        self._update(self._gap, pos, self._ready_time(tic, length, self.gap))
+        self._update(self._margin, pos, self._ready_time(tic, length, self.margin))
+
+class TextMeasurer():
+    """
+    弹幕宽度计算，优先使用字体文件的实际字宽（需要安装Pillow），无法加载字体时按照字符类型估算
+    fonts为字体文件路径或者字体名称，按顺序使用第一个能找到的字体
+    相同的文本只计算一次（LRU缓存）
+    """
+    def __init__(self, fontsize:int, fonts:list=None, cache_size:int=65536) -> None:
+        self.fontsize = fontsize
+        self.font = None
+        for font in fonts or []:
+            if not font:
+                continue
+            path = find_font(font)
+            if not path:
+                logging.debug(f'找不到字体{font}.')
+                continue
+            try:
+                from PIL import ImageFont
+                self.font = ImageFont.truetype(path, fontsize)
+                break
+            except Exception as e:
+                logging.debug(f'无法加载字体{font}({path})，将使用估算的弹幕宽度: {e}')
+        if self.font is None and any(fonts or []):
+            logging.debug(f'没有可用的字体文件，将使用估算的弹幕宽度.')
+        self.width = lru_cache(maxsize=cache_size)(self._measure)
+
+    def _char_width(self, ch:str) -> float:
+        if ord(ch) > 0xffff:
+            return self.fontsize
+        if unicodedata.east_asian_width(ch) in 'WFA':
+            return self.fontsize
+        return 0.5 * self.fontsize
+
+    def _measure(self, text:str) -> int:
+        if self.font is not None:
+            try:
+                return int(self.font.getlength(text))
+            except Exception:
+                pass
+        return int(sum(self._char_width(ch) for ch in text))
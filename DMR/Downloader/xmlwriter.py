@@ -0,0 +1,86 @@
+import re
+import threading
+import zlib
+from xml.sax.saxutils import escape, quoteattr
+from DMR.danmaku import SimpleDanmaku
+
+__all__ = ['XmlWriter']
+
+# XML 1.0 不允许出现的控制字符
+_INVALID_XML_CHARS = re.compile(r'[\x00-\x08\x0b\x0c\x0e-\x1f\ufffe\uffff]')
+
+def _clean(s) -> str:
+    return _INVALID_XML_CHARS.sub('', str(s if s is not None else ''))
+
+class XmlWriter():
+    """
+    B站格式的XML弹幕写入器，可以直接用于上传视频的弹幕池或者其他播放器
+    文件以缓冲的方式写入，关闭文件时写入结束标签（程序异常退出时文件可能不完整）
+    """
+    header = [
+        '<?xml version="1.0" encoding="UTF-8"?>',
+        '<i>',
+        '<chatserver>chat.bilibili.com</chatserver>',
+        '<chatid>0</chatid>',
+        '<mission>0</mission>',
+        '<maxlimit>0</maxlimit>',
+        '<state>0</state>',
+        '<real_name>0</real_name>',
+        '<source>k-v</source>',
+    ]
+
+    def __init__(self, bufsize:int=64*1024, **kwargs) -> None:
+        self.bufsize = bufsize
+        self.kwargs = kwargs
+        self._lock = threading.Lock()
+        self._file = None
+
+    def open(self, filename):
+        with self._lock:
+            if self._file:
+                self._close()
+            self._file = open(filename, 'w', encoding='utf-8', buffering=self.bufsize)
+            self._file.write('\n'.join(self.header) + '\n')
+
+    @staticmethod
+    def _color(color) -> int:
+        try:
+            return int(str(color), 16)
+        except ValueError:
+            return 0xffffff
+
+    @staticmethod
+    def _timestamp(danmu:SimpleDanmaku) -> int:
+        ts = danmu.server_time if danmu.server_time > 0 else danmu.recv_time
+        return int(ts) if ts > 0 else 0
+
+    def add(self, danmu:SimpleDanmaku) -> bool:
+        # p属性：出现时间,模式(1为滚动),字号,颜色,发送时间戳,弹幕池,用户哈希,弹幕id
+        uhash = '%08x' % zlib.crc32(_clean(danmu.uname).encode('utf-8'))
+        p = f'{danmu.time:.3f},1,25,{self._color(danmu.color)},{self._timestamp(danmu)},0,{uhash},0'
+        line = f'<d p="{p}" user={quoteattr(_clean(danmu.uname))}>{escape(_clean(danmu.content))}</d>\n'
+        with self._lock:
+            if not self._file:
+                return False
+            self._file.write(line)
+        return True
+
+    def add_super_chat(self, super_chat:SimpleDanmaku):
+        line = (
+            f'<sc ts="{super_chat.time:.3f}" user={quoteattr(_clean(super_chat.uname))} '
+            f'price="{super_chat.price}" time="{self._timestamp(super_chat)}">'
+            f'{escape(_clean(super_chat.content))}</sc>\n'
+        )
+        with self._lock:
+            if self._file:
+                self._file.write(line)
+
+    def _close(self):
+        self._file.write('</i>\n')
+        self._file.close()
+        self._file = None
+
+    def close(self):
+        with self._lock:
+            if self._file:
+                self._close()
@@ -1,9 +1,10 @@
 from datetime import datetime
 import logging
+import time
 import re, asyncio, aiohttp
 
-# from .youtube import Youtube
-# from .twitch import Twitch
+from .youtube import Youtube
+from .twitch import Twitch
 from .bilibili import Bilibili
 from .cc import CC
 from .douyu import Douyu
@@ -24,6 +25,8 @@ site_class = {
 
 # 使用自建API，DMC会实例化这个类然后调用start方法启动
 site_class_v2 = {
+    'youtube': Youtube,
+    'twitch': Twitch,
 }
 
 class DanmakuClient:
@@ -36,6 +39,11 @@ class DanmakuClient:
         self.__stop = False
         self._dm_queue = q
         self.__extra_data = kwargs
+        # 连接活跃时间（单调时钟），收到任意数据帧（包括心跳回复、人气值等）时更新
+        self.connect_mono = time.monotonic()
+        self._first_active = None
+        self._last_active = self.connect_mono
+        self.frames = 0
         if "http://" == url[:7] or "https://" == url[:8]:
             self.__url = url
         else:
@@ -67,16 +75,44 @@ class DanmakuClient:
                     await self.__ws.send_str(self.__site_api.heartbeat)
                 else:
                     await self.__ws.send_bytes(self.__site_api.heartbeat)
-            except:
-                pass
+            except Exception as e:
+                # 心跳包发送失败说明连接已经断开，抛出异常以便上层重连
+                if self.__stop:
+                    return
+                raise RuntimeError(f'Heartbeat failed: {e}') from e
+
+    @property
+    def last_active(self) -> float:
+        """最后一次收到数据的时间（单调时钟）"""
+        if self.__site_api is None and self.__site_class is not None:
+            # 自建API没有提供活跃时间时视为一直活跃，由其自身处理重连
+            return getattr(self.__site_class, 'last_active', time.monotonic())
+        return self._last_active
+
+    @property
+    def first_active(self) -> float:
+        """连接后第一次收到数据的时间（单调时钟），还没有收到数据时为None"""
+        if self.__site_api is None and self.__site_class is not None:
+            # 自建API的实例在收到第一条消息时设置first_active（start之前__site_class还是类）
+            if isinstance(self.__site_class, type):
+                return None
+            return getattr(self.__site_class, 'first_active', None)
+        return self._first_active
 
     async def fetch_danmaku(self):
         while self.__stop != True:
             msg = await self.__ws.receive()
+            # 在读取到数据时记录时间，弹幕时间不受解码和排队的影响
+            recv_mono, recv_time = time.monotonic(), time.time()
             if msg.type in [aiohttp.WSMsgType.CLOSED, aiohttp.WSMsgType.ERROR]:
                 raise RuntimeError('Websocket Closed')
+            self._last_active = recv_mono
+            self.frames += 1
+            if self._first_active is None:
+                self._first_active = recv_mono
             
             result = self.__site_api.decode_msg(msg.data)
+            decode_mono = time.monotonic()
             if isinstance(result, tuple):
                 ms, ack = result
                 if ack is not None:
@@ -89,6 +125,9 @@ class DanmakuClient:
                 ms = result
 
             for m in ms:
+                m['recv_mono'] = recv_mono
+                m['recv_time'] = recv_time
+                m['decode_mono'] = decode_mono
                 await self._dm_queue.put(m)
 
     async def start(self):
@@ -99,7 +138,7 @@ class DanmakuClient:
                 self.fetch_danmaku(),
             )
         else:
-            self.__site_class = self.__site_class(rid=self.rid, q=self._dm_queue)
+            self.__site_class = self.__site_class(rid=self.rid, q=self._dm_queue, url=self.__url)
             await self.__site_class.start()
 
     async def stop(self):
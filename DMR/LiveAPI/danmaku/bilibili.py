@@ -106,14 +106,17 @@ class Bilibili(DMAPI):
                         ).get("uname", "")
                         msg["color"] = f"{j.get('info', [[0, 0, 0, 16777215]])[0][3]:06x}"
                         msg["content"] = j.get("info")[1]
+                        msg["uid"] = j.get("info", ["", "", [0]])[2][0]
                         try:
-                            msg['time'] = datetime.fromtimestamp(j.get('info')[0][4] / 1000)
-                            if j.get('info')[13] != r'{}':
-                                emoticon_info = j.get('info')[0][13]
-                                emoticon_url = emoticon_info['url']
-                                emoticon_desc = j.get('info')[1]
-                                msg["content"] = json.dumps({'url': emoticon_url, 'desc': emoticon_desc},
-                                                            ensure_ascii=False)
+                            msg['server_time'] = j.get('info')[0][4] / 1000
+                            emoticon_info = j.get('info')[0][13]
+                            if isinstance(emoticon_info, dict) and emoticon_info.get('url'):
+                                msg["content"] = json.dumps({
+                                    'url': emoticon_info['url'],
+                                    'desc': j.get('info')[1],
+                                    'width': emoticon_info.get('width', 0),
+                                    'height': emoticon_info.get('height', 0),
+                                }, ensure_ascii=False)
                                 msg['msg_type'] = 'emoticon'
                         except:
                             pass
@@ -132,13 +135,11 @@ class Bilibili(DMAPI):
 
                     elif msg["msg_type"] == "super_chat":  # 新增此部分
                         msg["name"] = j.get('data', {}).get('uinfo', {}).get('base', {}).get('name', '')
+                        msg["uid"] = j.get('data', {}).get('uid', 0)
                         msg["content"] = j.get('data', {}).get('message', '')
                         msg["price"] = j.get('data', {}).get('price', 0)
                         msg["color"] = j.get('data', {}).get('background_color', '#FFFFFF')
-                        try:
-                            msg['time'] = datetime.fromtimestamp(j.get('data', {}).get('ts', 0))
-                        except:
-                            msg['time'] = datetime.now()  # 如果没有时间戳，则使用当前时间
+                        msg['server_time'] = j.get('data', {}).get('ts') or -1  # 没有时间戳则为-1
 
                     else:
                         msg["content"] = j
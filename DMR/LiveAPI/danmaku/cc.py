@@ -11,9 +11,6 @@ from .DMAPI import DMAPI
 
 
 class CC_Init:
-    def __init__(self):
-        self.offset = 0
-
     def get_reg(self):
         sid = 6144
         cid = 2
@@ -146,105 +143,143 @@ class CC_Init:
                 t += self.encode_dict(v)
         return t
 
-    def p(self, fmt):
-        def r(t):
-            s, = struct.unpack_from(fmt, t, self.offset)
-            self.offset += struct.calcsize(fmt)
-            return s
-
-        return r
-
-    def i(self, t):
-        return lambda t: int(t[self.offset - 1])
-
-    def o(self, t, e):
-        return lambda r: e(r, t(r))
-
-    def f(self, t, e):
-        return lambda r: e(r, t)
-
-    def n(self, e):
-        if 0 <= e <= 127:
-            r = self.i(e)
-        elif 128 <= e <= 143:
-            r = self.f(e - 128, self.de_dict)
-        elif 144 <= e <= 159:
-            r = self.f(e - 144, self.de_list)
-        elif 160 <= e <= 191:
-            r = self.f(e - 160, self.de_str)
-        elif e == 192:
-            r = self.i(None)
-        elif e == 193:
-            r = None
-        elif e == 194:
-            r = self.i(False)
-        elif e == 195:
-            r = self.i(True)
-        elif e == 202:
-            r = self.p('>f')
-        elif e == 203:
-            r = self.p('>d')
-        elif e == 204:
-            r = self.p('>B')
-        elif e == 205:
-            r = self.p('>H')
-        elif e == 206:
-            r = self.p('>I')
-        elif e == 207:
-            r = self.p('>Q')
-        elif e == 208:
-            r = self.p('>b')
-        elif e == 209:
-            r = self.p('>h')
-        elif e == 210:
-            r = self.p('>i')
-        elif e == 211:
-            r = self.p('>q')
-        elif e == 217:
-            r = self.o(self.p('>B'), self.de_str)
-        elif e == 218:
-            r = self.o(self.p('>H'), self.de_str)
-        elif e == 219:
-            r = self.o(self.p('>I'), self.de_str)
-        elif e == 220:
-            r = self.o(self.p('>H'), self.de_list)
-        elif e == 221:
-            r = self.o(self.p('>I'), self.de_list)
-        elif e == 222:
-            r = self.o(self.p('>H'), self.de_dict)
-        elif e == 223:
-            r = self.o(self.p('>I'), self.de_dict)
-        elif 224 <= e <= 256:
-            r = self.i(e - 256)
-        return r
-
-    def de_init(self, t):
-        r = int(t[self.offset])
-        self.offset += 1
-        n = self.n(r)
-        return n(t)
-
-    def de_str(self, t, e):
-        s = t[self.offset: self.offset + e].decode('utf-8')
-        self.offset += e
-        return s
-
-    def de_list(self, t, e):
-        l = [''] * e
-        n = self.de_init
-        for i in range(e):
-            l[i] = n(t)
-        return l
-
-    def de_dict(self, t, e):
-        k = [''] * e
-        v = [''] * e
-        f = self.de_init
-        for r in range(e):
-            k[r] = f(t)
-            v[r] = f(t)
-        d = dict(zip(k, v))
-        return d
+
+# 以下为无状态的msgpack解码器，解析位置由调用者以局部变量传递，多个直播间可以同时解码
+_SCALAR, _STR, _BIN, _ARRAY, _MAP = range(5)
+
+_NUMBERS = {
+    0xca: struct.Struct('>f'),
+    0xcb: struct.Struct('>d'),
+    0xcc: struct.Struct('>B'),
+    0xcd: struct.Struct('>H'),
+    0xce: struct.Struct('>I'),
+    0xcf: struct.Struct('>Q'),
+    0xd0: struct.Struct('>b'),
+    0xd1: struct.Struct('>h'),
+    0xd2: struct.Struct('>i'),
+    0xd3: struct.Struct('>q'),
+}
+
+_LENGTHS = {
+    0xc4: (_BIN, struct.Struct('>B')),
+    0xc5: (_BIN, struct.Struct('>H')),
+    0xc6: (_BIN, struct.Struct('>I')),
+    0xd9: (_STR, struct.Struct('>B')),
+    0xda: (_STR, struct.Struct('>H')),
+    0xdb: (_STR, struct.Struct('>I')),
+    0xdc: (_ARRAY, struct.Struct('>H')),
+    0xdd: (_ARRAY, struct.Struct('>I')),
+    0xde: (_MAP, struct.Struct('>H')),
+    0xdf: (_MAP, struct.Struct('>I')),
+}
+
+_CONSTS = {0xc0: None, 0xc2: False, 0xc3: True}
+
+
+def _read_head(buf, pos):
+    """
+    读取一个值的类型头
+    返回 (类型, 标量的值或者容器的长度, 新的位置)
+    """
+    b = buf[pos]
+    pos += 1
+    if b <= 0x7f:
+        return _SCALAR, b, pos
+    if b <= 0x8f:
+        return _MAP, b - 0x80, pos
+    if b <= 0x9f:
+        return _ARRAY, b - 0x90, pos
+    if b <= 0xbf:
+        return _STR, b - 0xa0, pos
+    if b >= 0xe0:
+        return _SCALAR, b - 256, pos
+    if b in _CONSTS:
+        return _SCALAR, _CONSTS[b], pos
+    fmt = _NUMBERS.get(b)
+    if fmt is not None:
+        return _SCALAR, fmt.unpack_from(buf, pos)[0], pos + fmt.size
+    if b in _LENGTHS:
+        kind, fmt = _LENGTHS[b]
+        return kind, fmt.unpack_from(buf, pos)[0], pos + fmt.size
+    raise ValueError(f'Unsupported msgpack type 0x{b:02x}')
+
+
+def _skip_body(buf, kind, n, pos):
+    """跳过一个已经读取类型头的值，不生成任何对象"""
+    if kind == _SCALAR:
+        return pos
+    if kind == _STR or kind == _BIN:
+        return pos + n
+    remaining = n if kind == _ARRAY else 2 * n
+    while remaining:
+        kind, n, pos = _read_head(buf, pos)
+        remaining -= 1
+        if kind == _STR or kind == _BIN:
+            pos += n
+        elif kind == _ARRAY:
+            remaining += n
+        elif kind == _MAP:
+            remaining += 2 * n
+    return pos
+
+
+def _decode_body(buf, kind, n, pos):
+    if kind == _SCALAR:
+        return n, pos
+    if kind == _STR:
+        return str(buf[pos:pos + n], 'utf-8'), pos + n
+    if kind == _BIN:
+        return bytes(buf[pos:pos + n]), pos + n
+    if kind == _ARRAY:
+        items = [None] * n
+        for i in range(n):
+            items[i], pos = _decode(buf, pos)
+        return items, pos
+    d = {}
+    for _ in range(n):
+        k, pos = _decode(buf, pos)
+        d[k], pos = _decode(buf, pos)
+    return d, pos
+
+
+def _decode(buf, pos):
+    kind, n, pos = _read_head(buf, pos)
+    return _decode_body(buf, kind, n, pos)
+
+
+def extract_msg_fields(data, fields):
+    """
+    从 {'msg': [{...}, ...], ...} 结构的数据中提取消息
+    只解析 msg 列表中每条消息的 fields 字段，其他内容直接跳过
+    """
+    buf = memoryview(data)
+    kind, n, pos = _read_head(buf, 0)
+    if kind != _MAP:
+        return []
+    for _ in range(n):
+        key, pos = _decode(buf, pos)
+        kind, cnt, pos = _read_head(buf, pos)
+        if key != 'msg' or kind != _ARRAY:
+            pos = _skip_body(buf, kind, cnt, pos)
+            continue
+
+        msgs = []
+        for _ in range(cnt):
+            kind, nfields, pos = _read_head(buf, pos)
+            if kind != _MAP:
+                pos = _skip_body(buf, kind, nfields, pos)
+                continue
+            m = {}
+            for _ in range(nfields):
+                k, pos = _decode(buf, pos)
+                kind, vn, pos = _read_head(buf, pos)
+                if k in fields:
+                    m[k], pos = _decode_body(buf, kind, vn, pos)
+                else:
+                    pos = _skip_body(buf, kind, vn, pos)
+            msgs.append(m)
+        return msgs
+    return []
 
 
 class CC(DMAPI):
@@ -272,47 +307,38 @@ class CC(DMAPI):
         reg_datas.append(join_data)
         return 'wss://weblink.cc.163.com/', reg_datas
 
+    # 需要解析的消息类型及其用到的字段
+    studio = {
+        'tcp-515-32785': ('chat', {4, 197}),
+        'tcp-535-32769': ('gamechat', {4, 7}),
+    }
+
     def decode_msg(e):
         n, r, p = struct.unpack('<HHI', e[:8])
         i = 'tcp-{}-{}'.format(n, r)
-        studio = {
-            'tcp-512-32784': 'origin',
-            'tcp-515-32785': 'chat',
-            'tcp-535-32769': 'gamechat'
-        }
+        # 其他类型的消息（包括tcp-512-32784）不需要解析，也不产生消息
+        if i not in CC.studio:
+            return []
+
+        if p:
+            s, = struct.unpack('<I', e[8:12])
+            o = e[12:]
+            if len(o) != s:
+                return []
+        else:
+            o = e[8:]
+        o = o if int(o[0]) != 120 else zlib.decompress(o)
+
+        ms_type, fields = CC.studio[i]
         msgs = []
-        if i in studio.keys():
-            if p:
-                s, = struct.unpack('<I', e[8:12])
-                a = e[12:]
-                if len(a) == s:
-                    o = a
-            else:
-                o = e[8:]
-            o = o if int(o[0]) != 120 else zlib.decompress(o)
-            CC.s.offset = 0
-            msg = CC.s.de_init(o)
-
-            ms_type = studio[i]
-
-            if ms_type == 'origin':
-                ms = msg['data']['msg_list']
-            else:
-                ms = msg['msg']
-
-            for m in ms:
+        for m in extract_msg_fields(o, fields):
+            try:
                 if ms_type == 'chat':
                     name = m[197]
-                    content = m[4]
-                    msg_type = 'danmaku'
-                elif ms_type == 'gamechat':
-                    name = json.loads(m[7])['nickname']
-                    content = m[4]
-                    msg_type = 'danmaku'
                 else:
-                    continue
-                msg = {'name': name, 'content': content, 'msg_type': msg_type, 'color': 'ffffff'}
-                msgs.append(msg.copy())
-        else:
-            msgs = [{'name': '', 'content': '', 'msg_type': 'other', 'color': "ffffff"}]
+                    name = json.loads(m[7])['nickname']
+                content = m[4]
+            except Exception:
+                continue
+            msgs.append({'name': name, 'content': content, 'msg_type': 'danmaku', 'color': 'ffffff'})
         return msgs
@@ -13,12 +13,11 @@ import json
 import logging
 import random
 import websocket
-from google.protobuf import json_format
 from concurrent.futures import ThreadPoolExecutor, as_completed
 
 from DMR.LiveAPI.douyin import douyin_cache
 from DMR.LiveAPI.utils import split_url
-from .dy_pb2 import PushFrame, Response, ChatMessage
+from .dy_pb2 import PushFrame, Response, ChatMessage, GiftMessage, LikeMessage
 
 # 抖音的弹幕录制参考了 https://github.com/biliup/biliup/blob/master/biliup/plugins/Danmaku/douyin.py
 import aiohttp
@@ -61,6 +60,37 @@ class Douyin:
                     f"wss://webcast3-ws-web-lf.douyin.com/webcast/im/push/v2/?room_id={room_info['id_str']}&compress=gzip&signature=00000000")
                 return url, []
 
+    # 需要解析的消息类型，默认为None：解析所有支持的消息类型（弹幕、礼物、点赞），其他消息作为other类型的消息发出
+    # 设置为集合（例如 {'WebcastChatMessage'}）时只解析其中的消息类型，其余消息直接跳过，不做任何解析
+    methods = None
+
+    @staticmethod
+    def decode_chat(payload, now):
+        chat = ChatMessage()
+        chat.ParseFromString(payload)
+        server_time = chat.common.createTime / 1000 if chat.common.createTime else -1
+        return {"time": now, "server_time": server_time, "name": chat.user.nickName, "uid": chat.user.id, "content": chat.content, "msg_type": "danmaku", "color": "ffffff"}
+
+    @staticmethod
+    def decode_gift(payload, now):
+        gift = GiftMessage()
+        gift.ParseFromString(payload)
+        return {
+            "time": now,
+            "name": gift.user.nickName,
+            "content": gift.gift.name,
+            "msg_type": "gift",
+            "color": "ffffff",
+            "count": gift.comboCount or gift.repeatCount,
+            "price": gift.gift.diamondCount,
+        }
+
+    @staticmethod
+    def decode_like(payload, now):
+        like = LikeMessage()
+        like.ParseFromString(payload)
+        return {"time": now, "name": like.user.nickName, "content": "", "msg_type": "like", "color": "ffffff", "count": like.count}
+
     @staticmethod
     def decode_msg(data):
         wss_package = PushFrame()
@@ -79,22 +109,26 @@ class Douyin:
             ack = obj.SerializeToString()
         
         msgs = []
+        now = datetime.now()
+        methods = Douyin.methods
         for msg in payload_package.messagesList:
-            now = datetime.now()
-            if msg.method == 'WebcastChatMessage':
-                chatMessage = ChatMessage()
-                chatMessage.ParseFromString(msg.payload)
-                data = json_format.MessageToDict(chatMessage, preserving_proto_field_name=True)
-                name = data['user']['nickName']
-                content = data['content']
-                msg_dict = {"time": now, "name": name, "content": content, "msg_type": "danmaku", "color": "ffffff"}
-                # print(msg_dict)
-            else:
-                msg_dict = {"time": now, "name": "", "content": "", "msg_type": "other", "raw_data": msg}
-            msgs.append(msg_dict)
+            method = msg.method
+            if methods is not None and method not in methods:
+                continue
+            decoder = _DECODERS.get(method)
+            if decoder is None:
+                msgs.append({"time": now, "name": "", "content": "", "msg_type": "other", "raw_data": msg})
+                continue
+            msgs.append(decoder(msg.payload, now))
         
         return msgs, ack
 
+_DECODERS = {
+    'WebcastChatMessage': Douyin.decode_chat,
+    'WebcastGiftMessage': Douyin.decode_gift,
+    'WebcastLikeMessage': Douyin.decode_like,
+}
+
 # class Douyin:
 #     headers = douyin_cache.get_headers()
 #     def __init__(self, rid, q):
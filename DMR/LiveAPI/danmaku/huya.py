@@ -64,7 +64,7 @@ class Huya(DMAPI):
                     color = msg.tBulletFormat.iFontColor
                     if color == -1:
                         color = 16777215
-                    msg = {"name": name, "color": f"{color:06x}", "content": content, "msg_type": "danmaku"}
+                    msg = {"name": name, "uid": msg.tUserInfo.lUid, "color": f"{color:06x}", "content": content, "msg_type": "danmaku"}
                     msgs.append(msg)        
             elif command.iCmdType == EWebSocketCommandType.EWSCmdS2C_MsgPushReq_V2:
                 stream = tarscore.TarsInputStream(command.vData)
@@ -81,7 +81,7 @@ class Huya(DMAPI):
                         color = msg.tBulletFormat.iFontColor
                         if color == -1:
                             color = 16777215
-                        msg = {"name": name, "color": f"{color:06x}", "content": content, "msg_type": "danmaku"}
+                        msg = {"name": name, "uid": msg.tUserInfo.lUid, "color": f"{color:06x}", "content": content, "msg_type": "danmaku"}
                         msgs.append(msg)
             else:
                 msg = {"name": "", "content": "", "msg_type": "other","raw_data": data}
@@ -1,41 +1,299 @@
-import json, re, select, random, traceback
-from struct import pack, unpack
+import asyncio, aiohttp, logging, random, threading, time
 
-import asyncio, aiohttp, zlib
+__all__ = ['Twitch', 'TwitchIRCPool', 'parse_irc']
 
+# IRC标签值的转义字符
+_TAG_ESCAPES = {':': ';', 's': ' ', '\\': '\\', 'r': '\r', 'n': '\n'}
 
-class Twitch:
-    heartbeat = "PING"
-
-    async def get_ws_info(url):
-        reg_datas = []
-        room_id = re.search(r"/([^/?]+)[^/]*$", url).group(1)
-
-        reg_datas.append("CAP REQ :twitch.tv/tags twitch.tv/commands twitch.tv/membership")
-        reg_datas.append("PASS SCHMOOPIIE")
-        nick = f"justinfan{int(8e4 * random.random() + 1e3)}"
-        reg_datas.append(f"NICK {nick}")
-        reg_datas.append(f"USER {nick} 8 * :{nick}")
-        reg_datas.append(f"JOIN #{room_id}")
-
-        return "wss://irc-ws.chat.twitch.tv", reg_datas
-
-    def decode_msg(data):
-        # print(data)
-        # print('----------------')
-        msgs = []
-        for d in data.splitlines():
+def _unescape(value:str) -> str:
+    if '\\' not in value:
+        return value
+    out, i, n = [], 0, len(value)
+    while i < n:
+        ch = value[i]
+        if ch == '\\' and i + 1 < n:
+            out.append(_TAG_ESCAPES.get(value[i + 1], value[i + 1]))
+            i += 2
+        else:
+            if ch != '\\':
+                out.append(ch)
+            i += 1
+    return ''.join(out)
+
+def _int(value:str):
+    """格式错误的标签只跳过这个字段（返回None），不能影响共用的连接"""
+    try:
+        return int(value)
+    except ValueError:
+        return None
+
+def _parse_emotes(value:str) -> list:
+    # emotes=25:0-4,12-16/1902:6-10，位置以字符为单位，包含结束位置
+    emotes = []
+    for group in value.split('/'):
+        eid, _, ranges = group.partition(':')
+        for r in ranges.split(','):
+            start, _, end = r.partition('-')
+            if start.isdigit() and end.isdigit():
+                emotes.append({'id': eid, 'start': int(start), 'end': int(end)})
+    return emotes
+
+def parse_irc(line:str):
+    """
+    解析一行IRC消息，返回(命令, 频道, 消息)
+    只有PRIVMSG会解析标签并生成弹幕消息，其他命令的消息为None
+    使用字符串切分而不是正则表达式，每行只扫描一遍
+    """
+    tags = ''
+    if line.startswith('@'):
+        tags, _, line = line[1:].partition(' ')
+    if line.startswith(':'):
+        _, _, line = line[1:].partition(' ')
+    command, _, rest = line.partition(' ')
+    if command != 'PRIVMSG':
+        return command, None, rest
+    target, _, text = rest.partition(' :')
+    channel = target.lstrip('#').lower()
+    if text.startswith('\x01ACTION ') and text.endswith('\x01'):
+        text = text[8:-1]
+
+    msg = {
+        'name': '',
+        'content': text,
+        'color': 'ffffff',
+        'msg_type': 'danmaku',
+    }
+    for tag in tags.split(';') if tags else ():
+        key, _, value = tag.partition('=')
+        if not value:
+            continue
+        if key == 'display-name':
+            msg['name'] = _unescape(value)
+        elif key == 'color':
+            msg['color'] = value.lstrip('#').lower()
+        elif key == 'user-id':
+            msg['uid'] = value
+        elif key == 'tmi-sent-ts':
+            ts = _int(value)
+            if ts is not None:
+                msg['server_time'] = ts / 1000
+        elif key == 'emotes':
+            msg['emotes'] = _parse_emotes(value)
+        elif key == 'bits':
+            bits = _int(value)
+            if bits is not None:
+                msg['bits'] = bits
+    return command, channel, msg
+
+class _IRCConnection:
+    """一个IRC连接，负责登录、加入频道、断线重连，收到的消息交给连接池分发"""
+    def __init__(self, pool) -> None:
+        self.pool = pool
+        self.channels = set()
+        self.ws = None
+        self.task = None
+        self.last_active = time.monotonic()
+
+    async def send(self, data:str):
+        if self.ws is not None and not self.ws.closed:
+            await self.ws.send_str(data)
+
+    async def join(self, channel:str):
+        self.channels.add(channel)
+        if self.task is None or self.task.done():
+            self.task = asyncio.create_task(self.run())
+        else:
+            await self.send(f'JOIN #{channel}')
+
+    async def part(self, channel:str):
+        self.channels.discard(channel)
+        await self.send(f'PART #{channel}')
+        if not self.channels and self.ws is not None:
+            await self.ws.close()
+
+    async def _ping(self):
+        # Twitch在没有消息时不会发送任何数据，定时发送PING以便判断连接是否存活
+        while True:
+            await asyncio.sleep(self.pool.ping_interval)
+            await self.send('PING :tmi.twitch.tv')
+
+    async def run(self):
+        retry = 0
+        while self.channels:
+            ping = None
             try:
-                msg = {}
-                msg["name"] = re.search(r"display-name=([^;]+);", d).group(1)
-                msg["content"] = re.search(r"PRIVMSG [^:]+:(.+)", d).group(1)
-                # msg['msg_type']  = {'dgb': 'gift', 'chatmsg': 'danmaku',
-                # 'uenter': 'enter'}.get(msg['type'], 'other')
-                msg["msg_type"] = "danmaku"
-                c = re.search(r"color=#([a-zA-Z0-9]{6});", d)
-                msg["color"] = "ffffff" if c == None else c.group(1).lower()
-                msgs.append(msg)
+                async with self.pool.session.ws_connect(self.pool.url) as ws:
+                    self.ws = ws
+                    nick = f"justinfan{int(8e4 * random.random() + 1e3)}"
+                    await ws.send_str('CAP REQ :twitch.tv/tags twitch.tv/commands')
+                    await ws.send_str('PASS SCHMOOPIIE')
+                    await ws.send_str(f'NICK {nick}')
+                    for channel in list(self.channels):
+                        await ws.send_str(f'JOIN #{channel}')
+                    ping = asyncio.create_task(self._ping())
+                    async for msg in ws:
+                        self.last_active = time.monotonic()
+                        retry = 0
+                        if msg.type != aiohttp.WSMsgType.TEXT:
+                            continue
+                        for line in msg.data.split('\r\n'):
+                            if line and not await self.pool.handle(line, self):
+                                await ws.close()
+                                break
+            except asyncio.CancelledError:
+                raise
             except Exception as e:
-                # traceback.print_exc()
-                pass
-        return msgs
+                logging.debug(f'Twitch IRC连接异常: {e}')
+            finally:
+                if ping is not None:
+                    ping.cancel()
+                self.ws = None
+            if not self.channels:
+                break
+            retry += 1
+            delay = min(2 ** retry, 60)
+            logging.debug(f'Twitch IRC连接断开，{delay}秒后重连.')
+            await asyncio.sleep(delay / 2 + random.uniform(0, delay / 2))
+
+class TwitchIRCPool:
+    """
+    全局Twitch IRC连接池，所有Twitch直播间共用少量的连接
+    连接池在独立线程的事件循环中运行，收到的消息通过回调分发给各个直播间
+    """
+    url = "wss://irc-ws.chat.twitch.tv"
+    # 每个连接最多加入的频道数量
+    max_channels = 50
+    ping_interval = 60
+
+    _instance = None
+    _instance_lock = threading.Lock()
+
+    def __init__(self) -> None:
+        self.loop = asyncio.new_event_loop()
+        self.connections = []
+        self.rooms = {}     # 频道 -> 回调列表
+        self.session = None
+        self.thread = threading.Thread(target=self.loop.run_forever, daemon=True)
+        self.thread.start()
+
+    @classmethod
+    def get(cls) -> 'TwitchIRCPool':
+        with cls._instance_lock:
+            if cls._instance is None:
+                cls._instance = cls()
+            return cls._instance
+
+    def join(self, channel:str, callback):
+        """加入频道（线程安全），返回concurrent.futures.Future"""
+        return asyncio.run_coroutine_threadsafe(self._join(channel, callback), self.loop)
+
+    def part(self, channel:str, callback):
+        """离开频道（线程安全），返回concurrent.futures.Future"""
+        return asyncio.run_coroutine_threadsafe(self._part(channel, callback), self.loop)
+
+    def channel_active(self, channel:str) -> float:
+        """频道所在连接最后一次收到数据的时间，频道不在任何连接中时返回None"""
+        for conn in self.connections:
+            if channel in conn.channels:
+                return conn.last_active
+        return None
+
+    def last_active(self, channel:str) -> float:
+        active = self.channel_active(channel)
+        return time.monotonic() if active is None else active
+
+    async def _join(self, channel:str, callback):
+        if self.session is None:
+            self.session = aiohttp.ClientSession()
+        callbacks = self.rooms.setdefault(channel, [])
+        callbacks.append(callback)
+        if len(callbacks) > 1:
+            return
+        conn = min(
+            (c for c in self.connections if len(c.channels) < self.max_channels),
+            key=lambda c: len(c.channels),
+            default=None,
+        )
+        if conn is None:
+            conn = _IRCConnection(self)
+            self.connections.append(conn)
+        await conn.join(channel)
+
+    async def _part(self, channel:str, callback):
+        callbacks = self.rooms.get(channel, [])
+        if callback in callbacks:
+            callbacks.remove(callback)
+        if callbacks:
+            return
+        self.rooms.pop(channel, None)
+        for conn in self.connections:
+            if channel in conn.channels:
+                await conn.part(channel)
+        self.connections = [c for c in self.connections if c.channels]
+
+    async def handle(self, line:str, conn:_IRCConnection) -> bool:
+        """处理一行消息，返回False表示需要重连"""
+        command, channel, msg = parse_irc(line)
+        if command == 'PRIVMSG':
+            msg['recv_mono'], msg['recv_time'] = time.monotonic(), time.time()
+            for callback in self.rooms.get(channel, ()):
+                try:
+                    callback(dict(msg))
+                except Exception as e:
+                    logging.debug(e)
+        elif command == 'PING':
+            await conn.send(f'PONG {msg}')
+        elif command == 'RECONNECT':
+            return False
+        return True
+
+class Twitch:
+    """
+    Twitch直播间弹幕，每个直播间一个实例（通过site_class_v2由DanmakuClient实例化），实际的连接由TwitchIRCPool管理
+    """
+    def __init__(self, rid=None, q=None, url=None, **kwargs):
+        self.channel = str(rid).lower()
+        self.q = q
+        self.url = url
+        self.pool = None
+        self._callback = None
+        self._stop = None
+        self._loop = None
+        self._joined = None
+        self._first_active = None
+        self.kwargs = kwargs
+
+    @property
+    def last_active(self) -> float:
+        if self.pool is None:
+            return time.monotonic()
+        return self.pool.last_active(self.channel)
+
+    @property
+    def first_active(self) -> float:
+        """加入频道后第一次收到数据（弹幕或者连接上的任意消息）的时间，DanmakuSource据此判断重连成功"""
+        if self._first_active is None and self._joined is not None and self.pool is not None:
+            active = self.pool.channel_active(self.channel)
+            if active is not None and active > self._joined:
+                self._first_active = active
+        return self._first_active
+
+    def _put(self, msg:dict):
+        # 在连接池的线程中调用，通过队列的put写入，由队列的策略（阻塞、丢弃）处理队列已满的情况
+        asyncio.run_coroutine_threadsafe(self.q.put(msg), self._loop)
+
+    async def start(self):
+        self._loop = asyncio.get_running_loop()
+        self._stop = asyncio.Event()
+        self._callback = self._put
+        self.pool = TwitchIRCPool.get()
+        self._joined = time.monotonic()
+        await asyncio.wrap_future(self.pool.join(self.channel, self._callback))
+        await self._stop.wait()
+
+    async def stop(self):
+        if self._stop is not None:
+            self._stop.set()
+        if self.pool is not None and self._callback is not None:
+            callback, self._callback = self._callback, None
+            await asyncio.wrap_future(self.pool.part(self.channel, callback))
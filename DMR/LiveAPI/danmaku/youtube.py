@@ -1,4 +1,4 @@
-import json, re, select, random, traceback, urllib, datetime, base64
+import re, time, logging, datetime, base64
 import asyncio, aiohttp
 
 # The core codes for YouTube support are basically from taizan-hokuto/pytchat
@@ -9,65 +9,154 @@ headers = {
 
 
 class Youtube:
-    q = None
-    url = ""
-    vid = ""
-    ctn = ""
-    client = None
-    stop = False
+    """
+    YouTube直播聊天，每个直播间一个实例（通过site_class_v2由DanmakuClient实例化）
+    轮询间隔按照服务器返回的timeoutMs调整，同一个事件循环中的所有直播间共用一个HTTP会话
+    """
+    base_url = "https://www.youtube.com"
+    key = "eW91dHViZWkvdjEvbGl2ZV9jaGF0L2dldF9saXZlX2NoYXQ/a2V5PUFJemFTeUFPX0ZKMlNscVU4UTRTVEVITEdDaWx3X1k5XzExcWNXOA=="
+    # 轮询间隔的范围（秒），服务器没有给出timeoutMs时使用default_interval
+    min_interval = 0.5
+    max_interval = 10
+    default_interval = 1
 
-    @classmethod
-    async def run(cls, url, q, client, **kargs):
-        from .paramgen import liveparam
+    # 事件循环 -> [会话, 引用计数]，aiohttp的会话不能跨事件循环使用
+    _sessions = {}
 
-        cls.q = q
-        cls.url = url
-        cls.client = client
-        cls.stop = False
-        cls.key = "eW91dHViZWkvdjEvbGl2ZV9jaGF0L2dldF9saXZlX2NoYXQ/a2V5PUFJemFTeUFPX0ZKMlNscVU4UTRTVEVITEdDaWx3X1k5XzExcWNXOA=="
-        await cls.get_url()
-        while cls.stop == False:
-            try:
-                await cls.get_room_info()
-                cls.ctn = liveparam.getparam(cls.vid, cls.cid, 1)
-                await cls.get_chat()
-            except:
-                traceback.print_exc()
-                await asyncio.sleep(1)
+    def __init__(self, rid=None, q=None, url=None, **kwargs):
+        self.rid = rid
+        self.q = q
+        self.url = url or f"{self.base_url}/channel/{rid}"
+        self.cid = ""
+        self.vid = ""
+        self.ctn = ""
+        self.client = None
+        self._stop = False
+        self.last_active = time.monotonic()
+        # 第一次成功获取聊天消息的时间，DanmakuSource据此判断重连成功
+        self.first_active = None
+        self.kwargs = kwargs
 
     @classmethod
-    async def stop(cls):
-        cls.stop == True
+    def _acquire_session(cls) -> aiohttp.ClientSession:
+        loop = asyncio.get_running_loop()
+        entry = cls._sessions.get(loop)
+        if entry is None or entry[0].closed:
+            entry = cls._sessions[loop] = [aiohttp.ClientSession(), 0]
+        entry[1] += 1
+        return entry[0]
 
     @classmethod
-    async def get_url(cls):
-        a = re.search(r"youtube.com/channel/([^/?]+)", cls.url)
+    async def _release_session(cls):
+        loop = asyncio.get_running_loop()
+        entry = cls._sessions.get(loop)
+        if entry is None:
+            return
+        entry[1] -= 1
+        if entry[1] <= 0:
+            del cls._sessions[loop]
+            await entry[0].close()
+
+    async def start(self):
+        from .paramgen import liveparam
+
+        self._stop = False
+        self.client = self._acquire_session()
+        retry = 0
         try:
-            cid = a.group(1)
-            cls.cid = cid
-            cls.url = f"https://www.youtube.com/channel/{cid}/videos"
-        except:
-            a = re.search(r"youtube.com/watch\?v=([^/?]+)", cls.url)
-            async with cls.client.request(
-                "get", f"https://www.youtube.com/embed/{a.group(1)}"
+            await self.get_url()
+            while not self._stop:
+                try:
+                    await self.get_room_info()
+                    self.ctn = liveparam.getparam(self.vid, self.cid, 1)
+                    await self.get_chat()
+                    retry = 0
+                except asyncio.CancelledError:
+                    raise
+                except Exception as e:
+                    logging.debug(f'YouTube弹幕获取失败: {e}')
+                    retry += 1
+                    await asyncio.sleep(min(2 ** retry, 30))
+        finally:
+            if self.client is not None:
+                self.client = None
+                await self._release_session()
+
+    async def stop(self):
+        self._stop = True
+
+    async def get_url(self):
+        a = re.search(r"youtube.com/channel/([^/?]+)", self.url)
+        if a:
+            self.cid = a.group(1)
+        else:
+            a = re.search(r"youtube.com/watch\?v=([^/?&]+)", self.url)
+            async with self.client.request(
+                "get", f"{self.base_url}/embed/{a.group(1)}", headers=headers
             ) as resp:
                 b = re.search(r'\\"channelId\\":\\"(.{24})\\"', await resp.text())
-                cls.cid = b.group(1)
-                cls.url = f"https://www.youtube.com/channel/{cls.cid}/videos"
+                self.cid = b.group(1)
+        self.url = f"{self.base_url}/channel/{self.cid}/videos"
 
-    @classmethod
-    async def get_room_info(cls):
-        async with cls.client.request("get", cls.url) as resp:
+    async def get_room_info(self):
+        async with self.client.request("get", self.url, headers=headers) as resp:
+            self.last_active = time.monotonic()
             t = re.search(
                 r'"gridVideoRenderer"((.(?!"gridVideoRenderer"))(?!"style":"UPCOMING"))+"label":"(LIVE|LIVE NOW|PREMIERING NOW)"([\s\S](?!"style":"UPCOMING"))+?("gridVideoRenderer"|</script>)',
                 await resp.text(),
             ).group(0)
-            cls.vid = re.search(r'"gridVideoRenderer".+?"videoId":"(.+?)"', t).group(1)
-            # print(cls.vid)
+            self.vid = re.search(r'"gridVideoRenderer".+?"videoId":"(.+?)"', t).group(1)
+
+    @staticmethod
+    def _text(runs) -> str:
+        message = ""
+        for r in runs or []:
+            if r.get("emoji"):
+                message += r["emoji"].get("shortcuts", [""])[0]
+            else:
+                message += r.get("text", "")
+        return message
+
+    @staticmethod
+    def _price(text:str) -> float:
+        a = re.search(r"[\d,]+(\.\d+)?", text or "")
+        try:
+            return float(a.group(0).replace(",", "")) if a else 0
+        except ValueError:
+            return 0
 
     @classmethod
-    async def get_chat_single(cls):
+    def decode_actions(cls, actions) -> list:
         msgs = []
+        for action in actions or []:
+            item = action.get("addChatItemAction", {}).get("item", {})
+            renderer = item.get("liveChatTextMessageRenderer")
+            msg_type = "danmaku"
+            if renderer is None:
+                renderer = item.get("liveChatPaidMessageRenderer")
+                msg_type = "super_chat"
+            if renderer is None:
+                continue
+            try:
+                msg = {}
+                msg["name"] = renderer["authorName"]["simpleText"]
+                msg["uid"] = renderer.get("authorExternalChannelId")
+                msg["content"] = cls._text(renderer.get("message", {}).get("runs"))
+                msg["color"] = "ffffff"
+                msg["msg_type"] = msg_type
+                if msg_type == "super_chat":
+                    msg["price"] = cls._price(renderer.get("purchaseAmountText", {}).get("simpleText"))
+                ts = renderer.get("timestampUsec")
+                msg["server_time"] = int(ts) / 1e6 if ts else -1
+                msgs.append(msg)
+            except (KeyError, TypeError, ValueError):
+                pass
+        return msgs
+
+    async def get_chat_single(self):
+        """
+        获取一次聊天消息，返回消息列表和服务器建议的下次轮询间隔（秒）
+        """
         data = {
             "context": {
                 "client": {
@@ -85,52 +174,40 @@ class Youtube:
                     ),
                 },
             },
-            "continuation": cls.ctn,
+            "continuation": self.ctn,
         }
-        u = f'https://www.youtube.com/{base64.b64decode(cls.key).decode("utf-8")}'
-        async with cls.client.request("post", u, headers=headers, json=data) as resp:
-            # print(await resp.text())
+        u = f'{self.base_url}/{base64.b64decode(self.key).decode("utf-8")}'
+        async with self.client.request("post", u, headers=headers, json=data) as resp:
             j = await resp.json()
-            j = j["continuationContents"]
-            cont = j["liveChatContinuation"]["continuations"][0]
-            if cont is None:
-                raise Exception("No Continuation")
-            metadata = (
-                cont.get("invalidationContinuationData")
-                or cont.get("timedContinuationData")
-                or cont.get("reloadContinuationData")
-                or cont.get("liveChatReplayContinuationData")
-            )
-            cls.ctn = metadata["continuation"]
-            # print(j['liveChatContinuation'].get('actions'))
-            for action in j["liveChatContinuation"].get("actions", []):
-                try:
-                    renderer = action["addChatItemAction"]["item"]["liveChatTextMessageRenderer"]
-                    msg = {}
-                    msg["name"] = renderer["authorName"]["simpleText"]
-                    message = ""
-                    runs = renderer["message"].get("runs")
-                    for r in runs:
-                        if r.get("emoji"):
-                            message += r["emoji"].get("shortcuts", [""])[0]
-                        else:
-                            message += r.get("text", "")
-                    msg["content"] = message
-                    msg["msg_type"] = "danmaku"
-                    msgs.append(msg)
-                except:
-                    pass
-
-        return msgs
+        self.last_active = time.monotonic()
+        if self.first_active is None:
+            self.first_active = self.last_active
+        j = j["continuationContents"]
+        cont = j["liveChatContinuation"]["continuations"][0]
+        if cont is None:
+            raise Exception("No Continuation")
+        metadata = (
+            cont.get("invalidationContinuationData")
+            or cont.get("timedContinuationData")
+            or cont.get("reloadContinuationData")
+            or cont.get("liveChatReplayContinuationData")
+        )
+        self.ctn = metadata["continuation"]
+        timeout = metadata.get("timeoutMs")
+        interval = int(timeout) / 1000 if timeout else self.default_interval
+        interval = min(max(interval, self.min_interval), self.max_interval)
+        return self.decode_actions(j["liveChatContinuation"].get("actions")), interval
 
-    @classmethod
-    async def get_chat(cls):
-        while cls.stop == False:
-            ms = await cls.get_chat_single()
-            if len(ms) != 0:
-                interval = 1 / len(ms)
-            else:
-                await asyncio.sleep(1)
+    async def get_chat(self):
+        while not self._stop:
+            t0 = time.monotonic()
+            ms, interval = await self.get_chat_single()
+            # 将这一批消息均匀分布在下次轮询之前，避免弹幕集中在同一时间出现
+            step = interval / len(ms) if ms else 0
             for m in ms:
-                await cls.q.put(m)
-                await asyncio.sleep(interval)
+                m["recv_mono"], m["recv_time"] = time.monotonic(), time.time()
+                await self.q.put(m)
+                await asyncio.sleep(step)
+            rest = interval - (time.monotonic() - t0)
+            if rest > 0:
+                await asyncio.sleep(rest)
@@ -12,6 +12,8 @@ def concat_rid(plat: str, rid: str) -> str:
 
 
 def split_url(url: str):
+    if 'twitch.tv/' in url:
+        return 'twitch', re.findall(r'twitch\.tv/([\w]*)', url)[0].lower()
     platform = re.findall(r'\.(.*).com/', url)[0]
     rid = re.findall(r'\.com/([\w]*)', url)[0]
 
@@ -15,6 +15,8 @@ from DMR.message import PipeMessage
 from DMR.LiveAPI import *
 from os.path import join, exists
 from DMR.utils import *
+from .chunks import ChunkManifest
+from .scheduler import RenderScheduler
 
 
 def isvideo(path: str) -> bool:
@@ -26,23 +28,24 @@ def isvideo(path: str) -> bool:
 
 
 class Render():
-    def __init__(self, pipe, nrenders=3, debug=False, **kwargs) -> None:
+    def __init__(self, pipe, nrenders=3, max_renders=0, max_cpu=90, debug=False, **kwargs) -> None:
         self.sender = pipe
         self.nrenders = int(nrenders)
         self.debug = debug
         self.kwargs = kwargs
 
-        self.render_queue = queue.Queue()
+        self.render_queue = RenderScheduler(self.nrenders, max_renders=max_renders, max_cpu=max_cpu)
         self.state_dict = dict()
         self._lock = threading.Lock()
 
-        self.render_group = [None for _ in range(self.nrenders)]
+        self.render_group = [None for _ in range(self.render_queue.nworkers)]
+        # 边录边渲染的任务，按录制中的视频文件名索引
+        self.live_jobs = {}
 
-    def _distribute(self, task):
+    def _distribute(self, task, enqueue=True):
         with self._lock:
             if task == 'exit':
-                for _ in range(self.nrenders):
-                    self.render_queue.put(task)
+                self.render_queue.put(task)
                 return
 
             group = task.get('group')
@@ -54,7 +57,7 @@ class Render():
             else:
                 self.state_dict[group] = [task]
 
-            if task.get('msg_type') == 'render':
+            if task.get('msg_type') == 'render' and enqueue:
                 self.render_queue.put(task)
 
     def _gather(self, task, status, desc=''):
@@ -83,9 +86,8 @@ class Render():
 
     def _render_subprocess(self, pid):
         while not self.stoped:
-            task = self.render_queue.get()
+            task = self.render_queue.get(pid)
             if task == 'exit':
-                self.render_queue.task_done()
                 return
 
             render_config = task['config']
@@ -98,10 +100,13 @@ class Render():
             target_render = TargetRender(debug=self.debug, **render_config)
             self.render_group[pid] = target_render
 
-            logging.info(f'正在渲染: {task["video"]}')
+            logging.info(f'正在渲染: {task["video"]}，排队{task["queue_wait"]:.0f}秒.')
+            status = False
+            duration = None
             try:
                 status, info = target_render.render_one(**task.copy())
                 if status:
+                    duration = FFprobe.get_duration(task['video'])
                     if task.get('video_info'):
                         task['video_info']['has_danmu'] = '（带弹幕版）'
                         task['video_info']['src_file'] = task['video']
@@ -114,18 +119,22 @@ class Render():
             except Exception as e:
                 logging.exception(e)
                 self._gather(task, 'error', desc=e)
+            finally:
+                self.render_queue.finish(pid, duration)
 
+            if task.get('speed'):
+                logging.info(f'渲染完成: {task["video"]}，渲染速度{task["speed"]:.2f}x.')
             self.render_queue.task_done()
 
     def start(self):
         self.stoped = False
-        for pid in range(self.nrenders):
+        for pid in range(self.render_queue.nworkers):
             thread = threading.Thread(
                 target=self._render_subprocess, args=(pid,), daemon=True)
             thread.start()
         return
 
-    def add(self, video, danmaku=None, output=None, group=None, video_info=None, render_config=None, **kwargs):
+    def add(self, video, danmaku=None, output=None, group=None, video_info=None, render_config=None, priority=None, **kwargs):
         if video == 'end':
             self._distribute({
                 'msg_type': 'end',
@@ -139,14 +148,11 @@ class Render():
         if not danmaku:
             danmaku = os.path.splitext(video)[0] + '.ass'
         if not output:
-            filename = os.path.splitext(os.path.basename(video))[
-                0] + f"（带弹幕版）.{render_config.get('format','mp4')}"
-            if render_config.get('output_dir'):
-                output_dir = render_config.get('output_dir')
-            else:
-                output_dir = os.path.dirname(video)+'（带弹幕版）'
-            os.makedirs(output_dir, exist_ok=True)
-            output = join(output_dir, filename)
+            output = self.output_name(video, render_config)
+
+        resume = ChunkManifest.exists(output)
+        if resume:
+            logging.info(f'检测到未完成的渲染 {output}，将继续渲染.')
 
         self._distribute({
             'msg_type': 'render',
@@ -156,12 +162,111 @@ class Render():
             'group': group,
             'video_info': video_info,
             'config': render_config,
+            'resume': resume,
+            'priority': render_config.get('priority', 0) if priority is None else priority,
             'kwargs': kwargs,
         })
 
+    @staticmethod
+    def output_name(video, render_config) -> str:
+        filename = os.path.splitext(os.path.basename(video))[
+            0] + f"（带弹幕版）.{render_config.get('format','mp4')}"
+        if render_config.get('output_dir'):
+            output_dir = render_config.get('output_dir')
+        else:
+            output_dir = os.path.dirname(video)+'（带弹幕版）'
+        os.makedirs(output_dir, exist_ok=True)
+        return join(output_dir, filename)
+
+    @staticmethod
+    def _live_key(video) -> str:
+        # streamgears录制时文件名带有.part后缀，录制完成后去掉
+        video = os.path.abspath(video)
+        return video[:-5] if video.endswith('.part') else video
+
+    def add_live(self, video, danmaku, group=None, render_config=None):
+        """
+        开始边录边渲染：video和danmaku是正在录制的视频和弹幕文件，分段结束时调用finish_live
+        """
+        if not render_config:
+            render_config = self.kwargs
+        if render_config.get('engine') != 'ffmpeg':
+            logging.warning('边录边渲染只支持ffmpeg渲染引擎.')
+            return False
+        from .ffmpegrender import FFmpegRender
+        from .liverender import LiveRender
+        target_render = FFmpegRender(debug=self.debug, **render_config)
+        job = LiveRender(target_render, video, danmaku,
+                         workdir=os.path.splitext(video)[0] + '.live',
+                         ext='.' + render_config.get('format', 'mp4'))
+        with self._lock:
+            self.live_jobs[self._live_key(video)] = job
+        job.start()
+        return True
+
+    def finish_live(self, raw_video, video, danmaku=None, group=None, video_info=None, render_config=None, priority=None,
+                    **kwargs) -> bool:
+        """
+        录制分段结束（已经改名为video），完成对应的边录边渲染任务，没有这个任务时返回False
+        边录边渲染失败时改为普通渲染
+        """
+        with self._lock:
+            job = self.live_jobs.pop(self._live_key(raw_video), None)
+        if job is None:
+            return False
+        if not render_config:
+            render_config = self.kwargs
+        if not danmaku:
+            danmaku = os.path.splitext(video)[0] + '.ass'
+        task = {
+            'msg_type': 'render',
+            'video': video,
+            'danmaku': danmaku,
+            'output': self.output_name(video, render_config),
+            'group': group,
+            'video_info': video_info,
+            'config': render_config,
+            'priority': render_config.get('priority', 0) if priority is None else priority,
+            'kwargs': kwargs,
+        }
+        self._distribute(task, enqueue=False)
+
+        def finish():
+            t = time.time()
+            try:
+                status, info = job.wait(task['output'])
+            except Exception as e:
+                logging.exception(e)
+                status, info = False, e
+            if status:
+                logging.info(f'边录边渲染完成: {video}，分段结束后用时{time.time()-t:.1f}秒.')
+                if job.render.advanced_render_args.get('render_cache', False) and exists(danmaku):
+                    try:
+                        job.render.record_cache(job.render.cache_key(video, danmaku), video, danmaku, task['output'])
+                    except Exception as e:
+                        logging.debug(e)
+                if task.get('video_info'):
+                    task['video_info']['has_danmu'] = '（带弹幕版）'
+                    task['video_info']['src_file'] = task['video']
+                    task['video_info']['dm_file'] = task['danmaku']
+                self._gather(task, 'info', desc=info)
+            elif not self.stoped and exists(video) and exists(danmaku):
+                logging.warning(f'边录边渲染 {video} 失败，将重新渲染.')
+                logging.debug(info)
+                self.render_queue.put(task)
+            else:
+                self._gather(task, 'error', desc=info)
+
+        threading.Thread(target=finish, daemon=True).start()
+        return True
+
     def wait(self):
         self.render_queue.join()
 
+    def stats(self) -> dict:
+        """渲染调度的状态：同时渲染的任务数、正在渲染和等待的任务、各并发数的总渲染速度、最近任务的排队时间和渲染速度"""
+        return self.render_queue.stats()
+
     # def render_only(self, input_dir):
     #     files = glob.glob(input_dir+'/*')
     #     videos = [f for f in files if isvideo(f)]
@@ -194,6 +299,14 @@ class Render():
 
     def stop(self):
         self.stoped = True
+        with self._lock:
+            live_jobs = list(self.live_jobs.values())
+            self.live_jobs.clear()
+        for job in live_jobs:
+            try:
+                job.stop()
+            except Exception as e:
+                logging.debug(e)
         for proc in self.render_group:
             try:
                 proc.stop()
@@ -0,0 +1,188 @@
+import logging
+import math
+import re
+from collections import Counter
+
+from DMR.utils import *
+
+__all__ = ['optimize_ass', 'font_family']
+
+_MOVE = re.compile(r'^\{\\move\((-?\d+),(-?\d+),(-?\d+),(-?\d+)\)\}')
+_COLOR = re.compile(r'\{\\alpha&H([0-9a-fA-F]{2})\\1c(?:&H)?([0-9a-fA-F]{6})&\}')
+
+def _fmt_time(sec:float) -> str:
+    return '%02d:%02d:%05.2f' % sec2hms(sec)
+
+def font_family(font_path:str) -> str:
+    """读取字体文件的字体名称（需要PIL），失败时返回None"""
+    if not font_path:
+        return None
+    try:
+        from PIL import ImageFont
+        return ImageFont.truetype(font_path, 10).getname()[0]
+    except Exception as e:
+        logging.debug(f'无法读取字体文件{font_path}的字体名称: {e}')
+        return None
+
+def _watermark_events(text:str, duration:float, width:int, height:int, scale:float, interval:float=30, show:float=10, margin:int=50) -> list:
+    """
+    与FFmpegRender的drawtext水印相同的效果：四个角落依次显示，每隔interval秒切换一次，每次显示show秒
+    """
+    text = text.replace('\\', '\\\\').replace('{', '\\{').replace('}', '\\}').replace('\n', ' ')
+    m = int(margin * scale)
+    corners = [
+        '{\\an7\\pos(%d,%d)}' % (m, m),
+        '{\\an9\\pos(%d,%d)}' % (width - m, m),
+        '{\\an3\\pos(%d,%d)}' % (width - m, height - m),
+        '{\\an1\\pos(%d,%d)}' % (m, height - m),
+    ]
+    events = []
+    for k in range(math.ceil(duration / (interval * 4))):
+        for i, pos in enumerate(corners):
+            st = k * interval * 4 + i * interval
+            if st >= duration:
+                break
+            events.append((st, f'Dialogue: 2,{_fmt_time(st)},{_fmt_time(st + show)},watermark,,0,0,0,,{pos}{text}'))
+    return events
+
+def optimize_ass(src:str,
+                 dst:str,
+                 duration:float=None,
+                 max_events:int=0,
+                 window:float=1,
+                 max_styles:int=32,
+                 watermark:str=None,
+                 watermark_font:str=None,
+                 video_size:tuple=None,
+                 ) -> dict:
+    """
+    在交给ffmpeg（libass）渲染之前精简AssWriter生成的ASS弹幕文件，返回统计信息
+    1. 删除看不到的事件：持续时间不大于0、在视频结束之后开始、纵坐标在画面外的弹幕，以及ffmpeg无法渲染的图片弹幕（Picture）
+    2. 将滚动弹幕中的透明度和颜色标签提取为样式，每条弹幕只保留\\move标签（最多生成max_styles个样式）
+    3. max_events大于0时，每window秒内最多保留max_events条滚动弹幕（按时间先后保留）
+    4. 指定watermark时将水印写成ASS事件，代替逐帧计算的drawtext滤镜（需要知道视频时长）
+    duration: 视频时长（秒），未知时为None
+    video_size: 视频分辨率(宽, 高)，用于换算水印大小，未知时按ASS的分辨率计算
+    """
+    header, events, styles = [], [], {}
+    width = height = 0
+    in_events = False
+    with open(src, encoding='utf-8') as f:
+        for row in f:
+            row = row.rstrip('\r\n')
+            if not in_events:
+                header.append(row)
+                if row.startswith('PlayResX:'):
+                    width = int(row.split(':')[-1].strip())
+                elif row.startswith('PlayResY:'):
+                    height = int(row.split(':')[-1].strip())
+                elif row.startswith('Style:'):
+                    fields = row[6:].strip().split(',')
+                    styles[fields[0]] = (len(header) - 1, fields)
+                elif row.startswith('Format:') and header[-2:-1] == ['[Events]']:
+                    in_events = True
+                continue
+            if row.startswith('Dialogue:') or row.startswith('Picture:'):
+                events.append(row)
+
+    stats = Counter(total=len(events))
+    r2l = styles.get('R2L')
+    fontsize = int(r2l[1][2]) if r2l else 0
+    parsed = []
+    colors = Counter()
+    buckets = Counter()
+    for row in events:
+        event_type, _, rest = row.partition(':')
+        fields = rest.strip().split(',', 9)
+        if event_type == 'Picture':
+            stats['picture'] += 1
+            continue
+        if len(fields) < 10:
+            parsed.append((0, row, None, None, None))
+            continue
+        try:
+            st, et = hms2sec(*fields[1].split(':')), hms2sec(*fields[2].split(':'))
+        except ValueError:
+            parsed.append((0, row, None, None, None))
+            continue
+        if et <= st or (duration and duration > 0 and st >= duration):
+            stats['invisible'] += 1
+            continue
+        if fields[3] != 'R2L':
+            parsed.append((st, row, None, None, None))
+            continue
+
+        text = fields[9]
+        move = _MOVE.match(text)
+        if move and height:
+            y0, y1 = int(move.group(2)), int(move.group(4))
+            if min(y0, y1) > height + fontsize or max(y0, y1) < -fontsize:
+                stats['invisible'] += 1
+                continue
+        if max_events > 0:
+            bucket = int(st // window)
+            if buckets[bucket] >= max_events:
+                stats['clamped'] += 1
+                continue
+            buckets[bucket] += 1
+        color = None
+        if move:
+            color = _COLOR.match(text, move.end())
+        key = (color.group(1).upper(), color.group(2).upper()) if color else None
+        if key:
+            colors[key] += 1
+        parsed.append((st, row, fields, move, color))
+
+    # 出现次数最多的颜色提取为样式，R2L样式本身就是白色
+    hoisted = {}
+    if r2l:
+        base_color = r2l[1][3].upper()
+        for key, _ in colors.most_common(max_styles):
+            primary = f'&H{key[0]}{key[1]}'
+            if primary == base_color:
+                hoisted[key] = 'R2L'
+            else:
+                hoisted[key] = f'R2L_{key[0]}{key[1]}'
+        new_styles = []
+        for key, name in hoisted.items():
+            if name == 'R2L':
+                continue
+            fields = list(r2l[1])
+            fields[0] = name
+            fields[3] = f'&H{key[0]}{key[1]}'
+            new_styles.append('Style: ' + ','.join(fields))
+        pos = r2l[0] + 1
+        header[pos:pos] = new_styles
+
+    output = []
+    for st, row, fields, move, color in parsed:
+        if color is not None:
+            key = (color.group(1).upper(), color.group(2).upper())
+            name = hoisted.get(key)
+            if name:
+                fields = list(fields)
+                fields[3] = name
+                text = fields[9]
+                fields[9] = text[:move.end()] + text[color.end():]
+                row = 'Dialogue: ' + ','.join(fields)
+                stats['hoisted'] += 1
+        output.append((st, row))
+
+    if watermark and duration and duration > 0 and width and height:
+        scale = height / video_size[1] if video_size and video_size[1] else 1
+        font = watermark_font or (r2l[1][1] if r2l else 'Microsoft YaHei')
+        style = f'Style: watermark,{font},{int(27 * scale)},&H80FFFFFF,&H80FFFFFF,&H80000000,&H80000000,0,0,0,0,100,100,0,0,1,0,0,7,0,0,0,1'
+        pos = max((i for i, row in enumerate(header) if row.startswith('Style:')), default=len(header) - 4) + 1
+        header.insert(pos, style)
+        marks = _watermark_events(watermark, duration, width, height, scale)
+        output += marks
+        output.sort(key=lambda x: x[0])
+        stats['watermark'] = len(marks)
+
+    with open(dst, 'w', encoding='utf-8') as f:
+        f.write('\n'.join(header) + '\n')
+        f.writelines(row + '\n' for _, row in output)
+
+    stats['output'] = len(output)
+    stats['styles'] = sum(1 for name in hoisted.values() if name != 'R2L')
+    return dict(stats)
@@ -0,0 +1,252 @@
+import bisect
+import hashlib
+import json
+import logging
+import os
+import re
+import threading
+from os.path import exists, join
+
+from DMR.utils import *
+
+__all__ = ['split_ranges', 'slice_ass', 'write_concat_list', 'chunks_dir', 'ChunkManifest', 'ass_intervals', 'plan_smart_render',
+           'parse_event', 'shift_event']
+
+_MOVE = re.compile(r'^\{\\move\((-?\d+),(-?\d+),(-?\d+),(-?\d+)\)\}')
+
+def split_ranges(keyframes:list, duration:float, nchunks:int, min_length:float=10) -> list:
+    """
+    在关键帧处把视频分为nchunks段（尽量等长），返回[(开始时间, 结束时间), ...]
+    每段至少min_length秒，关键帧不够时分段数量会少于nchunks
+    """
+    if duration <= 0 or nchunks < 2 or not keyframes:
+        return [(0, duration)]
+    keyframes = sorted(keyframes)
+    bounds = [0]
+    for i in range(1, nchunks):
+        target = duration * i / nchunks
+        pos = bisect.bisect_left(keyframes, target)
+        candidates = [keyframes[j] for j in (pos - 1, pos) if 0 <= j < len(keyframes)]
+        if not candidates:
+            continue
+        k = min(candidates, key=lambda x: abs(x - target))
+        if k - bounds[-1] >= min_length and duration - k >= min_length:
+            bounds.append(k)
+    return list(zip(bounds, bounds[1:] + [duration]))
+
+def ass_intervals(filename:str, gap:float=1) -> list:
+    """
+    读取ASS文件中所有Dialogue事件的显示时间并合并，返回[(开始时间, 结束时间), ...]（有弹幕显示的时间段）
+    间隔小于gap秒的时间段也会合并
+    """
+    intervals = []
+    with open(filename, encoding='utf-8') as f:
+        for row in f:
+            if not row.startswith('Dialogue:'):
+                continue
+            fields = row[9:].strip().split(',', 9)
+            if len(fields) < 10:
+                continue
+            try:
+                st, et = hms2sec(*fields[1].split(':')), hms2sec(*fields[2].split(':'))
+            except ValueError:
+                continue
+            if et > st:
+                intervals.append((st, et))
+    intervals.sort()
+    merged = []
+    for st, et in intervals:
+        if merged and st - merged[-1][1] < gap:
+            if et > merged[-1][1]:
+                merged[-1][1] = et
+        else:
+            merged.append([st, et])
+    return [tuple(x) for x in merged]
+
+def plan_smart_render(keyframes:list, duration:float, intervals:list, min_copy:float=2) -> list:
+    """
+    按关键帧把视频分为GOP，与弹幕时间段重叠的GOP需要重新编码，其余的直接复制
+    返回[(开始时间, 结束时间, 是否重新编码), ...]，相邻且状态相同的GOP合并为一段
+    短于min_copy秒的复制段并入相邻的编码段，避免过多的分段
+    """
+    if duration <= 0:
+        return []
+    bounds = [0] + [k for k in sorted(keyframes) if 0 < k < duration] + [duration]
+    segments = []
+    j = 0
+    for t0, t1 in zip(bounds, bounds[1:]):
+        # 第一个关键帧之前的部分无法直接复制
+        dirty = not keyframes or (t0 == 0 and min(keyframes) > 1e-3)
+        while j < len(intervals) and intervals[j][1] <= t0:
+            j += 1
+        if j < len(intervals) and intervals[j][0] < t1:
+            dirty = True
+        if segments and segments[-1][2] == dirty:
+            segments[-1][1] = t1
+        else:
+            segments.append([t0, t1, dirty])
+
+    for seg in segments:
+        if not seg[2] and seg[1] - seg[0] < min_copy and len(segments) > 1:
+            seg[2] = True
+    merged = []
+    for seg in segments:
+        if merged and merged[-1][2] == seg[2]:
+            merged[-1][1] = seg[1]
+        else:
+            merged.append(list(seg))
+    return [tuple(x) for x in merged]
+
+def _fmt_time(sec:float) -> str:
+    return '%02d:%02d:%05.2f' % sec2hms(max(sec, 0))
+
+def parse_event(row:str):
+    """解析一行ASS事件，返回(事件类型, 字段, 开始时间, 结束时间)，不是事件或者格式错误时返回None"""
+    if not (row.startswith('Dialogue:') or row.startswith('Picture:')):
+        return None
+    event_type, _, rest = row.partition(':')
+    fields = rest.strip().split(',', 9)
+    if len(fields) < 10:
+        return None
+    try:
+        st, et = hms2sec(*fields[1].split(':')), hms2sec(*fields[2].split(':'))
+    except ValueError:
+        return None
+    return event_type, fields, st, et
+
+def shift_event(event_type:str, fields:list, st:float, et:float, start:float) -> str:
+    """
+    把事件的时间减去start，返回新的一行
+    在start之前开始的滚动弹幕（\\move）加上运动的开始和结束时间，保持原来的运动轨迹
+    """
+    fields = list(fields)
+    text = fields[9]
+    if st < start:
+        move = _MOVE.match(text)
+        if move and et > st:
+            # 使用\move的t1, t2参数（相对于事件开始的毫秒数，t1为负数）保持原来的起点和速度
+            x0, y0, x1, y1 = move.groups()
+            t1, t2 = round((st - start) * 1000), round((et - start) * 1000)
+            text = '{\\move(%s,%s,%s,%s,%d,%d)}' % (x0, y0, x1, y1, t1, t2) + text[move.end():]
+    fields[1] = _fmt_time(max(st, start) - start)
+    fields[2] = _fmt_time(et - start)
+    fields[9] = text
+    return f'{event_type}: ' + ','.join(fields) + '\n'
+
+def slice_ass(src:str, dst:str, start:float, end:float) -> int:
+    """
+    截取ASS文件中与[start, end)重叠的事件，时间减去start，返回事件数量
+    """
+    cnt = 0
+    with open(src, encoding='utf-8') as f, open(dst, 'w', encoding='utf-8') as out:
+        in_events = False
+        for row in f:
+            if not in_events:
+                out.write(row)
+                if row.startswith('[Events]'):
+                    in_events = True
+                continue
+            if not (row.startswith('Dialogue:') or row.startswith('Picture:')):
+                out.write(row)
+                continue
+            event = parse_event(row)
+            if event is None:
+                continue
+            event_type, fields, st, et = event
+            if et <= start or st >= end:
+                continue
+            out.write(shift_event(event_type, fields, st, et, start))
+            cnt += 1
+    return cnt
+
+def write_concat_list(filename:str, files:list):
+    """生成ffmpeg concat demuxer使用的文件列表"""
+    with open(filename, 'w', encoding='utf-8') as f:
+        for path in files:
+            path = str(path).replace('\\', '/').replace("'", "'\\''")
+            f.write(f"file '{path}'\n")
+
+def chunks_dir(output:str) -> str:
+    """分段渲染的临时文件夹（保存各段的视频、弹幕和进度记录）"""
+    return os.path.splitext(output)[0] + '.chunks'
+
+def file_hash(filename:str) -> str:
+    h = hashlib.sha1()
+    with open(filename, 'rb') as f:
+        for block in iter(lambda: f.read(1024 * 1024), b''):
+            h.update(block)
+    return h.hexdigest()
+
+class ChunkManifest():
+    """
+    分段渲染的进度记录（分段文件夹中的manifest.json），用于中断后继续渲染
+    key记录了视频文件、弹幕文件和渲染参数，任何一项变化时之前的进度都会作废
+    每段渲染完成后立即写入记录，重新开始时检查已完成的分段（大小和时长）并跳过
+    """
+    name = 'manifest.json'
+
+    def __init__(self, workdir:str, key:dict) -> None:
+        self.workdir = workdir
+        self.filename = join(workdir, self.name)
+        self.key = key
+        self.ranges = []
+        self.chunks = {}
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def exists(output:str) -> bool:
+        return exists(join(chunks_dir(output), ChunkManifest.name))
+
+    def load(self) -> bool:
+        """读取进度记录，记录存在并且与当前任务一致时返回True"""
+        try:
+            with open(self.filename, encoding='utf-8') as f:
+                data = json.load(f)
+        except (OSError, ValueError):
+            return False
+        if data.get('key') != self.key:
+            logging.debug(f'{self.filename} 与当前渲染任务不一致，将重新渲染.')
+            return False
+        self.ranges = [tuple(r) for r in data.get('ranges', [])]
+        self.chunks = {int(i): info for i, info in data.get('chunks', {}).items()}
+        return bool(self.ranges)
+
+    def reset(self, ranges:list):
+        self.ranges = list(ranges)
+        self.chunks = {}
+        self.save()
+
+    def save(self):
+        with self._lock:
+            data = {
+                'key': self.key,
+                'ranges': self.ranges,
+                'chunks': {str(i): info for i, info in self.chunks.items()},
+            }
+            tmp = self.filename + '.tmp'
+            with open(tmp, 'w', encoding='utf-8') as f:
+                json.dump(data, f, ensure_ascii=False, indent=2)
+            os.replace(tmp, self.filename)
+
+    def is_done(self, i:int) -> bool:
+        """检查第i段是否已经完成：文件存在、大小与记录一致、时长与分段长度一致"""
+        info = self.chunks.get(i)
+        if not info:
+            return False
+        path = join(self.workdir, info['file'])
+        if not exists(path) or os.path.getsize(path) != info['size']:
+            return False
+        t0, t1 = self.ranges[i]
+        duration = FFprobe.get_duration(path)
+        return duration < 0 or abs(duration - (t1 - t0)) < 1
+
+    def mark_done(self, i:int, filename:str):
+        with self._lock:
+            self.chunks[i] = {
+                'file': os.path.basename(filename),
+                'size': os.path.getsize(filename),
+            }
+        self.save()
+
+    def progress(self) -> tuple:
+        return len(self.chunks), len(self.ranges)
@@ -1,18 +1,37 @@
+import bisect
+import hashlib
+import json
+import math
 import os
 import platform
 import signal
 import sys
 import subprocess
 import logging
+import shutil
 import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
 
 from tools import ToolsList
 
 from .baserender import BaseRender
-from os.path import exists
+from os.path import exists, join
 from DMR.utils import *
 
 
+# 影响输出内容的advanced_render_args及其默认值，其余参数（分段渲染、智能渲染、边录边渲染、缓存等）只影响渲染方式
+_OUTPUT_ARGS = {
+    'fps': None,
+    'gop': 5,
+    'filter_complex': None,
+    'ass_optimize': True,
+    'ass_max_events': 0,
+    'ass_event_window': 1,
+}
+
+
 class FFmpegRender(BaseRender):
     def __init__(self,
                  hwaccel_args: list,
@@ -40,8 +59,20 @@ class FFmpegRender(BaseRender):
         self.font_path = font_path  # 新增字体路径
         self.ffmpeg = ffmpeg if ffmpeg else ToolsList.get('ffmpeg')
         self.debug = debug
+        self.stoped = False
+        self.render_proc = None
+        self.render_procs = []
+        self._procs_lock = threading.Lock()
+        self.smart_stats = None
 
-    def render_helper(self, video: str, danmaku: str, output: str, to_stdout: bool = False, logfile=None):
+    def render_args(self, video: str, danmaku: str, output: str, watermark_in_ass: bool = False,
+                    start: float = None, length: float = None, audio: bool = True, seek: bool = True) -> list:
+        """
+        生成渲染使用的ffmpeg参数
+        start, length: 只渲染视频从start开始的length秒（分段渲染），弹幕文件的时间需要已经减去start
+        audio: 是否输出音频，为'copy'时直接复制音频
+        seek: 为False时输入的视频已经是从start开始的一段，start只用于计算水印的显示时间
+        """
         ffmpeg_args = [self.ffmpeg, '-y']
         ffmpeg_args += self.hwaccel_args
 
@@ -86,12 +117,17 @@ class FFmpegRender(BaseRender):
         else:
             filter_name = '-vf'
             filter_str = 'subtitles=filename=\'%s\'' % danmaku
+            if watermark_in_ass and self.font_path:
+                fontsdir = os.path.dirname(os.path.abspath(self.font_path))
+                if platform.system().lower() == 'windows':
+                    fontsdir = fontsdir.replace("\\", "/").replace(":/", "\\:/")
+                filter_str += ':fontsdir=\'%s\'' % fontsdir
             fps = self.advanced_render_args.get('fps')
             if fps:
                 filter_str += ',fps=fps=%i' % int(fps)
 
         # 四个位置的水印滤镜，依次循环显示
-        if self.watermark_text:
+        if self.watermark_text and not watermark_in_ass:
             interval = 30  # 每隔 30 秒出现
             duration = 10  # 每次持续 10 秒
             margin = 50  # 距离边缘 50 像素
@@ -100,45 +136,382 @@ class FFmpegRender(BaseRender):
             fontcolor = "white"
             alpha = 0.5  # 半透明度
 
-            # 四个角落位置，使用 `mod(t, interval * 4)` 来控制显示顺序
-            top_left = f"drawtext=text='{self.watermark_text}':fontcolor={fontcolor}@{alpha}:fontsize=27:x={margin}:y={margin}{fontfile}:enable='between(mod(t,{interval * 4}),0,{duration})'"
-            top_right = f"drawtext=text='{self.watermark_text}':fontcolor={fontcolor}@{alpha}:fontsize=27:x=(w-text_w-{margin}):y={margin}{fontfile}:enable='between(mod(t,{interval * 4}),{interval},{interval + duration})'"
-            bottom_right = f"drawtext=text='{self.watermark_text}':fontcolor={fontcolor}@{alpha}:fontsize=27:x=(w-text_w-{margin}):y=(h-text_h-{margin}){fontfile}:enable='between(mod(t,{interval * 4}),{interval * 2},{interval * 2 + duration})'"
-            bottom_left = f"drawtext=text='{self.watermark_text}':fontcolor={fontcolor}@{alpha}:fontsize=27:x={margin}:y=(h-text_h-{margin}){fontfile}:enable='between(mod(t,{interval * 4}),{interval * 3},{interval * 3 + duration})'"
+            # 四个角落位置，使用 `mod(t, interval * 4)` 来控制显示顺序，分段渲染时t需要加上这一段的开始时间
+            t = f't+{start:.3f}' if start else 't'
+            top_left = f"drawtext=text='{self.watermark_text}':fontcolor={fontcolor}@{alpha}:fontsize=27:x={margin}:y={margin}{fontfile}:enable='between(mod({t},{interval * 4}),0,{duration})'"
+            top_right = f"drawtext=text='{self.watermark_text}':fontcolor={fontcolor}@{alpha}:fontsize=27:x=(w-text_w-{margin}):y={margin}{fontfile}:enable='between(mod({t},{interval * 4}),{interval},{interval + duration})'"
+            bottom_right = f"drawtext=text='{self.watermark_text}':fontcolor={fontcolor}@{alpha}:fontsize=27:x=(w-text_w-{margin}):y=(h-text_h-{margin}){fontfile}:enable='between(mod({t},{interval * 4}),{interval * 2},{interval * 2 + duration})'"
+            bottom_left = f"drawtext=text='{self.watermark_text}':fontcolor={fontcolor}@{alpha}:fontsize=27:x={margin}:y=(h-text_h-{margin}){fontfile}:enable='between(mod({t},{interval * 4}),{interval * 3},{interval * 3 + duration})'"
 
             watermark_filters = ",".join([top_left, top_right, bottom_right, bottom_left])
             filter_str += f",{watermark_filters}"
 
+        seek_args = []
+        if start and seek:
+            seek_args += ['-ss', '%.3f' % start]
+        if length:
+            seek_args += ['-t', '%.3f' % length]
+        if audio == 'copy':
+            audio_args = ['-c:a', 'copy']
+        else:
+            audio_args = ['-c:a', self.aencoder, *self.aencoder_args] if audio else ['-an']
+
         ffmpeg_args += [
             '-fflags', '+discardcorrupt',
+            *seek_args,
             '-i', video,
             *dash_args,
             filter_name, filter_str,
 
             '-c:v', self.vencoder,
             *self.vencoder_args,
-            '-c:a', self.aencoder,
-            *self.aencoder_args,
+            *audio_args,
             *scale_args,
             output,
         ]
 
-        ffmpeg_args = [str(x) for x in ffmpeg_args]
-        logging.debug(f'ffmpeg render args: {ffmpeg_args}')
-
-        if not logfile:
-            logfile = tempfile.TemporaryFile()
+        return [str(x) for x in ffmpeg_args]
 
+    def run_ffmpeg(self, ffmpeg_args: list, to_stdout: bool = False, logfile=None) -> int:
+        logging.debug(f'ffmpeg render args: {ffmpeg_args}')
         if to_stdout or self.debug:
-            self.render_proc = subprocess.Popen(
+            proc = subprocess.Popen(
                 ffmpeg_args, stdin=sys.stdin, stdout=sys.stdout, stderr=subprocess.STDOUT, bufsize=10 ** 8)
         else:
-            self.render_proc = subprocess.Popen(
+            proc = subprocess.Popen(
                 ffmpeg_args, stdin=subprocess.PIPE, stdout=logfile, stderr=subprocess.STDOUT, bufsize=10 ** 8)
+        with self._procs_lock:
+            self.render_proc = proc
+            self.render_procs.append(proc)
+        try:
+            return proc.wait()
+        finally:
+            with self._procs_lock:
+                self.render_procs.remove(proc)
 
-        self.render_proc.wait()
+    def render_helper(self, video: str, danmaku: str, output: str, to_stdout: bool = False, logfile=None):
+        # 精简弹幕文件，减少libass的渲染开销，水印也尽量写入弹幕文件
+        watermark_in_ass = False
+        if self.advanced_render_args.get('ass_optimize', True):
+            danmaku, watermark_in_ass = self.optimize_danmaku(video, danmaku, output)
+
+        ffmpeg_args = self.render_args(video, danmaku, output, watermark_in_ass)
+        if not logfile:
+            logfile = tempfile.TemporaryFile()
+        self.run_ffmpeg(ffmpeg_args, to_stdout, logfile)
         return logfile
 
+    def settings_hash(self) -> str:
+        """影响输出的渲染参数的哈希（不包括只影响渲染方式的参数）"""
+        settings = {
+            'vencoder': self.vencoder,
+            'vencoder_args': self.vencoder_args,
+            'aencoder': self.aencoder,
+            'aencoder_args': self.aencoder_args,
+            'output_resize': self.output_resize,
+            'advanced_render_args': {k: self.advanced_render_args.get(k, default)
+                                     for k, default in _OUTPUT_ARGS.items()},
+            'watermark_text': self.watermark_text,
+            'font_path': self.font_path,
+        }
+        return hashlib.sha1(json.dumps(settings, sort_keys=True, default=str).encode('utf-8')).hexdigest()
+
+    def render_key(self, video: str, danmaku: str) -> dict:
+        """分段进度记录使用的任务标识：视频文件、弹幕文件内容和影响输出的渲染参数"""
+        from .chunks import file_hash
+        stat = os.stat(video)
+        return {
+            'video': os.path.abspath(video),
+            'video_size': stat.st_size,
+            'video_mtime': int(stat.st_mtime),
+            'danmaku': file_hash(danmaku),
+            'settings': self.settings_hash(),
+        }
+
+    def cache_key(self, video: str, danmaku: str) -> str:
+        """渲染缓存使用的任务标识：视频指纹、弹幕文件内容和渲染参数，与文件路径无关"""
+        from .chunks import file_hash
+        from .rendercache import video_fingerprint
+        return '%s-%s-%s' % (video_fingerprint(video), file_hash(danmaku)[:16], self.settings_hash()[:16])
+
+    def cached_output(self, video: str, danmaku: str, key: str = None) -> str:
+        """返回渲染缓存中同样任务的输出文件，没有时返回None"""
+        from .rendercache import RenderCache
+        try:
+            return RenderCache().lookup(key or self.cache_key(video, danmaku))
+        except Exception as e:
+            logging.debug(f'render cache lookup failed: {e}')
+            return None
+
+    def render_chunked(self, video: str, danmaku: str, output: str, nchunks: int, to_stdout: bool = False, logfile=None,
+                       checkpoint_interval: float = 0):
+        """
+        分段并行渲染：在关键帧处把视频分为nchunks段，每段使用截取的弹幕文件单独渲染（只有视频），
+        最后使用concat demuxer无损拼接，并与原视频的音频合并
+        checkpoint_interval大于0时每段不超过这个时长，并记录渲染进度，中断后再次渲染同一个任务时跳过已经完成的分段
+        无法分段（获取不到关键帧、视频太短）时返回None
+        """
+        from .chunks import split_ranges, slice_ass, chunks_dir, ChunkManifest
+        workdir = chunks_dir(output)
+        manifest = None
+        ranges = None
+        if checkpoint_interval > 0:
+            manifest = ChunkManifest(workdir, self.render_key(video, danmaku))
+            if manifest.load():
+                ranges = manifest.ranges
+                done, total = manifest.progress()
+                logging.info(f'继续渲染 {output}，已完成{done}/{total}段.')
+            elif exists(workdir):
+                shutil.rmtree(workdir, ignore_errors=True)
+
+        if ranges is None:
+            duration = FFprobe.get_duration(video)
+            if checkpoint_interval > 0 and duration > 0:
+                nchunks = max(nchunks, math.ceil(duration / checkpoint_interval))
+            ranges = split_ranges(FFprobe.get_keyframes(video), duration, nchunks,
+                                  min_length=float(self.advanced_render_args.get('chunk_min_length', 30)))
+            if len(ranges) < 2 and manifest is None:
+                return None
+            if duration <= 0:
+                return None
+            os.makedirs(workdir, exist_ok=True)
+            if manifest is not None:
+                manifest.reset(ranges)
+
+        watermark_in_ass = False
+        if self.advanced_render_args.get('ass_optimize', True):
+            danmaku, watermark_in_ass = self.optimize_danmaku(video, danmaku, output)
+
+        os.makedirs(workdir, exist_ok=True)
+        ext = os.path.splitext(output)[1] or '.mp4'
+        # 只开启进度记录时默认依次渲染各段
+        nworkers = int(self.advanced_render_args.get('chunk_workers', 0) or 0) \
+                   or int(self.advanced_render_args.get('chunks', 0) or 0) or 1
+
+        def render_chunk(i):
+            t0, t1 = ranges[i]
+            chunk_ass = join(workdir, '%04d.ass' % i)
+            chunk_video = join(workdir, '%04d%s' % (i, ext))
+            if manifest is not None and manifest.is_done(i):
+                return True
+            if self.stoped:
+                return False
+            slice_ass(danmaku, chunk_ass, t0, t1)
+            # 先写入临时文件，渲染成功后再改名，避免把中断的分段当成已完成
+            tmp_video = join(workdir, '%04d.tmp%s' % (i, ext))
+            args = self.render_args(video, chunk_ass, tmp_video, watermark_in_ass,
+                                    start=t0, length=t1 - t0, audio=False)
+            with tempfile.TemporaryFile() as chunk_log:
+                retcode = self.run_ffmpeg(args, False, chunk_log)
+                if retcode != 0 and logfile:
+                    chunk_log.seek(0)
+                    logfile.write(f'chunk {i} ({t0:.2f}-{t1:.2f}) failed:\n'.encode('utf-8'))
+                    logfile.write(chunk_log.read()[-4096:])
+            if retcode != 0 or self.stoped or not exists(tmp_video):
+                return False
+            os.replace(tmp_video, chunk_video)
+            if manifest is not None:
+                manifest.mark_done(i, chunk_video)
+            return True
+
+        success = False
+        try:
+            t = time.time()
+            with ThreadPoolExecutor(max_workers=nworkers) as executor:
+                results = list(executor.map(render_chunk, range(len(ranges))))
+            if self.stoped or not all(results):
+                return False
+            logging.debug(f'{video} 分{len(ranges)}段渲染完成，用时{time.time()-t:.1f}秒.')
+
+            success = self.concat_chunks(video, ['%04d%s' % (i, ext) for i in range(len(ranges))], output,
+                                         workdir, to_stdout, logfile)
+            return success
+        finally:
+            # 开启进度记录时保留未完成任务的分段，下次渲染时继续
+            if success or manifest is None:
+                shutil.rmtree(workdir, ignore_errors=True)
+
+    def concat_chunks(self, video: str, files: list, output: str, workdir: str, to_stdout: bool = False, logfile=None,
+                      copy_audio: bool = False) -> bool:
+        """
+        使用concat demuxer无损拼接workdir中的分段视频（只有视频），并与原视频的音频合并
+        copy_audio: 音频已经编码过，直接复制
+        """
+        from .chunks import write_concat_list
+        concat_list = join(workdir, 'concat.txt')
+        write_concat_list(concat_list, files)
+        ffmpeg_args = [
+            self.ffmpeg, '-y',
+            '-f', 'concat', '-safe', '0',
+            '-i', concat_list,
+            '-fflags', '+discardcorrupt',
+            '-i', video,
+            '-map', '0:v', '-map', '1:a?',
+            '-c:v', 'copy',
+            *(['-c:a', 'copy'] if copy_audio else ['-c:a', self.aencoder, *self.aencoder_args]),
+            output,
+        ]
+        return self.run_ffmpeg([str(x) for x in ffmpeg_args], to_stdout, logfile) == 0 and not self.stoped
+
+    def smart_encoder_args(self, video: str):
+        """
+        智能渲染时重新编码的分段需要与直接复制的分段能够无损拼接：编码格式、分辨率和像素格式与原视频相同
+        返回额外的编码参数，不满足条件时返回None
+        """
+        if self.output_resize or self.advanced_render_args.get('filter_complex') or self.advanced_render_args.get('fps'):
+            logging.debug('智能渲染不支持 output_resize, filter_complex 和 fps 参数.')
+            return None
+        try:
+            stream = next(s for s in FFprobe.run_ffprobe(video)['streams'] if s.get('codec_type') == 'video')
+        except Exception as e:
+            logging.debug(f'获取视频 {video} 编码信息失败：{e}')
+            return None
+        codec = stream.get('codec_name')
+        names = {'h264': ('264',), 'hevc': ('265', 'hevc'), 'av1': ('av1',)}.get(codec, ())
+        if not any(name in self.vencoder.lower() for name in names):
+            logging.debug(f'视频 {video} 的编码格式 {codec} 与编码器 {self.vencoder} 不一致，无法使用智能渲染.')
+            return None
+        return ['-pix_fmt', stream['pix_fmt']] if stream.get('pix_fmt') else []
+
+    def render_smart(self, video: str, danmaku: str, output: str, to_stdout: bool = False, logfile=None):
+        """
+        智能渲染：只重新编码有弹幕显示的GOP，其余部分直接复制，没有弹幕时直接封装原视频
+        先用segment muxer在关键帧处把原视频无损切分，需要编码的分段渲染后替换，最后拼接并合并音频
+        无法使用智能渲染时返回None
+        """
+        from .chunks import ass_intervals, plan_smart_render, slice_ass, chunks_dir
+        encoder_args = self.smart_encoder_args(video)
+        if encoder_args is None:
+            return None
+
+        watermark_in_ass = False
+        if self.advanced_render_args.get('ass_optimize', True):
+            danmaku, watermark_in_ass = self.optimize_danmaku(video, danmaku, output)
+        if self.watermark_text and not watermark_in_ass:
+            logging.debug('水印需要使用drawtext渲染整个视频，无法使用智能渲染.')
+            return None
+
+        duration = FFprobe.get_duration(video)
+        packets = FFprobe.get_video_packets(video)
+        if duration <= 0 or not packets:
+            return None
+        segments = plan_smart_render([t for t, key in packets if key], duration, ass_intervals(danmaku),
+                                     min_copy=float(self.advanced_render_args.get('smart_min_copy', 2)))
+        dirty = [seg for seg in segments if seg[2]]
+        times = [t for t, _ in packets]
+        nframes = sum(bisect.bisect_left(times, t1) - bisect.bisect_left(times, t0) for t0, t1, _ in dirty)
+        ratio = nframes / len(times)
+        logging.info(f'{video} 智能渲染：{len(dirty)}/{len(segments)}段，需要重新编码{ratio:.1%}的帧.')
+        self.smart_stats = {'segments': len(segments), 'encoded_segments': len(dirty),
+                            'frames': len(times), 'encoded_frames': nframes, 'ratio': ratio}
+
+        if not dirty:
+            # 没有弹幕，不需要渲染
+            ffmpeg_args = [
+                self.ffmpeg, '-y',
+                '-fflags', '+discardcorrupt',
+                '-i', video,
+                '-map', '0:v', '-map', '0:a?',
+                '-c:v', 'copy',
+                '-c:a', self.aencoder,
+                *self.aencoder_args,
+                output,
+            ]
+            return self.run_ffmpeg([str(x) for x in ffmpeg_args], to_stdout, logfile) == 0
+        if len(dirty) == 1 and dirty[0][1] - dirty[0][0] >= duration - 1e-3:
+            return None
+
+        workdir = chunks_dir(output) + '.smart'
+        os.makedirs(workdir, exist_ok=True)
+        # 分段边界是关键帧的时间，取整到毫秒（向下）保证边界上的关键帧属于后一段
+        bounds = [math.floor(t0 * 1000) / 1000 for t0, _, _ in segments[1:]]
+        nworkers = int(self.advanced_render_args.get('chunk_workers', 0) or 0) \
+                   or int(self.advanced_render_args.get('chunks', 0) or 0) or 1
+
+        def render_segment(i):
+            t0, t1, _ = segments[i]
+            if self.stoped:
+                return False
+            t0 = math.floor(t0 * 1000) / 1000
+            if i < len(segments) - 1:
+                t1 = math.floor(t1 * 1000) / 1000
+            seg_ass = join(workdir, '%04d.ass' % i)
+            slice_ass(danmaku, seg_ass, t0, t1)
+            args = self.render_args(video, seg_ass, join(workdir, '%04d.ts' % i), watermark_in_ass,
+                                    start=t0, length=t1 - t0, audio=False)
+            args[-1:-1] = encoder_args
+            with tempfile.TemporaryFile() as seg_log:
+                retcode = self.run_ffmpeg(args, False, seg_log)
+                if retcode != 0 and logfile:
+                    seg_log.seek(0)
+                    logfile.write(f'segment {i} ({t0:.2f}-{t1:.2f}) failed:\n'.encode('utf-8'))
+                    logfile.write(seg_log.read()[-4096:])
+            return retcode == 0
+
+        try:
+            t = time.time()
+            split_args = [
+                self.ffmpeg, '-y',
+                '-fflags', '+discardcorrupt',
+                '-i', video,
+                '-map', '0:v:0', '-c:v', 'copy', '-an',
+                '-f', 'segment', '-segment_format', 'mpegts',
+                '-segment_times', ','.join('%.3f' % x for x in bounds),
+                '-reset_timestamps', '1',
+                join(workdir, '%04d.ts'),
+            ]
+            with tempfile.TemporaryFile() as split_log:
+                if self.run_ffmpeg([str(x) for x in split_args], False, split_log) != 0:
+                    return None
+            if not all(exists(join(workdir, '%04d.ts' % i)) for i in range(len(segments))):
+                logging.debug(f'{video} 切分结果与关键帧不一致，无法使用智能渲染.')
+                return None
+
+            with ThreadPoolExecutor(max_workers=nworkers) as executor:
+                results = list(executor.map(render_segment, [i for i, seg in enumerate(segments) if seg[2]]))
+            if self.stoped or not all(results):
+                return False
+            logging.debug(f'{video} 智能渲染分段完成，用时{time.time()-t:.1f}秒.')
+            return self.concat_chunks(video, ['%04d.ts' % i for i in range(len(segments))], output,
+                                      workdir, to_stdout, logfile)
+        finally:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+    @staticmethod
+    def optimized_name(output: str) -> str:
+        return os.path.splitext(output)[0] + '.render.ass'
+
+    def optimize_danmaku(self, video: str, danmaku: str, output: str):
+        """
+        生成精简后的弹幕文件，返回(弹幕文件路径, 水印是否已经写入弹幕文件)，失败时使用原弹幕文件
+        """
+        from .assopt import optimize_ass, font_family
+        duration = FFprobe.get_duration(video)
+        custom_filter = bool(self.advanced_render_args.get('filter_complex'))
+        watermark = self.watermark_text if (self.watermark_text and duration > 0 and not custom_filter) else None
+        dst = self.optimized_name(output)
+        try:
+            stats = optimize_ass(
+                danmaku, dst,
+                duration=duration if duration > 0 else None,
+                max_events=int(self.advanced_render_args.get('ass_max_events', 0) or 0),
+                window=float(self.advanced_render_args.get('ass_event_window', 1)),
+                watermark=watermark,
+                watermark_font=font_family(self.font_path),
+                video_size=FFprobe.get_resolution(video) if watermark else None,
+            )
+        except Exception as e:
+            logging.warning(f'弹幕文件 {danmaku} 精简失败，将使用原弹幕文件：{e}')
+            return danmaku, False
+        logging.debug(f'弹幕文件精简 {danmaku}: {stats}')
+        return dst, bool(stats.get('watermark'))
+
+    def record_cache(self, key: str, video: str, danmaku: str, output: str):
+        from .rendercache import RenderCache
+        try:
+            RenderCache().record(key, video, danmaku, output)
+        except Exception as e:
+            logging.debug(f'render cache record failed: {e}')
 
     def render_one(self, video: str, danmaku: str, output: str, **kwargs):
         if not exists(video):
@@ -146,10 +519,43 @@ class FFmpegRender(BaseRender):
         if not exists(danmaku):
             raise RuntimeError(f'不存在弹幕文件 {danmaku}，跳过渲染.')
 
+        self.stoped = False
+        cache_key = None
+        if self.advanced_render_args.get('render_cache', False):
+            cache_key = self.cache_key(video, danmaku)
+            cached = self.cached_output(video, danmaku, cache_key)
+            if cached:
+                if os.path.abspath(cached) != os.path.abspath(output):
+                    from .rendercache import RenderCache
+                    RenderCache.link(cached, output)
+                    self.record_cache(cache_key, video, danmaku, output)
+                logging.info(f'{video} 已经使用相同的弹幕和参数渲染过，使用渲染缓存 {cached}.')
+                return True, f'使用渲染缓存 {cached}'
+        nchunks = int(self.advanced_render_args.get('chunks', 0) or 0)
+        checkpoint_interval = float(self.advanced_render_args.get('checkpoint_interval', 0) or 0)
+        if not checkpoint_interval and kwargs.get('resume'):
+            # 之前使用分段进度记录渲染过这个任务
+            checkpoint_interval = 300
         with tempfile.TemporaryFile() as logfile:
-            self.render_helper(video, danmaku, output,
-                               to_stdout=self.debug, logfile=logfile)
+            try:
+                status = None
+                if self.advanced_render_args.get('smart_render'):
+                    status = self.render_smart(video, danmaku, output, to_stdout=self.debug, logfile=logfile)
+                if status is None and (nchunks > 1 or checkpoint_interval > 0):
+                    status = self.render_chunked(video, danmaku, output, nchunks,
+                                                 to_stdout=self.debug, logfile=logfile,
+                                                 checkpoint_interval=checkpoint_interval)
+                if status is None:
+                    self.render_helper(video, danmaku, output,
+                                       to_stdout=self.debug, logfile=logfile)
+            finally:
+                if exists(self.optimized_name(output)):
+                    os.remove(self.optimized_name(output))
             if self.debug:
+                # 调试模式下ffmpeg直接输出到控制台，根据输出文件的时长判断是否渲染成功
+                if cache_key and not self.stoped and exists(output) and \
+                        abs(FFprobe.get_duration(output) - FFprobe.get_duration(video)) < 5:
+                    self.record_cache(cache_key, video, danmaku, output)
                 return True, ''
 
             info = None
@@ -161,16 +567,22 @@ class FFmpegRender(BaseRender):
                 if 'video:' in line:
                     info = line
             if info:
+                if cache_key and exists(output):
+                    self.record_cache(cache_key, video, danmaku, output)
                 return True, info
             else:
                 return False, log
 
     def stop(self):
         logging.debug('ffmpeg render stop.')
-        try:
-            out, _ = self.render_proc.communicate(b'q', timeout=5)
-            logging.debug(out)
-        except subprocess.TimeoutExpired:
-            self.render_proc.kill()
-        except Exception as e:
-            logging.debug(e)
+        self.stoped = True
+        with self._procs_lock:
+            procs = list(self.render_procs)
+        for proc in procs:
+            try:
+                out, _ = proc.communicate(b'q', timeout=5)
+                logging.debug(out)
+            except subprocess.TimeoutExpired:
+                proc.kill()
+            except Exception as e:
+                logging.debug(e)
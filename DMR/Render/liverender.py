@@ -0,0 +1,351 @@
+import csv
+import logging
+import os
+import platform
+import shutil
+import subprocess
+import tempfile
+import threading
+import time
+from os.path import exists, join
+
+from DMR.utils import *
+from .chunks import parse_event, shift_event
+
+__all__ = ['open_shared', 'FollowFile', 'AssTail', 'LiveRender']
+
+def open_shared(filename:str):
+    """
+    以二进制只读方式打开文件，Windows下允许其他程序同时写入、改名和删除（录制分段结束时需要给文件改名）
+    """
+    if platform.system() == 'Windows':
+        import _winapi
+        import msvcrt
+        # FILE_SHARE_READ | FILE_SHARE_WRITE | FILE_SHARE_DELETE
+        handle = _winapi.CreateFile(filename, _winapi.GENERIC_READ, 7, 0, _winapi.OPEN_EXISTING, 0, 0)
+        fd = msvcrt.open_osfhandle(handle, os.O_RDONLY | getattr(os, 'O_BINARY', 0))
+        return open(fd, 'rb')
+    return open(filename, 'rb')
+
+class FollowFile():
+    """
+    读取正在写入的文件（类似tail -f），没有新数据时等待，调用finish()之后读到文件末尾时结束
+    """
+    def __init__(self, filename:str, poll:float=0.5) -> None:
+        self.filename = filename
+        self.poll = poll
+        self.position = 0
+        self.finished = False
+        self.closed = False
+        self._file = None
+
+    def _open(self) -> bool:
+        if self._file is None:
+            try:
+                self._file = open_shared(self.filename)
+            except OSError:
+                return False
+        return True
+
+    def read(self, size:int=1024*1024) -> bytes:
+        while not self.closed:
+            if self._open():
+                data = self._file.read(size)
+                if data:
+                    self.position += len(data)
+                    return data
+            if self.finished:
+                # finish()之后再读一次，保证读到写入结束前的所有数据
+                if self._open():
+                    data = self._file.read(size)
+                    if data:
+                        self.position += len(data)
+                        return data
+                return b''
+            time.sleep(self.poll)
+        return b''
+
+    def finish(self):
+        """文件已经写入完成"""
+        self.finished = True
+
+    def close(self):
+        self.closed = True
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+class AssTail():
+    """
+    读取正在写入的ASS弹幕文件，保存文件头和已经写入的事件，用于截取一段时间内的弹幕
+    也可以不读取文件，直接由feed()写入内容
+    """
+    def __init__(self, filename:str) -> None:
+        self.filename = filename
+        self.header = []
+        self.events = []
+        self.last_time = -1
+        self._in_events = False
+        self._buffer = ''
+        self._file = None
+
+    def poll(self) -> int:
+        """读取新写入的完整行，返回新事件的数量"""
+        if self._file is None:
+            try:
+                self._file = open_shared(self.filename)
+            except OSError:
+                return 0
+        data = self._file.read()
+        if not data:
+            return 0
+        return self.feed(data.decode('utf-8', errors='ignore'))
+
+    def feed(self, text:str) -> int:
+        """写入新的内容（不需要是完整的行），返回新事件的数量"""
+        self._buffer += text
+        *lines, self._buffer = self._buffer.split('\n')
+        cnt = 0
+        for row in lines:
+            row = row.rstrip('\r')
+            if not self._in_events:
+                self.header.append(row)
+                if row.startswith('Format:') and self.header[-2:-1] == ['[Events]']:
+                    self._in_events = True
+                continue
+            event = parse_event(row)
+            if event is None:
+                continue
+            self.events.append(event)
+            self.last_time = max(self.last_time, event[2])
+            cnt += 1
+        return cnt
+
+    def snapshot(self, start:float, end:float):
+        """
+        返回文件头和与[start, end)重叠的事件（副本），写入文件时不需要持有锁
+        需要按时间先后截取，在start之前结束的事件会被丢弃
+        """
+        self.events = [e for e in self.events if e[3] > start]
+        return list(self.header), [e for e in self.events if e[2] < end]
+
+    @staticmethod
+    def write_events(dst:str, header:list, events:list, start:float) -> int:
+        """把snapshot()返回的事件写入dst（时间减去start），返回事件数量"""
+        with open(dst, 'w', encoding='utf-8') as f:
+            f.write('\n'.join(header) + '\n')
+            for event_type, fields, st, et in events:
+                f.write(shift_event(event_type, fields, st, et, start))
+        return len(events)
+
+    def write_slice(self, dst:str, start:float, end:float) -> int:
+        """
+        把与[start, end)重叠的事件写入dst（时间减去start），返回事件数量
+        需要按时间先后截取，在start之前结束的事件会被丢弃
+        """
+        header, events = self.snapshot(start, end)
+        return self.write_events(dst, header, events, start)
+
+    def close(self):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+class LiveRender():
+    """
+    边录边渲染：跟随读取正在录制的视频分段，由ffmpeg在关键帧处无损切分为piece_length秒左右的小段（音频同时编码），
+    每一小段写入完成并且对应时间的弹幕写入之后（或者等待delay秒）立即渲染
+    录制分段结束后只需要渲染最后一小段并拼接，不需要等待整个视频渲染
+    """
+    def __init__(self, render, video:str, danmaku:str, workdir:str, ext:str='.mp4') -> None:
+        self.render = render
+        self.ext = ext
+        self.video = video
+        self.danmaku = danmaku
+        self.workdir = workdir
+        args = render.advanced_render_args
+        self.piece_length = float(args.get('live_piece_length', 10))
+        self.delay = float(args.get('live_delay', 10))
+        self.poll = 0.5
+
+        self.follower = FollowFile(video, poll=self.poll)
+        self.ass = AssTail(danmaku)
+        self.splitter = None
+        self.has_audio = False
+        self.pieces = []
+        self.rendered = 0
+        self.stoped = False
+        self.failed = False
+        self.log = ''
+        self._thread = None
+
+    def start(self):
+        os.makedirs(self.workdir, exist_ok=True)
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def finish(self):
+        """录制分段已经结束"""
+        self.follower.finish()
+
+    def stop(self):
+        self.stoped = True
+        self.follower.close()
+        if self.splitter and self.splitter.poll() is None:
+            self.splitter.kill()
+        self.render.stop()
+
+    def _probe(self) -> bool:
+        """等待视频文件写入足够的数据，判断是否有音频"""
+        while not self.stoped:
+            if exists(self.video) and os.path.getsize(self.video) > 0:
+                try:
+                    streams = FFprobe.run_ffprobe(self.video)['streams']
+                    self.has_audio = any(s.get('codec_type') == 'audio' for s in streams)
+                    return True
+                except Exception as e:
+                    if self.follower.finished:
+                        logging.debug(f'边录边渲染读取视频 {self.video} 失败：{e}')
+                        return False
+            elif self.follower.finished:
+                return False
+            time.sleep(self.poll * 4)
+        return False
+
+    def _start_splitter(self):
+        render = self.render
+        ffmpeg_args = [
+            render.ffmpeg, '-y',
+            '-fflags', '+discardcorrupt',
+            '-i', 'pipe:0',
+            '-map', '0:v:0', '-c:v', 'copy',
+            '-f', 'segment', '-segment_format', 'matroska',
+            '-segment_time', self.piece_length,
+            '-reset_timestamps', '1',
+            '-segment_list', join(self.workdir, 'pieces.csv'), '-segment_list_type', 'csv',
+            join(self.workdir, 'piece%05d.mkv'),
+        ]
+        if self.has_audio:
+            ffmpeg_args += [
+                '-map', '0:a:0', '-c:a', render.aencoder, *render.aencoder_args,
+                join(self.workdir, 'audio.mka'),
+            ]
+        ffmpeg_args = [str(x) for x in ffmpeg_args]
+        logging.debug(f'live render splitter args: {ffmpeg_args}')
+        self._splitter_log = tempfile.TemporaryFile()
+        self.splitter = subprocess.Popen(ffmpeg_args, stdin=subprocess.PIPE, stdout=self._splitter_log, stderr=subprocess.STDOUT)
+
+        def feeder():
+            try:
+                while True:
+                    data = self.follower.read()
+                    if not data:
+                        break
+                    self.splitter.stdin.write(data)
+            except (OSError, ValueError) as e:
+                logging.debug(f'live render feeder: {e}')
+            finally:
+                try:
+                    self.splitter.stdin.close()
+                except OSError:
+                    pass
+        threading.Thread(target=feeder, daemon=True).start()
+
+    def _read_pieces(self) -> list:
+        """读取已经写入完成的小段：[(文件名, 开始时间, 结束时间), ...]"""
+        filename = join(self.workdir, 'pieces.csv')
+        if not exists(filename):
+            return []
+        with open(filename, encoding='utf-8', newline='') as f:
+            data = f.read()
+        pieces = []
+        for row in csv.reader(data.splitlines(keepends=True)[:data.count('\n')]):
+            if len(row) >= 3:
+                pieces.append((row[0], float(row[1]), float(row[2])))
+        return pieces
+
+    def _render_piece(self, i:int, name:str, t0:float, t1:float) -> bool:
+        render = self.render
+        piece_ass = join(self.workdir, '%05d.ass' % i)
+        self.ass.write_slice(piece_ass, t0, t1)
+        if render.advanced_render_args.get('ass_optimize', True):
+            from .assopt import optimize_ass
+            try:
+                optimize_ass(piece_ass, piece_ass, duration=t1 - t0,
+                             max_events=int(render.advanced_render_args.get('ass_max_events', 0) or 0),
+                             window=float(render.advanced_render_args.get('ass_event_window', 1)))
+            except Exception as e:
+                logging.debug(f'弹幕文件 {piece_ass} 精简失败：{e}')
+        args = render.render_args(join(self.workdir, name), piece_ass, join(self.workdir, '%05d%s' % (i, self.ext)),
+                                  start=t0, audio=False, seek=False)
+        with tempfile.TemporaryFile() as piece_log:
+            retcode = render.run_ffmpeg(args, False, piece_log)
+            if retcode != 0:
+                piece_log.seek(0)
+                self.log += f'piece {i} ({t0:.2f}-{t1:.2f}) failed:\n' + piece_log.read()[-4096:].decode('utf-8', errors='ignore')
+        os.remove(join(self.workdir, name))
+        return retcode == 0
+
+    def _run(self):
+        try:
+            if not self._probe():
+                self.failed = True
+                return
+            logging.info(f'开始边录边渲染 {self.video}.')
+            self._start_splitter()
+            pending = []
+            while not self.stoped:
+                done = self.splitter.poll() is not None
+                self.ass.poll()
+                pieces = self._read_pieces()
+                now = time.monotonic()
+                for piece in pieces[len(self.pieces):]:
+                    pending.append((len(self.pieces), *piece, now))
+                    self.pieces.append(piece)
+                # 小段写入完成后，等待这段时间的弹幕写入弹幕文件
+                while pending and not self.stoped:
+                    i, name, t0, t1, seen = pending[0]
+                    if not (done or self.ass.last_time >= t1 or now - seen >= self.delay):
+                        break
+                    if not self._render_piece(i, name, t0 - self.pieces[0][1], t1 - self.pieces[0][1]):
+                        self.failed = True
+                        return
+                    pending.pop(0)
+                    self.rendered += 1
+                if done and not pending:
+                    break
+                time.sleep(self.poll)
+            if self.splitter.returncode != 0:
+                self._splitter_log.seek(0)
+                self.log += self._splitter_log.read()[-4096:].decode('utf-8', errors='ignore')
+                self.failed = True
+        except Exception as e:
+            logging.exception(e)
+            self.log += str(e)
+            self.failed = True
+        finally:
+            self.follower.close()
+            self.ass.close()
+
+    def wait(self, output:str) -> tuple:
+        """
+        等待剩余的小段渲染完成并拼接为output，返回(是否成功, 信息)，与render_one相同
+        """
+        self.finish()
+        self._thread.join()
+        try:
+            if self.stoped or self.failed or not self.pieces:
+                return False, self.log or f'边录边渲染 {self.video} 失败.'
+            files = ['%05d%s' % (i, self.ext) for i in range(len(self.pieces))]
+            audio = join(self.workdir, 'audio.mka') if self.has_audio else join(self.workdir, files[0])
+            with tempfile.TemporaryFile() as logfile:
+                self.render.concat_chunks(audio, files, output, self.workdir, logfile=logfile,
+                                          copy_audio=self.has_audio)
+                logfile.seek(0)
+                log = logfile.read().decode('utf-8', errors='ignore')
+            for line in log.splitlines():
+                if 'video:' in line:
+                    return True, line.strip()
+            return False, log
+        finally:
+            shutil.rmtree(self.workdir, ignore_errors=True)
@@ -175,6 +175,8 @@ def sub_render_proc(pid, nproc, video_info, danmu_info, q:multiprocessing.Queue)
             y = y0-(y0-y1)*(tic-dm.st)/(dm.et-dm.st) - dm.size[1]
             x, y = int(x), int(y)
             rgb, a = dm.image
+            if rgb is None:
+                continue
             frame.paste(rgb,(x,y),a)
 
         q.put(frame.tobytes())
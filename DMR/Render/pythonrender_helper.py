@@ -2,6 +2,7 @@ import re
 import os
 
 from abc import ABC, abstractmethod
+from functools import lru_cache
 from PIL import Image,ImageDraw,ImageFont
 from os.path import exists, join
 from DMR.utils import *
@@ -140,15 +141,30 @@ class ImageDanmaku(BaseDanmaku):
         if not imp:
             self.length = self.height = 0
             self.rgb = self.alpha = None
+            self.rendered = True
+            return
         
-        rgba = Image.open(imp)
-        a = int(self.opacity*255)
-        self.alpha = rgba.split()[-1]
-        self.alpha.point(lambda x:x>a and a)
-        self.rgb = rgba.convert('RGB')
+        self.rgb, self.alpha = load_image(imp, self.fontsize, self.opacity)
+        self.length, self.height = self.rgb.size
         self.rendered = True
-        
-    
+
+@lru_cache(maxsize=256)
+def load_image(path:str, height:int, opacity):
+    """
+    读取图片弹幕并缩放到指定高度，相同的图片只会解码一次（最近使用的256张图片保存在内存中）
+    opacity: 不透明度，0-1的小数或者ASS中的十六进制字符串
+    """
+    rgba = Image.open(path).convert('RGBA')
+    if height and rgba.height != height:
+        width = max(int(rgba.width * height / rgba.height), 1)
+        rgba = rgba.resize((width, height))
+    if isinstance(opacity, str):
+        a = int(opacity, 16)
+    else:
+        a = int(opacity*255)
+    alpha = rgba.split()[-1].point(lambda x: min(x, a))
+    return rgba.convert('RGB'), alpha
+
 def parser_ass(filename):
     meta_info = {
         'width': 0,
@@ -0,0 +1,133 @@
+import hashlib
+import json
+import logging
+import os
+import shutil
+import threading
+import time
+from os.path import exists
+
+__all__ = ['video_fingerprint', 'RenderCache']
+
+# 所有渲染线程共用同一个索引文件
+_lock = threading.Lock()
+# 索引文件保存在程序目录下，与当前工作目录无关
+_INDEX = os.path.join(os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))), '.temp', 'render_cache.json')
+
+def video_fingerprint(filename:str, nblocks:int=16, block_size:int=64*1024) -> str:
+    """
+    视频文件的快速指纹：文件大小、修改时间和均匀抽取的nblocks个数据块的哈希，不需要读取整个文件
+    """
+    stat = os.stat(filename)
+    h = hashlib.sha1()
+    h.update(f'{stat.st_size}:{int(stat.st_mtime)}'.encode('utf-8'))
+    with open(filename, 'rb') as f:
+        if stat.st_size <= nblocks * block_size:
+            h.update(f.read())
+        else:
+            step = (stat.st_size - block_size) / (nblocks - 1)
+            for i in range(nblocks):
+                f.seek(int(i * step))
+                h.update(f.read(block_size))
+    return h.hexdigest()
+
+class RenderCache():
+    """
+    渲染缓存：记录已经完成的渲染任务（视频指纹、弹幕内容和渲染参数 -> 输出文件），保存在本地的索引文件中
+    同样的视频和弹幕使用同样的参数再次渲染时直接使用之前的输出文件（输出文件的大小和修改时间需要与记录一致）
+    文件被清理（删除、移动）时由Cleaner调用evict()更新索引
+    """
+    def __init__(self, filename:str=None, max_entries:int=1000) -> None:
+        self.filename = os.path.abspath(filename) if filename else _INDEX
+        self.max_entries = max_entries
+
+    def _load(self) -> dict:
+        try:
+            with open(self.filename, encoding='utf-8') as f:
+                data = json.load(f)
+            return data if isinstance(data, dict) else {}
+        except (OSError, ValueError):
+            return {}
+
+    def _save(self, data:dict):
+        os.makedirs(os.path.dirname(self.filename) or '.', exist_ok=True)
+        tmp = self.filename + '.tmp'
+        with open(tmp, 'w', encoding='utf-8') as f:
+            json.dump(data, f, ensure_ascii=False, indent=2)
+        os.replace(tmp, self.filename)
+
+    @staticmethod
+    def _valid(entry:dict) -> bool:
+        output = entry.get('output')
+        if not output or not exists(output):
+            return False
+        stat = os.stat(output)
+        return stat.st_size == entry.get('size') and int(stat.st_mtime) == entry.get('mtime')
+
+    def lookup(self, key:str) -> str:
+        """返回key对应的有效输出文件，没有时返回None（无效的记录会被删除）"""
+        with _lock:
+            data = self._load()
+            entry = data.get(key)
+            if entry is None:
+                return None
+            if self._valid(entry):
+                return entry['output']
+            data.pop(key)
+            self._save(data)
+        return None
+
+    def record(self, key:str, video:str, danmaku:str, output:str):
+        stat = os.stat(output)
+        with _lock:
+            data = self._load()
+            data[key] = {
+                'video': os.path.abspath(video),
+                'danmaku': os.path.abspath(danmaku),
+                'output': os.path.abspath(output),
+                'size': stat.st_size,
+                'mtime': int(stat.st_mtime),
+                'time': int(time.time()),
+            }
+            if len(data) > self.max_entries:
+                # 先删除无效的记录，仍然过多时删除最早的记录
+                data = {k: v for k, v in data.items() if self._valid(v)}
+                for k in sorted(data, key=lambda k: data[k].get('time', 0))[:len(data) - self.max_entries]:
+                    data.pop(k)
+            self._save(data)
+
+    @staticmethod
+    def link(src:str, dst:str):
+        """把缓存的输出文件src用于新的输出dst：优先使用硬链接（不复制数据），不支持时（例如不在同一个磁盘）复制"""
+        if exists(dst):
+            os.remove(dst)
+        try:
+            os.link(src, dst)
+        except OSError:
+            shutil.copyfile(src, dst)
+
+    def evict(self, path:str, dst:str=None) -> int:
+        """
+        文件path被清理：删除以它为输出的记录和源视频已经删除的记录
+        输出文件被移动到dst时更新记录中的路径，返回变化的记录数量
+        """
+        path = os.path.abspath(path)
+        cnt = 0
+        with _lock:
+            data = self._load()
+            for key in list(data):
+                entry = data[key]
+                if entry.get('output') == path:
+                    if dst and exists(dst) and not os.path.isdir(dst):
+                        entry['output'] = os.path.abspath(dst)
+                    else:
+                        data.pop(key)
+                    cnt += 1
+                elif entry.get('video') == path and not exists(path):
+                    data.pop(key)
+                    cnt += 1
+            if cnt:
+                self._save(data)
+        if cnt:
+            logging.debug(f'render cache evict {path}: {cnt}')
+        return cnt
@@ -0,0 +1,331 @@
+import logging
+import math
+import os
+import queue
+import shutil
+import subprocess
+import tempfile
+import threading
+import time
+from os.path import exists, join
+
+from DMR.utils import *
+from .liverender import FollowFile, AssTail
+
+__all__ = ['RestreamSink', 'flv_body']
+
+def flv_body(data:bytes) -> bytes:
+    """去掉FLV文件头（和第一个PreviousTagSize），剩下的tag可以直接接在另一个FLV流后面"""
+    if data[:3] != b'FLV' or len(data) < 9:
+        return data
+    offset = int.from_bytes(data[5:9], 'big')
+    return data[offset + 4:]
+
+class RestreamSink():
+    """
+    实时转推带弹幕的直播流（RTMP/SRT等）
+    跟随读取正在录制的视频分段，在关键帧处切分为piece_length秒左右的小段，
+    每段使用AssWriter实时写入的弹幕渲染后，以FLV格式连续写入推流的ffmpeg
+    渲染速度跟不上直播时逐步降低弹幕密度，积压超过max_delay秒时丢弃积压的小段，保证延迟有上限
+    """
+    def __init__(self,
+                 url:str,
+                 render_config:dict=None,
+                 format:str=None,
+                 piece_length:float=2,
+                 dm_wait:float=8,
+                 max_delay:float=30,
+                 workdir:str=None,
+                 ffmpeg:str=None,
+                 debug:bool=False,
+                 **kwargs) -> None:
+        from .ffmpegrender import FFmpegRender
+        self.url = url
+        if not format:
+            format = 'flv' if str(url).startswith('rtmp') else 'mpegts'
+        self.format = format
+        self.piece_length = float(piece_length)
+        self.dm_wait = float(dm_wait)
+        self.max_delay = float(max_delay)
+        self.workdir = workdir or tempfile.mkdtemp(prefix='dmr_restream_')
+        self.debug = debug
+
+        render_config = dict(render_config or {})
+        render_config.setdefault('hwaccel_args', [])
+        render_config.setdefault('vencoder', 'libx264')
+        render_config.setdefault('vencoder_args', [])
+        render_config.setdefault('aencoder', 'aac')
+        render_config.setdefault('aencoder_args', [])
+        render_config.setdefault('output_resize', None)
+        self.render = FFmpegRender(debug=False, **render_config)
+        if ffmpeg:
+            self.render.ffmpeg = ffmpeg
+        self.max_events = int(self.render.advanced_render_args.get('ass_max_events', 0) or 0)
+
+        self.segments = queue.Queue()
+        self.danmakus = {}
+        self._dm_lock = threading.Lock()
+        self.follower = None
+        self.splitter = None
+        self.publisher = None
+        self.stoped = True
+        self._thread = None
+
+        # 负载控制：density为保留的弹幕比例，1为全部保留，0为不渲染弹幕
+        self.density = 1.
+        self.stats = {
+            'pieces': 0,
+            'dropped_pieces': 0,
+            'published': 0.,
+            'speed': 0.,
+            'density': 1.,
+            'restarts': 0,
+        }
+
+    # AssWriter监听器
+    def ass_open(self, filename:str, header:list):
+        with self._dm_lock:
+            tail = AssTail(filename)
+            tail.feed('\n'.join(header) + '\n')
+            self.danmakus[filename] = tail
+
+    def ass_event(self, filename:str, text:str):
+        with self._dm_lock:
+            tail = self.danmakus.get(filename)
+            if tail is not None:
+                tail.feed(text)
+
+    def add_segment(self, video:str, danmaku:str=None):
+        """开始录制新的分段，之前的分段已经录制完成"""
+        if self.follower is not None:
+            self.follower.finish()
+        self.segments.put((video, danmaku))
+
+    def start(self):
+        self.stoped = False
+        os.makedirs(self.workdir, exist_ok=True)
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self.stoped = True
+        self.segments.put(None)
+        if self.follower is not None:
+            self.follower.close()
+        for proc in [self.splitter, self.publisher]:
+            if proc is not None and proc.poll() is None:
+                proc.kill()
+        self.render.stop()
+        if self._thread is not None:
+            self._thread.join(timeout=10)
+        shutil.rmtree(self.workdir, ignore_errors=True)
+
+    def _start_publisher(self):
+        ffmpeg_args = [
+            self.render.ffmpeg, '-y',
+            '-fflags', '+discardcorrupt',
+            '-f', 'flv', '-i', 'pipe:0',
+            '-c', 'copy',
+            '-f', self.format,
+            self.url,
+        ]
+        logging.debug(f'restream publisher args: {ffmpeg_args}')
+        out = None if self.debug else subprocess.DEVNULL
+        self.publisher = subprocess.Popen(ffmpeg_args, stdin=subprocess.PIPE, stdout=out, stderr=subprocess.STDOUT)
+        self._header_sent = False
+
+    def _publish(self, data:bytes) -> bool:
+        for _ in range(2):
+            if self.publisher is None or self.publisher.poll() is not None:
+                if self.publisher is not None:
+                    logging.warning(f'转推 {self.url} 中断，正在重新连接.')
+                    self.stats['restarts'] += 1
+                self._start_publisher()
+            try:
+                self.publisher.stdin.write(data if not self._header_sent else flv_body(data))
+                self.publisher.stdin.flush()
+                self._header_sent = True
+                return True
+            except (OSError, ValueError) as e:
+                logging.debug(f'restream publish: {e}')
+                self.publisher.kill()
+                self.publisher.wait()
+        return False
+
+    def _start_splitter(self, video:str, piece_dir:str):
+        self.follower = FollowFile(video)
+        ffmpeg_args = [
+            self.render.ffmpeg, '-y',
+            '-fflags', '+discardcorrupt',
+            '-i', 'pipe:0',
+            '-map', '0:v:0', '-map', '0:a:0?', '-c', 'copy',
+            '-f', 'segment', '-segment_format', 'matroska',
+            '-segment_time', self.piece_length,
+            '-reset_timestamps', '1',
+            '-segment_list', join(piece_dir, 'pieces.csv'), '-segment_list_type', 'csv',
+            join(piece_dir, 'piece%05d.mkv'),
+        ]
+        ffmpeg_args = [str(x) for x in ffmpeg_args]
+        self.splitter = subprocess.Popen(ffmpeg_args, stdin=subprocess.PIPE,
+                                         stdout=subprocess.DEVNULL, stderr=subprocess.STDOUT)
+        follower, splitter = self.follower, self.splitter
+
+        def feeder():
+            try:
+                while True:
+                    data = follower.read()
+                    if not data:
+                        break
+                    splitter.stdin.write(data)
+            except (OSError, ValueError) as e:
+                logging.debug(f'restream feeder: {e}')
+            finally:
+                try:
+                    splitter.stdin.close()
+                except OSError:
+                    pass
+        threading.Thread(target=feeder, daemon=True).start()
+
+    def _slice_danmaku(self, danmaku:str, dst:str, t0:float, t1:float) -> bool:
+        """截取弹幕并按当前的弹幕密度限制数量，返回是否有弹幕需要渲染"""
+        # 弹幕录制时也需要这个锁（ass_event），锁内只复制事件，写入文件在锁外进行
+        with self._dm_lock:
+            tail = self.danmakus.get(danmaku)
+            if tail is None or self.density <= 0:
+                return False
+            header, events = tail.snapshot(t0, t1)
+        cnt = AssTail.write_events(dst, header, events, t0)
+        if not cnt:
+            return False
+        max_events = self.max_events
+        if self.density < 1:
+            max_events = max(1, math.ceil(cnt / max(t1 - t0, 1) * self.density))
+            if self.max_events:
+                max_events = min(max_events, self.max_events)
+        if max_events or self.render.advanced_render_args.get('ass_optimize', True):
+            from .assopt import optimize_ass
+            optimize_ass(dst, dst, duration=t1 - t0, max_events=max_events, window=1)
+        return True
+
+    def _burn(self, piece:str, danmaku:str, t0:float, t1:float, offset:float) -> bytes:
+        piece_ass = piece + '.ass'
+        output = piece + '.flv'
+        if not self._slice_danmaku(danmaku, piece_ass, t0, t1):
+            # 没有弹幕（或者负载过高不渲染弹幕）时只重新编码
+            with open(piece_ass, 'w', encoding='utf-8') as f:
+                f.write('[Script Info]\nScriptType: v4.00+\n\n[Events]\n'
+                        'Format: Layer, Start, End, Style, Name, MarginL, MarginR, MarginV, Effect, Text\n')
+        args = self.render.render_args(piece, piece_ass, output, start=offset + t0, audio='copy', seek=False)
+        args[-1:-1] = ['-output_ts_offset', '%.3f' % (offset + t0), '-f', 'flv']
+        with tempfile.TemporaryFile() as logfile:
+            retcode = self.render.run_ffmpeg(args, False, logfile)
+            if retcode != 0:
+                logfile.seek(0)
+                logging.debug(f'restream piece {piece} failed: {logfile.read()[-2048:]}')
+        try:
+            if retcode != 0 or not exists(output):
+                return b''
+            with open(output, 'rb') as f:
+                return f.read()
+        finally:
+            for filename in [piece, piece_ass, output]:
+                if exists(filename):
+                    os.remove(filename)
+
+    def _shed_load(self, duration:float, elapsed:float, backlog:int):
+        """根据渲染速度调整弹幕密度"""
+        speed = duration / elapsed if elapsed > 0 else 0
+        self.stats['speed'] = speed
+        if speed < 1.05 or backlog > 1:
+            density = self.density * 0.7 if self.density > 0.1 else 0
+            if density != self.density:
+                logging.warning(f'转推渲染速度{speed:.2f}x，降低弹幕密度至{density:.0%}.')
+            self.density = density
+        elif speed > 1.3 and backlog == 0 and self.density < 1:
+            self.density = min(1., max(self.density, 0.05) * 1.25)
+            logging.debug(f'restream speed {speed:.2f}x, danmaku density {self.density:.0%}.')
+        self.stats['density'] = self.density
+
+    def _read_pieces(self, piece_dir:str) -> list:
+        filename = join(piece_dir, 'pieces.csv')
+        if not exists(filename):
+            return []
+        with open(filename, encoding='utf-8') as f:
+            data = f.read()
+        pieces = []
+        for row in data.splitlines()[:data.count('\n')]:
+            fields = row.rsplit(',', 2)
+            if len(fields) == 3:
+                pieces.append((join(piece_dir, fields[0]), float(fields[1]), float(fields[2])))
+        return pieces
+
+    def _run(self):
+        offset = 0.
+        nseg = 0
+        while not self.stoped:
+            seg = self.segments.get()
+            if seg is None:
+                break
+            video, danmaku = seg
+            piece_dir = join(self.workdir, '%04d' % nseg)
+            nseg += 1
+            os.makedirs(piece_dir, exist_ok=True)
+            # 等待录制的视频文件创建
+            while not self.stoped and not exists(video) and self.segments.empty():
+                time.sleep(0.5)
+            if self.stoped or not exists(video):
+                continue
+            logging.info(f'开始转推 {video} 至 {self.url}.')
+            self._start_splitter(video, piece_dir)
+            done_pieces = 0
+            pending = []
+            seg_end = 0.
+            base = None
+            while not self.stoped:
+                done = self.splitter.poll() is not None
+                pieces = self._read_pieces(piece_dir)
+                now = time.monotonic()
+                for piece in pieces[done_pieces:]:
+                    pending.append((*piece, now))
+                done_pieces = len(pieces)
+                # 积压超过max_delay时只保留最新的小段
+                backlog = sum(t1 - t0 for _, t0, t1, _ in pending)
+                while len(pending) > 1 and backlog > self.max_delay:
+                    path, t0, t1, _ = pending.pop(0)
+                    backlog -= t1 - t0
+                    self.stats['dropped_pieces'] += 1
+                    if exists(path):
+                        os.remove(path)
+                    logging.warning(f'转推积压超过{self.max_delay}秒，丢弃{t1-t0:.1f}秒的视频.')
+                if pending:
+                    path, t0, t1, seen = pending[0]
+                    if base is None:
+                        base = t0
+                    with self._dm_lock:
+                        tail = self.danmakus.get(danmaku)
+                        dm_time = tail.last_time if tail else -1
+                    if done or dm_time >= t1 - base or now - seen >= self.dm_wait:
+                        pending.pop(0)
+                        tic = time.monotonic()
+                        data = self._burn(path, danmaku, t0 - base, t1 - base, offset)
+                        if data and self._publish(data):
+                            self.stats['pieces'] += 1
+                            self.stats['published'] += t1 - t0
+                        self._shed_load(t1 - t0, time.monotonic() - tic, len(pending))
+                        seg_end = t1 - base
+                        continue
+                if done and not pending:
+                    break
+                time.sleep(0.2)
+            offset += seg_end
+            shutil.rmtree(piece_dir, ignore_errors=True)
+            with self._dm_lock:
+                self.danmakus.pop(danmaku, None)
+
+        if self.publisher is not None and self.publisher.poll() is None:
+            try:
+                self.publisher.stdin.close()
+                self.publisher.wait(timeout=10)
+            except Exception as e:
+                logging.debug(e)
+                self.publisher.kill()
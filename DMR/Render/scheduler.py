@@ -0,0 +1,209 @@
+import collections
+import logging
+import os
+import threading
+import time
+
+__all__ = ['cpu_percent', 'RenderScheduler']
+
+def cpu_percent() -> float:
+    """
+    当前的CPU使用率（0-100），安装了psutil时使用psutil（两次调用之间的平均值），否则使用1分钟平均负载估算
+    无法获取时返回None
+    """
+    try:
+        import psutil
+        return psutil.cpu_percent(interval=None)
+    except ImportError:
+        pass
+    try:
+        return min(100., os.getloadavg()[0] / (os.cpu_count() or 1) * 100)
+    except (AttributeError, OSError):
+        return None
+
+class RenderScheduler():
+    """
+    渲染任务调度，接口与queue.Queue相同（put/get/task_done/join），代替原来的先进先出队列
+    - 每个分组（直播间）一个队列，优先级高的任务先渲染，优先级相同时轮流渲染各分组的任务（按已经渲染的视频大小计算），同一分组内按先后顺序
+    - 同时渲染的任务数超过nrenders时（max_renders大于nrenders），CPU使用率超过max_cpu的情况下不开始新的任务
+    - max_renders大于nrenders时自动调整同时渲染的任务数：按渲染速度统计各个并发数下的总吞吐量，吞吐量还在提高时增加并发数，不再提高时减少
+    - 记录每个任务的排队时间和渲染速度（视频时长/渲染用时）
+    """
+    def __init__(self, nrenders:int=1, max_renders:int=0, max_cpu:float=90, admit_interval:float=10) -> None:
+        self.min_renders = max(1, int(nrenders))
+        self.max_renders = max(self.min_renders, int(max_renders or 0))
+        self.limit = self.min_renders
+        self.max_cpu = float(max_cpu or 0)
+        self.admit_interval = admit_interval
+        self.min_elapsed = 10
+
+        self.queues = collections.OrderedDict()
+        self.served = {}
+        self.running = {}
+        self.unfinished = 0
+        self.closed = False
+        self._cond = threading.Condition()
+        self._last_admit = 0
+        self._cpu = None
+        self._cpu_time = 0
+
+        # 各个并发数下完成的任务的渲染速度
+        self.speeds = collections.defaultdict(lambda: collections.deque(maxlen=10))
+        self.history = collections.deque(maxlen=100)
+
+    @property
+    def nworkers(self) -> int:
+        """需要创建的渲染线程数量"""
+        return self.max_renders
+
+    def put(self, task, priority:int=None):
+        with self._cond:
+            if task == 'exit':
+                self.closed = True
+                self._cond.notify_all()
+                return
+            if priority is not None:
+                task['priority'] = priority
+            task.setdefault('priority', 0)
+            task['queue_time'] = time.time()
+            group = task.get('group')
+            if group not in self.queues:
+                self.queues[group] = collections.deque()
+            if group not in self.served or not self.queues[group]:
+                # 新加入（或者重新有任务）的分组从当前最少的进度开始，不会因为之前没有任务而连续占用渲染
+                active = [self.served[g] for g, q in self.queues.items() if q and g in self.served]
+                self.served[group] = max(self.served.get(group, 0), min(active) if active else 0)
+            self.queues[group].append(task)
+            self.unfinished += 1
+            self._cond.notify_all()
+
+    def _cpu_usage(self) -> float:
+        now = time.monotonic()
+        if now - self._cpu_time >= 2:
+            self._cpu = cpu_percent()
+            self._cpu_time = now
+        return self._cpu
+
+    def _admit(self) -> bool:
+        if len(self.running) >= self.limit:
+            return False
+        # nrenders以内的任务直接开始，只有自动增加的（超过nrenders的）任务需要检查CPU使用率
+        if len(self.running) < self.min_renders:
+            return True
+        # 新任务开始之后一段时间CPU使用率才会反映出来
+        if time.monotonic() - self._last_admit < self.admit_interval:
+            return False
+        cpu = self._cpu_usage()
+        if self.max_cpu > 0 and cpu is not None and cpu >= self.max_cpu:
+            return False
+        return True
+
+    def _select(self):
+        candidates = [(g, q[0]) for g, q in self.queues.items() if q]
+        if not candidates:
+            return None
+        group, _ = min(candidates, key=lambda x: (-x[1].get('priority', 0), self.served.get(x[0], 0)))
+        task = self.queues[group].popleft()
+        try:
+            cost = os.path.getsize(task['video'])
+        except (OSError, KeyError, TypeError):
+            cost = 1
+        self.served[group] = self.served.get(group, 0) + cost
+        return task
+
+    def get(self, pid:int=0):
+        """取出下一个任务，调度器关闭时返回'exit'"""
+        with self._cond:
+            while True:
+                if self.closed:
+                    return 'exit'
+                if pid < self.limit and any(self.queues.values()) and self._admit():
+                    task = self._select()
+                    now = time.time()
+                    task['queue_wait'] = now - task['queue_time']
+                    task['start_time'] = now
+                    task['concurrency'] = len(self.running) + 1
+                    self.running[pid] = task
+                    self._last_admit = time.monotonic()
+                    return task
+                self._cond.wait(timeout=2)
+
+    def finish(self, pid:int, duration:float=None):
+        """记录任务完成，duration为视频时长（秒），无法获取时为None"""
+        with self._cond:
+            task = self.running.pop(pid, None)
+            if task is None:
+                return
+            elapsed = time.time() - task['start_time']
+            speed = duration / elapsed if duration and duration > 0 and elapsed > 0 else None
+            task['speed'] = speed
+            # 时间太短的任务（使用渲染缓存、直接封装等）不能反映编码速度
+            if speed and elapsed >= self.min_elapsed:
+                # 并发数按任务开始和结束时的平均值计算
+                concurrency = round((task['concurrency'] + len(self.running) + 1) / 2)
+                self.speeds[concurrency].append(speed)
+                self._tune()
+            self.history.append({
+                'video': task.get('video'),
+                'group': task.get('group'),
+                'priority': task.get('priority'),
+                'queue_wait': task['queue_wait'],
+                'elapsed': elapsed,
+                'speed': speed,
+            })
+            self._cond.notify_all()
+
+    def throughput(self, concurrency:int) -> float:
+        """并发数为concurrency时的总渲染速度（平均单任务速度*并发数），没有记录时返回None"""
+        speeds = self.speeds.get(concurrency)
+        if not speeds:
+            return None
+        return sum(speeds) / len(speeds) * concurrency
+
+    def _tune(self):
+        if self.max_renders <= self.min_renders:
+            return
+        current = self.throughput(self.limit)
+        if current is None:
+            return
+        lower = self.throughput(self.limit - 1) if self.limit > self.min_renders else None
+        upper = self.throughput(self.limit + 1) if self.limit < self.max_renders else None
+        cpu = self._cpu_usage()
+        # 多一个任务总速度提高不到5%时不值得占用更多资源
+        if lower is not None and current < lower * 1.05:
+            self.limit -= 1
+            logging.info(f'并发渲染的总速度没有提高（{lower:.2f}x -> {current:.2f}x），同时渲染的任务数减少为{self.limit}.')
+        elif self.limit < self.max_renders and any(self.queues.values()) and \
+                (upper is None or upper > current * 1.05) and \
+                not (self.max_cpu > 0 and cpu is not None and cpu >= self.max_cpu):
+            self.limit += 1
+            logging.info(f'当前总渲染速度{current:.2f}x，同时渲染的任务数增加为{self.limit}.')
+
+    def task_done(self):
+        with self._cond:
+            self.unfinished -= 1
+            if self.unfinished <= 0:
+                self.unfinished = 0
+                self._cond.notify_all()
+
+    def join(self):
+        with self._cond:
+            while self.unfinished > 0 and not self.closed:
+                self._cond.wait()
+
+    def stats(self) -> dict:
+        with self._cond:
+            now = time.time()
+            return {
+                'limit': self.limit,
+                'running': [{
+                    'video': t.get('video'),
+                    'group': t.get('group'),
+                    'queue_wait': t['queue_wait'],
+                    'elapsed': now - t['start_time'],
+                } for t in self.running.values()],
+                'waiting': {str(g): len(q) for g, q in self.queues.items() if q},
+                'cpu': self._cpu,
+                'throughput': {c: self.throughput(c) for c in sorted(self.speeds)},
+                'history': list(self.history),
+            }
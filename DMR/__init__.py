@@ -139,14 +139,28 @@ class DanmakuRender():
                                           upload_configs=replay_config['upload']['src_video'])
                 self.downloaders[group]['status'] = 'end'
 
+        elif type == 'segment_start':
+            fp = msg['msg']
+            if self.live_render_enabled(replay_config) and msg.get('danmaku'):
+                logging.info(f'分片 {fp} 开始边录边渲染.')
+                self.render.add_live(fp, msg.get('danmaku'), group=group,
+                                     render_config=replay_config.get('render'))
+
         elif type == 'split':
             fp = msg['msg']
             logging.info(f'分片 {fp} 录制完成.')
 
             if replay_config.get('danmaku') and replay_config.get('auto_render') and replay_config.get('video'):
-                logging.info(f'添加分片 {fp} 至渲染队列.')
-                self.render.add(fp, group=group, video_info=msg.get('video_info'),
-                                render_config=replay_config.get('render'))
+                priority = self.render_priority(replay_config)
+                if msg.get('raw_file') and self.render.finish_live(msg['raw_file'], fp, group=group,
+                                                                   video_info=msg.get('video_info'),
+                                                                   render_config=replay_config.get('render'),
+                                                                   priority=priority):
+                    logging.info(f'分片 {fp} 正在完成边录边渲染.')
+                else:
+                    logging.info(f'添加分片 {fp} 至渲染队列.')
+                    self.render.add(fp, group=group, video_info=msg.get('video_info'),
+                                    render_config=replay_config.get('render'), priority=priority)
 
             if replay_config.get('upload') and replay_config['upload'].get('src_video'):
                 self.uploader.add(fp, group=(group, 'src_video'), video_info=msg.get('video_info'),
@@ -156,6 +170,23 @@ class DanmakuRender():
             logging.error(f'录制 {group} 遇到错误，即将重试.')
             logging.error(msg.get('desc'))
 
+    @staticmethod
+    def render_priority(replay_config) -> int:
+        """渲染优先级：渲染参数中的priority，带弹幕视频需要实时上传时再提高一级（上传在等待渲染完成）"""
+        render_config = replay_config.get('render') or {}
+        priority = int(render_config.get('priority', 0) or 0)
+        for upload_config in (replay_config.get('upload') or {}).get('dm_video') or []:
+            if upload_config.get('realtime'):
+                return priority + 1
+        return priority
+
+    @staticmethod
+    def live_render_enabled(replay_config) -> bool:
+        if not (replay_config.get('danmaku') and replay_config.get('auto_render') and replay_config.get('video')):
+            return False
+        render_config = replay_config.get('render') or {}
+        return bool((render_config.get('advanced_render_args') or {}).get('live_render'))
+
     def process_render_message(self, msg):
         type = msg['type']
         group = msg['group']
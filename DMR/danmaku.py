@@ -1,12 +1,16 @@
-
 class SimpleDanmaku():
+    # 录制时会产生大量弹幕对象，使用__slots__减少内存占用
+    __slots__ = ('time', 'dtype', 'uname', 'color', 'content', 'price', 'recv_time', 'server_time')
+
     def __init__(self,
                  time: float = -1,
                  dtype: str = None,
                  uname: str = None,
                  color: str = 'ffffff',
                  content: str = None,
-                 price: float = 0  # 新增 price 字段
+                 price: float = 0,  # 新增 price 字段
+                 recv_time: float = -1,  # 接收到弹幕的时间戳
+                 server_time: float = -1,  # 直播平台给出的弹幕时间戳，没有则为-1
                  ) -> None:
         self.time = time
         self.dtype = dtype
@@ -14,6 +18,8 @@ class SimpleDanmaku():
         self.color = color
         self.content = content
         self.price = price  # 将 price 存储在 SimpleDanmaku 对象中
+        self.recv_time = recv_time
+        self.server_time = server_time
 
     def todict(self):
         return {
@@ -22,5 +28,7 @@ class SimpleDanmaku():
             'uname': self.uname,
             'color': self.color,
             'content': self.content,
-            'price': self.price  # 将 price 添加到返回的字典中
+            'price': self.price,  # 将 price 添加到返回的字典中
+            'recv_time': self.recv_time,
+            'server_time': self.server_time,
         }
@@ -1,5 +1,7 @@
+import bisect
 import subprocess
 import json
+import threading
 import warnings
 import re
 
@@ -15,6 +17,7 @@ __all__ = [
     'RGB2BGR',
     'BGR2RGB',
     'FFprobe',
+    'LatencyHistogram',
 ]
 
 def replace_keywords(string:str, kw_info:dict=None, replace_invalid:bool=False):
@@ -51,6 +54,57 @@ def BGR2RGB(color):
 def RGB2BGR(color):
     return BGR2RGB(color)
 
+class LatencyHistogram():
+    """
+    耗时直方图（线程安全），按近似对数间隔的桶统计，单位为秒
+    """
+    BUCKETS = (0.001, 0.002, 0.005, 0.01, 0.02, 0.05, 0.1, 0.2, 0.5, 1, 2, 5, 10, 30, 60)
+
+    def __init__(self, buckets:tuple=None) -> None:
+        self.buckets = tuple(buckets) if buckets else self.BUCKETS
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self.counts = [0] * (len(self.buckets) + 1)
+            self.count = 0
+            self.total = 0.
+            self.max = 0.
+
+    def record(self, value:float):
+        idx = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            self.counts[idx] += 1
+            self.count += 1
+            self.total += value
+            if value > self.max:
+                self.max = value
+
+    def percentile(self, q:float) -> float:
+        """返回q分位数所在桶的上界（超出最大的桶时返回最大值）"""
+        with self._lock:
+            if not self.count:
+                return 0.
+            target = q * self.count
+            acc = 0
+            for idx, cnt in enumerate(self.counts):
+                acc += cnt
+                if acc >= target:
+                    return self.buckets[idx] if idx < len(self.buckets) else self.max
+            return self.max
+
+    def stats(self) -> dict:
+        return {
+            'count': self.count,
+            'mean': self.total / self.count if self.count else 0.,
+            'max': self.max,
+            'p50': self.percentile(0.5),
+            'p90': self.percentile(0.9),
+            'p99': self.percentile(0.99),
+            'buckets': {f'<={b}': c for b, c in zip(self.buckets + ('inf',), self.counts)},
+        }
+
 class FFprobe():
     header = {
                 'Content-Type': 'application/x-www-form-urlencoded',
@@ -88,6 +142,38 @@ class FFprobe():
         except:
             return -1
 
+    @classmethod
+    def get_video_packets(cls,fpath) -> list:
+        """视频流所有数据包的[(时间, 是否关键帧), ...]（秒，相对于视频开始，按时间排序），失败时返回空列表"""
+        try:
+            out = subprocess.check_output([
+                cls.ffprobe(),
+                '-i', fpath,
+                '-select_streams', 'v:0',
+                '-show_entries', 'packet=pts_time,flags',
+                '-of', 'csv=p=0',
+                '-v', 'quiet'
+                ])
+            try:
+                st = float(cls.run_ffprobe(fpath)['format']['start_time'])
+            except:
+                st = 0
+            packets = []
+            for line in out.decode('utf8').splitlines():
+                pts, _, flags = line.strip().partition(',')
+                try:
+                    packets.append((float(pts) - st, 'K' in flags))
+                except ValueError:
+                    pass
+            return sorted(packets)
+        except:
+            return []
+
+    @classmethod
+    def get_keyframes(cls,fpath) -> list:
+        """视频流所有关键帧的时间（秒，相对于视频开始），失败时返回空列表"""
+        return [t for t, key in cls.get_video_packets(fpath) if key]
+
     @classmethod
     def run_ffprobe_livestream(cls, url, header=None):
         if header is None:
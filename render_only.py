@@ -52,6 +52,13 @@ def main():
     tasks = []
     ignores = []
 
+    # 渲染缓存中有记录的视频不需要读取时长
+    cache_render = None
+    if config.render_config.get('engine') == 'ffmpeg' and \
+            (config.render_config.get('advanced_render_args') or {}).get('render_cache', False):
+        from DMR.Render.ffmpegrender import FFmpegRender
+        cache_render = FFmpegRender(**config.render_config)
+
     for _, vname in enumerate(videos):
         danmu = os.path.splitext(vname)[0] + '.ass'
         fmt = config.render_config.get('format', 'mp4')
@@ -63,6 +70,21 @@ def main():
         os.makedirs(output_dir,exist_ok=True)
         output = join(output_dir,filename)
 
+        cached = cache_render.cached_output(vname, danmu) if cache_render and exists(danmu) else None
+        if cached:
+            if os.path.abspath(cached) != os.path.abspath(output):
+                tasks.append({
+                    'video':vname,
+                    'danmaku':danmu,
+                    'output':output
+                })
+                continue
+            ignores.append({
+                'video': vname,
+                'msg': f'视频 {vname} 已经渲染过（渲染缓存），跳过渲染.',
+                })
+            continue
+
         if exists(output) and FFprobe.get_duration(output) - FFprobe.get_duration(vname) < 30:
             ignores.append({
                 'video': vname,
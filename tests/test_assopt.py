@@ -0,0 +1,128 @@
+import shutil
+import subprocess
+import time
+
+import pytest
+
+from DMR.danmaku import SimpleDanmaku
+from DMR.Downloader.asswriter import AssWriter
+from DMR.Render.assopt import optimize_ass
+
+FFMPEG = shutil.which('ffmpeg')
+needs_ffmpeg = pytest.mark.skipif(not FFMPEG, reason='ffmpeg not found')
+
+COLORS = ['ffffff', 'ff0000', '00ff00', '0000ff']
+
+
+def write_ass(filename, n, rate=10, colors=COLORS, extra=()):
+    writer = AssWriter(description='test', width=640, height=360, dst=0, dmrate=1, font='Microsoft YaHei',
+                       fontsize=24, margin_h=6, margin_w=20, dmduration=8, opacity=0.8, auto_fontsize=False,
+                       outlinecolor='000000', outlinesize=1)
+    writer.open(filename)
+    for i in range(n):
+        writer.add(SimpleDanmaku(time=i / rate, dtype='danmaku', uname='u', color=colors[i % len(colors)],
+                                 content=f'弹幕{i}'), calc_collision=False)
+    writer.close()
+    with open(filename, 'a', encoding='utf-8') as f:
+        f.writelines(row + '\n' for row in extra)
+
+
+def read(filename):
+    styles, events = [], []
+    with open(filename, encoding='utf-8') as f:
+        for row in f:
+            row = row.rstrip('\n')
+            if row.startswith('Style:'):
+                styles.append(row)
+            elif row.startswith('Dialogue:') or row.startswith('Picture:'):
+                events.append(row)
+    return styles, events
+
+
+def test_cull_invisible_and_picture(tmp_path):
+    src, dst = str(tmp_path / 'a.ass'), str(tmp_path / 'b.ass')
+    extra = [
+        # 持续时间为0
+        'Dialogue: 0,0:00:01.00,0:00:01.00,R2L,,0,0,0,,{\\move(640,24,-40,24)}零长度',
+        # 视频结束之后才开始
+        'Dialogue: 0,0:01:00.00,0:01:08.00,R2L,,0,0,0,,{\\move(640,24,-40,24)}太晚',
+        # 纵坐标在画面外
+        'Dialogue: 0,0:00:02.00,0:00:10.00,R2L,,0,0,0,,{\\move(640,1000,-40,1000)}画面下方',
+        'Dialogue: 0,0:00:02.00,0:00:10.00,R2L,,0,0,0,,{\\move(640,-100,-40,-100)}画面上方',
+        # libass不支持图片
+        'Picture: 0,0:00:03.00,0:00:11.00,R2L,,0,0,0,,{\\move(640,24,-24,24)}emoticon.png',
+        # 其他样式的事件原样保留
+        'Dialogue: 0,0:00:04.00,0:00:12.00,message_box,,0000,0000,0000,,醒目留言',
+    ]
+    write_ass(src, 10, extra=extra)
+    stats = optimize_ass(src, dst, duration=30)
+    assert stats['total'] == 16
+    assert stats['invisible'] == 4
+    assert stats['picture'] == 1
+    assert stats['output'] == 11
+    _, events = read(dst)
+    text = '\n'.join(events)
+    assert 'Picture:' not in text
+    for content in ['零长度', '太晚', '画面下方', '画面上方']:
+        assert content not in text
+    assert any(row.endswith('醒目留言') for row in events)
+
+
+def test_hoist_colors_to_styles(tmp_path):
+    src, dst = str(tmp_path / 'a.ass'), str(tmp_path / 'b.ass')
+    write_ass(src, 20)
+    _, src_events = read(src)
+    stats = optimize_ass(src, dst)
+    styles, events = read(dst)
+    names = [row[6:].strip().split(',')[0] for row in styles]
+    # 白色与R2L样式相同，不需要新样式
+    assert sorted(n for n in names if n.startswith('R2L_')) == ['R2L_330000FF', 'R2L_3300FF00', 'R2L_33FF0000']
+    assert stats['styles'] == 3 and stats['hoisted'] == 20
+    for src_row, row in zip(src_events, events):
+        assert '\\1c' not in row and '\\alpha' not in row
+        # \move和文本不变
+        assert src_row.split('}', 1)[0].split(',,', 1)[1] in row
+        assert src_row.rsplit('}', 1)[1] == row.rsplit('}', 1)[1]
+    # 红色弹幕使用了红色（BGR）样式
+    assert ',R2L_330000FF,' in events[1]
+
+
+def test_max_styles(tmp_path):
+    src, dst = str(tmp_path / 'a.ass'), str(tmp_path / 'b.ass')
+    colors = [f'{i:02x}0000' for i in range(1, 11)]
+    write_ass(src, 40, colors=colors)
+    stats = optimize_ass(src, dst, max_styles=4)
+    styles, events = read(dst)
+    assert stats['styles'] == 4 and stats['hoisted'] == 16
+    assert sum('\\1c' in row for row in events) == 24
+
+
+def test_max_events_clamp(tmp_path):
+    src, dst = str(tmp_path / 'a.ass'), str(tmp_path / 'b.ass')
+    write_ass(src, 100, rate=20)
+    stats = optimize_ass(src, dst, max_events=5, window=1)
+    _, events = read(dst)
+    assert stats['clamped'] == 75 and stats['output'] == len(events) == 25
+    # 每秒只保留最早的5条
+    assert [row.rsplit('}', 1)[1] for row in events[:6]] == ['弹幕0', '弹幕1', '弹幕2', '弹幕3', '弹幕4', '弹幕20']
+
+
+def render_time(filename, duration):
+    t0 = time.perf_counter()
+    subprocess.run([FFMPEG, '-v', 'error', '-f', 'lavfi', '-i', f'color=c=black:s=640x360:r=30:d={duration}',
+                    '-vf', f'ass={filename}', '-f', 'null', '-'], check=True)
+    return time.perf_counter() - t0
+
+
+@needs_ffmpeg
+def test_render_speed(tmp_path):
+    # 用libass实际渲染，比较精简前后的渲染速度
+    duration = 10
+    src, dst = str(tmp_path / 'a.ass'), str(tmp_path / 'b.ass')
+    write_ass(src, duration * 30, rate=30)
+    stats = optimize_ass(src, dst, duration=duration, max_events=10, window=1)
+    raw_time = render_time(src, duration)
+    opt_time = render_time(dst, duration)
+    print(f"events {stats['total']} -> {stats['output']}, "
+          f'{duration * 30 / raw_time:.1f}fps -> {duration * 30 / opt_time:.1f}fps')
+    assert opt_time < raw_time
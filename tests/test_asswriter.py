@@ -0,0 +1,116 @@
+import os
+import time
+
+import pytest
+
+from DMR.danmaku import SimpleDanmaku
+from DMR.Downloader.asswriter import AssWriter
+
+
+def make_writer(**kwargs):
+    args = dict(description='test', width=1920, height=1080, dst=0, dmrate=1, font='Microsoft YaHei',
+                fontsize=36, margin_h=6, margin_w=20, dmduration=15, opacity=0.8, auto_fontsize=False,
+                outlinecolor='000000', outlinesize=1)
+    args.update(kwargs)
+    return AssWriter(**args)
+
+
+def danmakus(n):
+    # 每条弹幕间隔足够大，不会因为碰撞被丢弃
+    return [SimpleDanmaku(time=i * 2 + 1, dtype='danmaku', uname='u', color='ffffff', content=f'弹幕{i}')
+            for i in range(n)]
+
+
+def read_events(filename):
+    with open(filename, encoding='utf-8') as f:
+        return [row for row in f if row.startswith('Dialogue:')]
+
+
+@pytest.fixture
+def fsync_calls(monkeypatch):
+    calls = []
+    real_fsync = os.fsync
+    monkeypatch.setattr(os, 'fsync', lambda fd: (calls.append(fd), real_fsync(fd)))
+    return calls
+
+
+def test_buffered_until_close(tmp_path, fsync_calls):
+    filename = str(tmp_path / 'a.ass')
+    writer = make_writer(flush_size=1 << 20, flush_interval=60)
+    writer.open(filename)
+    for danmu in danmakus(100):
+        assert writer.add(danmu)
+    # 缓冲没有满，也没有到写入间隔
+    assert read_events(filename) == []
+    writer.close()
+    events = read_events(filename)
+    assert len(events) == 100 and '弹幕99' in events[-1]
+    assert fsync_calls == []
+
+
+def test_flush_size_and_interval(tmp_path):
+    filename = str(tmp_path / 'a.ass')
+    writer = make_writer(flush_size=200, flush_interval=60)
+    writer.open(filename)
+    for danmu in danmakus(20):
+        writer.add(danmu)
+    time.sleep(0.5)
+    # 超过flush_size后在后台写入
+    assert len(read_events(filename)) >= 10
+    writer.close()
+
+    writer = make_writer(flush_size=1 << 20, flush_interval=0.2)
+    writer.open(filename)
+    for danmu in danmakus(5):
+        writer.add(danmu)
+    time.sleep(0.8)
+    assert len(read_events(filename)) == 5
+    writer.close()
+
+
+@pytest.mark.parametrize('mode', ['never', 'flush', 'close'])
+def test_fsync_modes(tmp_path, fsync_calls, mode):
+    filename = str(tmp_path / 'a.ass')
+    writer = make_writer(flush_size=1 << 20, flush_interval=60, fsync=mode)
+    writer.open(filename)
+    for i, danmu in enumerate(danmakus(30)):
+        writer.add(danmu)
+        if i % 10 == 9:
+            writer.flush()
+            # flush之后其他进程可以读到全部内容
+            assert len(read_events(filename)) == i + 1
+    flushed = len(fsync_calls)
+    writer.close()
+    assert len(read_events(filename)) == 30
+    if mode == 'never':
+        assert fsync_calls == []
+    elif mode == 'flush':
+        assert flushed == 3 and len(fsync_calls) >= 4
+    else:
+        assert flushed == 0 and len(fsync_calls) == 1
+
+
+def test_slow_disk_does_not_stall_add(tmp_path, monkeypatch):
+    # 同步到磁盘很慢时，add()只写入缓冲，不会阻塞调用者（弹幕接收的事件循环）
+    real_fsync = os.fsync
+
+    def slow_fsync(fd):
+        time.sleep(0.3)
+        real_fsync(fd)
+    monkeypatch.setattr(os, 'fsync', slow_fsync)
+
+    filename = str(tmp_path / 'a.ass')
+    writer = make_writer(flush_size=256, flush_interval=0.05, fsync='flush')
+    writer.open(filename)
+    worst = 0
+    start = time.perf_counter()
+    for danmu in danmakus(300):
+        t = time.perf_counter()
+        writer.add(danmu)
+        worst = max(worst, time.perf_counter() - t)
+        time.sleep(0.002)
+    elapsed = time.perf_counter() - start
+    writer.close()
+    print(f'add(): worst {worst * 1000:.1f}ms over {elapsed:.2f}s with 300ms fsync')
+    assert worst < 0.1
+    assert len(read_events(filename)) == 300
@@ -0,0 +1,212 @@
+import json
+import random
+import struct
+import threading
+import time
+import zlib
+
+from DMR.LiveAPI.danmaku.cc import CC, extract_msg_fields
+
+
+# 测试用的msgpack编码器，覆盖CC消息中出现的类型
+def pack(v) -> bytes:
+    if v is None:
+        return b'\xc0'
+    if v is True or v is False:
+        return b'\xc3' if v else b'\xc2'
+    if isinstance(v, int):
+        if 0 <= v <= 0x7f:
+            return bytes([v])
+        if -32 <= v < 0:
+            return bytes([v + 256])
+        if 0 <= v <= 0xffff:
+            return b'\xcd' + struct.pack('>H', v)
+        if 0 <= v <= 0xffffffff:
+            return b'\xce' + struct.pack('>I', v)
+        return b'\xd3' + struct.pack('>q', v)
+    if isinstance(v, float):
+        return b'\xcb' + struct.pack('>d', v)
+    if isinstance(v, str):
+        b = v.encode('utf-8')
+        n = len(b)
+        if n < 32:
+            return bytes([0xa0 + n]) + b
+        if n <= 0xff:
+            return b'\xd9' + struct.pack('>B', n) + b
+        return b'\xda' + struct.pack('>H', n) + b
+    if isinstance(v, list):
+        n = len(v)
+        head = bytes([0x90 + n]) if n < 16 else b'\xdc' + struct.pack('>H', n)
+        return head + b''.join(pack(x) for x in v)
+    if isinstance(v, dict):
+        n = len(v)
+        head = bytes([0x80 + n]) if n < 16 else b'\xde' + struct.pack('>H', n)
+        return head + b''.join(pack(k) + pack(x) for k, x in v.items())
+    raise TypeError(v)
+
+
+# 原来的解码方式：完整解析整个数据再取出需要的字段，作为对照
+def legacy_unpack(buf, pos=0):
+    b = buf[pos]
+    pos += 1
+    if b <= 0x7f:
+        return b, pos
+    if b <= 0x8f or b in (0xde, 0xdf):
+        if b <= 0x8f:
+            n = b - 0x80
+        else:
+            fmt = '>H' if b == 0xde else '>I'
+            n, = struct.unpack_from(fmt, buf, pos)
+            pos += struct.calcsize(fmt)
+        d = {}
+        for _ in range(n):
+            k, pos = legacy_unpack(buf, pos)
+            d[k], pos = legacy_unpack(buf, pos)
+        return d, pos
+    if b <= 0x9f or b in (0xdc, 0xdd):
+        if b <= 0x9f:
+            n = b - 0x90
+        else:
+            fmt = '>H' if b == 0xdc else '>I'
+            n, = struct.unpack_from(fmt, buf, pos)
+            pos += struct.calcsize(fmt)
+        items = []
+        for _ in range(n):
+            x, pos = legacy_unpack(buf, pos)
+            items.append(x)
+        return items, pos
+    if b <= 0xbf or b in (0xd9, 0xda, 0xdb):
+        if b <= 0xbf:
+            n = b - 0xa0
+        else:
+            fmt = {0xd9: '>B', 0xda: '>H', 0xdb: '>I'}[b]
+            n, = struct.unpack_from(fmt, buf, pos)
+            pos += struct.calcsize(fmt)
+        return bytes(buf[pos:pos + n]).decode('utf-8'), pos + n
+    if b >= 0xe0:
+        return b - 256, pos
+    if b in (0xc0, 0xc2, 0xc3):
+        return {0xc0: None, 0xc2: False, 0xc3: True}[b], pos
+    fmt = {0xca: '>f', 0xcb: '>d', 0xcc: '>B', 0xcd: '>H', 0xce: '>I', 0xcf: '>Q',
+           0xd0: '>b', 0xd1: '>h', 0xd2: '>i', 0xd3: '>q'}[b]
+    return struct.unpack_from(fmt, buf, pos)[0], pos + struct.calcsize(fmt)
+
+
+def legacy_decode_msg(e):
+    n, r, p = struct.unpack('<HHI', e[:8])
+    studio = {(515, 32785): 'chat', (535, 32769): 'gamechat'}
+    if (n, r) not in studio:
+        return []
+    o = e[12:] if p else e[8:]
+    o = o if o[0] != 120 else zlib.decompress(o)
+    msg, _ = legacy_unpack(o)
+    msgs = []
+    for m in msg['msg']:
+        if studio[(n, r)] == 'chat':
+            name = m[197]
+        else:
+            name = json.loads(m[7])['nickname']
+        msgs.append({'name': name, 'content': m[4], 'msg_type': 'danmaku', 'color': 'ffffff'})
+    return msgs
+
+
+def random_value(rng, depth=0):
+    choice = rng.randrange(8 if depth < 2 else 5)
+    if choice == 0:
+        return rng.randrange(-32, 1 << 40)
+    if choice == 1:
+        return rng.random() * 1000
+    if choice == 2:
+        return ''.join(rng.choice('abc弹幕😀 ') for _ in range(rng.randrange(0, 60)))
+    if choice == 3:
+        return rng.choice([None, True, False])
+    if choice == 4:
+        return rng.randrange(0, 1 << 16)
+    if choice == 5:
+        return [random_value(rng, depth + 1) for _ in range(rng.randrange(0, 6))]
+    return {str(i): random_value(rng, depth + 1) for i in range(rng.randrange(0, 6))}
+
+
+def make_frame(rng, gamechat=False, compress=False, with_length=False):
+    msgs = []
+    for i in range(rng.randrange(1, 30)):
+        m = {k: random_value(rng) for k in rng.sample(range(1, 300), rng.randrange(0, 12))}
+        m[4] = f'内容{i}-' + 'x' * rng.randrange(0, 40)
+        if gamechat:
+            m[7] = json.dumps({'nickname': f'用户{i}', 'level': rng.randrange(100)}, ensure_ascii=False)
+        else:
+            m[197] = f'用户{i}'
+        msgs.append(m)
+    payload = {'ts': rng.randrange(1 << 32), 'extra': random_value(rng), 'msg': msgs, 'tail': random_value(rng)}
+    body = pack(payload)
+    if compress:
+        body = zlib.compress(body)
+    sid, cid = (535, 32769) if gamechat else (515, 32785)
+    if with_length:
+        return struct.pack('<HHI', sid, cid, 1) + struct.pack('<I', len(body)) + body
+    return struct.pack('<HHI', sid, cid, 0) + body
+
+
+def make_frames(n, seed=0):
+    rng = random.Random(seed)
+    return [make_frame(rng, gamechat=rng.random() < 0.5, compress=rng.random() < 0.5,
+                       with_length=rng.random() < 0.5) for _ in range(n)]
+
+
+def test_matches_legacy_decoder():
+    for frame in make_frames(300):
+        assert CC.decode_msg(frame) == legacy_decode_msg(frame)
+
+
+def test_other_frames():
+    # 其他类型的消息不产生任何消息
+    frame = struct.pack('<HHI', 512, 32784, 0) + pack({'data': {'msg_list': [{4: 'x', 197: 'n'}]}})
+    assert CC.decode_msg(frame) == []
+    frame = struct.pack('<HHI', 6144, 2, 0) + pack({'msg': [{4: 'x', 197: 'n'}]})
+    assert CC.decode_msg(frame) == []
+
+
+def test_extract_selected_fields_only():
+    data = pack({'a': [1, 2, {'b': 3}], 'msg': [{4: 'x', 5: 'y', 197: 'n'}, 'not a map']})
+    assert extract_msg_fields(data, {4, 197}) == [{4: 'x', 197: 'n'}]
+
+
+def test_concurrent_rooms():
+    # 多个直播间在不同线程中同时解码，结果与单独解码一致
+    rooms = [make_frames(60, seed=i) for i in range(8)]
+    expected = [[legacy_decode_msg(f) for f in frames] for frames in rooms]
+    results = [None] * len(rooms)
+    barrier = threading.Barrier(len(rooms))
+
+    def worker(i):
+        barrier.wait()
+        out = []
+        for _ in range(5):
+            out = [CC.decode_msg(f) for f in rooms[i]]
+            if out != expected[i]:
+                break
+        results[i] = out
+
+    threads = [threading.Thread(target=worker, args=(i,)) for i in range(len(rooms))]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    assert results == expected
+
+
+def test_throughput():
+    frames = make_frames(200, seed=42)
+
+    def rate(func):
+        t = time.perf_counter()
+        cnt = 0
+        for _ in range(3):
+            for f in frames:
+                func(f)
+                cnt += 1
+        return cnt / (time.perf_counter() - t)
+
+    new, old = rate(CC.decode_msg), rate(legacy_decode_msg)
+    print(f'cc decoder: {new:.0f} frames/s, full decode: {old:.0f} frames/s')
+    assert new > old * 0.8
@@ -0,0 +1,76 @@
+import json
+import time
+
+from DMR.Downloader.danmakuio import DanmakuWriter
+from DMR.Downloader.dmsource import DanmakuSource
+from DMR.utils import LatencyHistogram
+
+
+def parse(sources):
+    return DanmakuWriter._parse_sources(None, sources)
+
+
+def test_parse_sources():
+    sources = parse([
+        'https://www.twitch.tv/Someone',
+        {'url': 'https://www.huya.com/123', 'prefix': '', 'delay': 2},
+        {'url': 'https://www.douyu.com/456', 'prefix': '[斗鱼]'},
+        # 自定义前缀时也需要检查地址
+        {'url': 'not a url', 'prefix': '[x]'},
+        {'url': 'not a url'},
+        {'prefix': '[x]'},
+        123,
+    ])
+    assert sources == [
+        {'url': 'https://www.twitch.tv/Someone', 'prefix': '[twitch]'},
+        {'url': 'https://www.huya.com/123', 'prefix': '', 'delay': 2},
+        {'url': 'https://www.douyu.com/456', 'prefix': '[斗鱼]'},
+    ]
+
+
+def test_latency_histogram():
+    hist = LatencyHistogram((0.01, 0.1, 1))
+    for value in [0.005] * 50 + [0.05] * 40 + [0.5] * 9 + [3]:
+        hist.record(value)
+    stats = hist.stats()
+    assert stats['count'] == 100 and stats['max'] == 3
+    assert abs(stats['mean'] - (0.25 + 2 + 4.5 + 3) / 100) < 1e-9
+    assert stats['p50'] == 0.01 and stats['p90'] == 0.1 and stats['p99'] == 1
+    # 超出最大的桶时返回最大值
+    assert hist.percentile(1) == 3
+    assert stats['buckets'] == {'<=0.01': 50, '<=0.1': 40, '<=1': 9, '<=inf': 1}
+    hist.reset()
+    assert hist.stats()['count'] == 0 and hist.percentile(0.5) == 0
+
+
+def make_writer(tmp_path):
+    writer = DanmakuWriter('https://live.bilibili.com/1', str(tmp_path / 'rec_%03d.ass'), 3600, 'ass,jsonl', None,
+                           advanced_dm_args={'dm_delay_fixed': 0}, description='test', width=1920, height=1080,
+                           dst=0, dmrate=1, font='Microsoft YaHei', fontsize=36, margin_h=6, margin_w=20,
+                           dmduration=15, opacity=0.8, auto_fontsize=False, outlinecolor='000000', outlinesize=1)
+    writer.part_start_time = time.time() - 10
+    writer.part_start_mono = time.monotonic() - 10
+    writer.dm_file = str(tmp_path / 'rec_000.ass')
+    writer.dmwriter.open(writer.dm_file)
+    return writer
+
+
+def test_time_from_socket_stamp(tmp_path):
+    writer = make_writer(tmp_path)
+    source = DanmakuSource('https://live.bilibili.com/1')
+    now = time.monotonic()
+    # 2秒前读取到数据，解码用了0.01秒，在队列中等待了约2秒才处理
+    dm = {'msg_type': 'danmaku', 'name': 'u', 'color': 'ffffff', 'content': '排队的弹幕',
+          'recv_mono': now - 2, 'recv_time': time.time() - 2, 'decode_mono': now - 1.99, 'server_time': 1700000000}
+    writer.handle(dm, dm['recv_mono'], source)
+    writer.dmwriter.close()
+
+    with open(str(tmp_path / 'rec_000.jsonl'), encoding='utf-8') as f:
+        row = json.loads(f.readline())
+    # 弹幕时间是读取到数据的时间（约8秒），而不是处理的时间（约10秒）
+    assert abs(row['time'] - 8) < 0.2
+    assert row['server_time'] == 1700000000
+    latency = writer.stats()['latency']
+    assert latency['decode']['count'] == 1 and abs(latency['decode']['max'] - 0.01) < 1e-3
+    assert latency['queue']['count'] == 1 and latency['queue']['max'] >= 1.99
+    assert latency['total']['count'] == 1 and latency['total']['max'] >= 2
@@ -0,0 +1,123 @@
+import random
+import shutil
+import subprocess
+import time
+
+import pytest
+
+from DMR.danmaku import SimpleDanmaku
+from DMR.Downloader.asswriter import AssWriter
+from DMR.Downloader.dedup import DanmakuDeduplicator
+
+FFMPEG = shutil.which('ffmpeg')
+needs_ffmpeg = pytest.mark.skipif(not FFMPEG, reason='ffmpeg not found')
+
+
+def dm(t, content):
+    return SimpleDanmaku(time=t, dtype='danmaku', uname='u', color='ffffff', content=content)
+
+
+def run(dedup, danmus):
+    out = []
+    for danmu in danmus:
+        out.extend(dedup.expire(danmu.time))
+        if dedup.add(danmu):
+            out.append(danmu)
+    if danmus:
+        out.extend(dedup.expire(danmus[-1].time, flush=True))
+    return out
+
+
+def spam(duration=60, rate=20, seed=0):
+    # 模拟刷屏：大部分弹幕来自少数几条重复内容
+    rnd = random.Random(seed)
+    repeated = ['666', '哈哈哈哈', '主播牛逼', '？？？', '草']
+    danmus = []
+    for i in range(duration * rate):
+        t = i / rate
+        if rnd.random() < 0.8:
+            content = rnd.choice(repeated)
+        else:
+            content = f'普通弹幕{i}'
+        danmus.append(dm(t, content))
+    return danmus
+
+
+def test_fold_counts_only_suppressed():
+    dedup = DanmakuDeduplicator('fold', window=10, threshold=2)
+    out = run(dedup, [dm(t, '666') for t in range(5)])
+    assert [d.content for d in out] == ['666', '666', '666×3']
+    # 合并弹幕在窗口结束时写入
+    assert out[-1].time == 4
+    stats = dedup.stats()
+    assert stats['received'] == 5 and stats['suppressed'] == 3 and stats['folded'] == 1
+    assert stats['written'] == len(out) == 3
+    assert stats['saved'] == 2
+
+
+def test_thin_drops_duplicates():
+    dedup = DanmakuDeduplicator('thin', window=10, threshold=1)
+    out = run(dedup, [dm(1, '666'), dm(2, '666'), dm(3, '好'), dm(12, '666')])
+    assert [d.content for d in out] == ['666', '好', '666']
+    assert dedup.stats()['written'] == 3
+
+
+def test_repeated_chars_and_case_share_key():
+    dedup = DanmakuDeduplicator('thin', window=10, threshold=1)
+    out = run(dedup, [dm(1, '哈哈哈'), dm(2, '哈哈哈哈哈'), dm(3, 'AAA '), dm(4, 'aaaa')])
+    assert [d.content for d in out] == ['哈哈哈', 'AAA ']
+
+
+def test_window_expires():
+    dedup = DanmakuDeduplicator('fold', window=10, threshold=1)
+    out = run(dedup, [dm(0, '666'), dm(5, '666'), dm(10, '666'), dm(11, '666')])
+    assert [(d.time, d.content) for d in out] == [(0, '666'), (10, '666×1'), (10, '666'), (11, '666×1')]
+
+
+def test_invalid_mode():
+    with pytest.raises(ValueError):
+        DanmakuDeduplicator('drop')
+
+
+def write_ass(filename, danmus):
+    writer = AssWriter(description='test', width=1280, height=720, dst=0, dmrate=1, font='Microsoft YaHei',
+                       fontsize=36, margin_h=6, margin_w=20, dmduration=15, opacity=0.8, auto_fontsize=False,
+                       outlinecolor='000000', outlinesize=1)
+    writer.open(filename)
+    written = sum(1 for danmu in danmus if writer.add(danmu))
+    writer.close()
+    return written
+
+
+def render_time(filename, duration):
+    t0 = time.perf_counter()
+    subprocess.run([FFMPEG, '-v', 'error', '-f', 'lavfi', '-i', f'color=c=black:s=640x360:r=30:d={duration}',
+                    '-vf', f'ass={filename}', '-f', 'null', '-'], check=True)
+    return time.perf_counter() - t0
+
+
+def test_reduction_on_spam():
+    danmus = spam()
+    dedup = DanmakuDeduplicator('fold', window=10, threshold=2)
+    out = run(dedup, danmus)
+    stats = dedup.stats()
+    assert stats['written'] == len(out)
+    assert stats['reduction'] == round(1 - len(out) / len(danmus), 4)
+    print(f"dedup: {len(danmus)} -> {len(out)} danmaku, reduction {stats['reduction']:.1%}")
+    assert stats['reduction'] > 0.5
+
+
+@needs_ffmpeg
+def test_render_reduction(tmp_path):
+    # 用libass实际渲染一段画面，比较去重前后的渲染事件数量和渲染耗时
+    duration = 10
+    danmus = spam(duration)
+    out = run(DanmakuDeduplicator('fold', window=10, threshold=2), danmus)
+    raw_file, dedup_file = str(tmp_path / 'raw.ass'), str(tmp_path / 'dedup.ass')
+    raw_events = write_ass(raw_file, danmus)
+    dedup_events = write_ass(dedup_file, out)
+    raw_time = render_time(raw_file, duration)
+    dedup_time = render_time(dedup_file, duration)
+    print(f'rendered events {raw_events} -> {dedup_events}, render time {raw_time:.2f}s -> {dedup_time:.2f}s')
+    assert dedup_events < raw_events
+    assert dedup_time < raw_time
@@ -0,0 +1,84 @@
+import os
+import re
+import time
+
+from DMR.Downloader.dmfilter import DanmakuFilter
+
+
+def dm(content, name='user', uid=1):
+    return {'content': content, 'name': name, 'uid': uid}
+
+
+def test_keywords_and_regex():
+    f = DanmakuFilter(rules=['广告', r'^\d+$'])
+    assert f.match(dm('这是广告'))
+    assert f.match(dm('666'))
+    assert not f.match(dm('正常弹幕'))
+
+
+def test_backreference_rules_keep_group_numbers():
+    f = DanmakuFilter(rules=[r'(\d)\1\1', r'(a)\1', r'(?P<c>b)(?P=c)', 'x+y'])
+    assert f.match(dm('aa'))
+    assert f.match(dm('111'))
+    assert f.match(dm('bb'))
+    assert f.match(dm('xxy'))
+    assert not f.match(dm('ab'))
+    assert not f.match(dm('112'))
+
+
+def test_gbk_rule_file_keeps_previous_rules(tmp_path):
+    rule_file = tmp_path / 'rules.txt'
+    rule_file.write_text('广告\n', encoding='utf-8')
+    f = DanmakuFilter(rule_file=str(rule_file), reload_interval=0)
+    assert f.match(dm('广告'))
+
+    rule_file.write_bytes('刷屏\n'.encode('gbk'))
+    mtime = os.path.getmtime(rule_file) + 10
+    os.utime(rule_file, (mtime, mtime))
+    assert f.match(dm('广告'))
+    assert not f.match(dm('刷屏'))
+
+
+def test_gbk_rule_file_at_init(tmp_path):
+    rule_file = tmp_path / 'rules.txt'
+    rule_file.write_bytes('刷屏\n'.encode('gbk'))
+    f = DanmakuFilter(rules=['广告'], rule_file=str(rule_file))
+    assert f.match(dm('广告'))
+
+
+def test_deleted_rule_file(tmp_path):
+    rule_file = tmp_path / 'rules.txt'
+    rule_file.write_text('广告\n', encoding='utf-8')
+    f = DanmakuFilter(rule_file=str(rule_file), reload_interval=0)
+    os.remove(rule_file)
+    time.sleep(0.01)
+    assert f.match(dm('广告'))
+
+
+def test_cost_against_rule_count():
+    # 每条弹幕的过滤耗时：关键词自动机应基本不随规则数量增长，逐条re.search则线性增长
+    msgs = [dm(f'普通弹幕内容{i}，主播好厉害哈哈哈哈') for i in range(2000)]
+    result = {}
+    for n in (10, 100, 1000):
+        rules = [f'屏蔽词{i}号' for i in range(n)]
+        f = DanmakuFilter(rules=rules)
+        linear = [re.compile(r) for r in rules]
+
+        t0 = time.perf_counter()
+        for m in msgs:
+            assert not f.match(m)
+        t_auto = (time.perf_counter() - t0) / len(msgs)
+
+        t0 = time.perf_counter()
+        for m in msgs:
+            assert not any(r.search(m['content']) for r in linear)
+        t_linear = (time.perf_counter() - t0) / len(msgs)
+
+        result[n] = (t_auto, t_linear)
+        print(f'rules={n}: automaton {t_auto*1e6:.2f}us/msg, linear {t_linear*1e6:.2f}us/msg')
+
+    auto_10, linear_10 = result[10]
+    auto_1000, linear_1000 = result[1000]
+    assert auto_1000 < linear_1000 / 10
+    assert auto_1000 < auto_10 * 5
+    assert linear_1000 > linear_10 * 20
@@ -0,0 +1,97 @@
+import asyncio
+
+import pytest
+
+from DMR.Downloader.dmqueue import DanmakuQueue
+
+
+def chat(i):
+    return {'msg_type': 'danmaku', 'content': f'chat{i}'}
+
+
+def gift(i):
+    return {'msg_type': 'gift', 'content': f'gift{i}'}
+
+
+async def drain(q):
+    items = []
+    while not q.empty():
+        items.append(q.get_nowait())
+        q.task_done()
+    # 所有消息（包括被丢弃的）都已经task_done，join应该立即返回
+    await asyncio.wait_for(q.join(), 1)
+    return items
+
+
+def test_drop_type_keeps_chat():
+    async def run():
+        q = DanmakuQueue(10, 'drop_type')
+        for i in range(100):
+            await q.put(gift(i))
+            if i % 5 == 0:
+                await q.put(chat(i))
+        items = await drain(q)
+        assert len(items) == 10
+        assert [m['content'] for m in items] == [f'chat{i}' for i in range(50, 100, 5)]
+        assert q.dropped == {'gift': 100, 'danmaku': 10}
+        assert q.high_water == 10
+    asyncio.run(run())
+
+
+def test_drop_type_evicts_low_priority_first():
+    async def run():
+        q = DanmakuQueue(4, 'drop_type')
+        for m in [chat(0), gift(0), gift(1), chat(1)]:
+            q.put_nowait(m)
+        q.put_nowait(chat(2))
+        q.put_nowait(chat(3))
+        # 非弹幕消息在队列满时直接丢弃
+        q.put_nowait(gift(2))
+        items = await drain(q)
+        assert [m['content'] for m in items] == ['chat0', 'chat1', 'chat2', 'chat3']
+        assert q.dropped == {'gift': 3}
+    asyncio.run(run())
+
+
+def test_drop_oldest():
+    async def run():
+        q = DanmakuQueue(10, 'drop_oldest')
+        for i in range(100):
+            await q.put(chat(i) if i % 2 else gift(i))
+        items = await drain(q)
+        assert [m['content'] for m in items] == [chat(i)['content'] if i % 2 else gift(i)['content'] for i in range(90, 100)]
+        assert sum(q.dropped.values()) == 90
+    asyncio.run(run())
+
+
+def test_block():
+    async def run():
+        q = DanmakuQueue(10, 'block')
+        for i in range(10):
+            await q.put(chat(i))
+        with pytest.raises(asyncio.QueueFull):
+            q.put_nowait(chat(10))
+
+        producer = asyncio.create_task(q.put(chat(11)))
+        await asyncio.sleep(0.05)
+        assert not producer.done()
+        q.get_nowait()
+        q.task_done()
+        await asyncio.wait_for(producer, 1)
+        items = await drain(q)
+        assert len(items) == 10 and items[-1]['content'] == 'chat11'
+        assert q.dropped == {}
+    asyncio.run(run())
+
+
+def test_join_waits_for_unfinished():
+    async def run():
+        q = DanmakuQueue(3, 'drop_type')
+        for i in range(10):
+            q.put_nowait(chat(i))
+        q.get_nowait()
+        with pytest.raises(asyncio.TimeoutError):
+            await asyncio.wait_for(q.join(), 0.05)
+        q.task_done()
+        await drain(q)
+    asyncio.run(run())
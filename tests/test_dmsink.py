@@ -0,0 +1,116 @@
+import json
+import xml.etree.ElementTree as ET
+
+import pytest
+
+from DMR.danmaku import SimpleDanmaku
+from DMR.Downloader.dmsink import DanmakuSinks, parse_formats, sink_filename
+
+ASS_ARGS = dict(description='test', width=640, height=360, dst=0, dmrate=0.15, font='Microsoft YaHei',
+                fontsize=36, margin_h=6, margin_w=20, dmduration=15, opacity=0.8, auto_fontsize=False,
+                outlinecolor='000000', outlinesize=1)
+
+
+def dm(t, content, dtype='danmaku', **kwargs):
+    return SimpleDanmaku(time=t, dtype=dtype, uname='u', color='ff0000', content=content, **kwargs)
+
+
+def ass_events(filename):
+    with open(filename, encoding='utf-8') as f:
+        return [row for row in f if row.startswith('Dialogue:') or row.startswith('Picture:')]
+
+
+def xml_danmaku(filename):
+    root = ET.parse(filename).getroot()
+    return [d.text for d in root.iter('d')], [(sc.text, sc.get('price')) for sc in root.iter('sc')]
+
+
+def jsonl_rows(filename):
+    with open(filename, encoding='utf-8') as f:
+        return [json.loads(row) for row in f]
+
+
+def test_parse_formats():
+    assert parse_formats('ass') == ['ass']
+    assert parse_formats('ass, XML,ass') == ['ass', 'xml']
+    assert parse_formats(['jsonl', 'ass']) == ['jsonl', 'ass']
+    with pytest.raises(NotImplementedError):
+        parse_formats('srt')
+    with pytest.raises(NotImplementedError):
+        parse_formats('')
+    assert sink_filename('/a/b.part.ass', 'xml') == '/a/b.part.xml'
+
+
+def test_fan_out_to_all_formats(tmp_path):
+    sinks = DanmakuSinks(['ass', 'xml', 'jsonl'], **ASS_ARGS)
+    base = str(tmp_path / 'rec.ass')
+    assert sinks.filenames(base) == [str(tmp_path / f'rec.{ext}') for ext in ('ass', 'xml', 'jsonl')]
+    sinks.open(base)
+    # 只有一条轨道，同时出现的弹幕在ASS中因为重叠被丢弃
+    assert sinks.add(dm(1, '第一条'))
+    assert sinks.add(dm(1.1, '第二条'))
+    sinks.add_super_chat(dm(2, '醒目留言', dtype='super_chat', price=30))
+    sinks.close()
+    assert not sinks.add(dm(3, '关闭之后'))
+
+    events = ass_events(str(tmp_path / 'rec.ass'))
+    assert len([e for e in events if ',R2L,' in e]) == 1
+    assert any('醒目留言' in e for e in events)
+    danmakus, super_chats = xml_danmaku(str(tmp_path / 'rec.xml'))
+    assert danmakus == ['第一条', '第二条']
+    assert super_chats == [('醒目留言', '30')]
+    rows = jsonl_rows(str(tmp_path / 'rec.jsonl'))
+    assert [row['content'] for row in rows] == ['第一条', '第二条', '醒目留言']
+
+
+def test_add_returns_true_if_any_sink_wrote(tmp_path):
+    # ASS放在第一个，ASS丢弃的弹幕仍然写入了XML，应该返回True
+    sinks = DanmakuSinks(['ass', 'xml'], **ASS_ARGS)
+    sinks.open(str(tmp_path / 'rec.ass'))
+    assert sinks.add(dm(1, '第一条'))
+    assert sinks.add(dm(1.1, '第二条'))
+    sinks.close()
+    # 只有ASS时返回ASS的结果
+    sinks = DanmakuSinks(['ass'], **ASS_ARGS)
+    sinks.open(str(tmp_path / 'only.ass'))
+    assert sinks.add(dm(1, '第一条'))
+    assert not sinks.add(dm(1.1, '第二条'))
+    sinks.close()
+
+
+def test_failing_sink_does_not_stop_others(tmp_path):
+    sinks = DanmakuSinks(['xml', 'jsonl'])
+    sinks.open(str(tmp_path / 'rec.xml'))
+
+    def broken(danmu):
+        raise OSError('disk full')
+
+    sinks.sinks['xml'].add = broken
+    assert sinks.add(dm(1, '弹幕'))
+    sinks.close()
+    assert [row['content'] for row in jsonl_rows(str(tmp_path / 'rec.jsonl'))] == ['弹幕']
+
+
+def test_image_falls_back_to_text(tmp_path):
+    sinks = DanmakuSinks(['ass', 'xml', 'jsonl'], **ASS_ARGS)
+    sinks.open(str(tmp_path / 'rec.ass'))
+    assert sinks.add_image(dm(1, '[表情]', dtype='emoticon'), '/cache/e.png', ratio=2)
+    sinks.close()
+    events = ass_events(str(tmp_path / 'rec.ass'))
+    assert len(events) == 1 and events[0].startswith('Picture:') and events[0].rstrip().endswith('/cache/e.png')
+    assert xml_danmaku(str(tmp_path / 'rec.xml'))[0] == ['[表情]']
+    assert jsonl_rows(str(tmp_path / 'rec.jsonl'))[0]['content'] == '[表情]'
+
+
+def test_open_switches_all_files(tmp_path):
+    sinks = DanmakuSinks(['ass', 'xml', 'jsonl'], **ASS_ARGS)
+    sinks.open(str(tmp_path / 'p000.ass'))
+    sinks.add(dm(1, '分段一'))
+    sinks.open(str(tmp_path / 'p001.ass'))
+    sinks.add(dm(1, '分段二'))
+    sinks.close()
+    for part, content in (('p000', '分段一'), ('p001', '分段二')):
+        assert content in ass_events(str(tmp_path / f'{part}.ass'))[0]
+        # 切换分段时XML写入了结束标签
+        assert xml_danmaku(str(tmp_path / f'{part}.xml'))[0] == [content]
+        assert [row['content'] for row in jsonl_rows(str(tmp_path / f'{part}.jsonl'))] == [content]
@@ -0,0 +1,47 @@
+import asyncio
+import time
+
+from DMR.Downloader.dmsource import DanmakuSource
+from DMR.LiveAPI.danmaku import DanmakuClient
+from DMR.LiveAPI.danmaku.youtube import Youtube
+
+
+class FakeTask:
+    def done(self):
+        return False
+
+    def cancel(self):
+        pass
+
+
+class Gaps:
+    def __init__(self):
+        self.values = []
+
+    def record(self, value):
+        self.values.append(value)
+
+
+def test_v2_first_active_resets_backoff():
+    async def run():
+        src = DanmakuSource('https://www.youtube.com/channel/UCxxxxxxxxxxxxxxxxxxxxxx')
+        dmc = DanmakuClient(src.url, src.queue)
+        # start()之前还没有实例化
+        assert dmc.first_active is None
+
+        site = Youtube(rid=src.rid, q=src.queue, url=src.url)
+        dmc._DanmakuClient__site_class = site
+        src.dmc, src.task = dmc, FakeTask()
+        src.retry, src.gap_start = 3, time.monotonic() - 5
+
+        gaps = Gaps()
+        assert src.check(gaps)
+        assert src.retry == 3 and not gaps.values
+
+        site.first_active = time.monotonic()
+        assert dmc.first_active == site.first_active
+        assert src.check(gaps)
+        assert src.retry == 0
+        assert src.gap_start is None
+        assert len(gaps.values) == 1 and gaps.values[0] >= 5
+    asyncio.run(run())
@@ -0,0 +1,117 @@
+import os
+import sys
+import tracemalloc
+
+import numpy as np
+import pytest
+
+from DMR.danmaku import SimpleDanmaku
+from DMR.Downloader.dmtable import DanmakuTable
+from DMR.Downloader.journal import DTYPES, JournalWriter
+
+
+def danmakus(n):
+    return [SimpleDanmaku(time=(n - i) * 0.5, dtype='super_chat' if i % 10 == 0 else 'danmaku',
+                          uname=f'user{i % 7}', color='ff0000' if i % 2 else 'ffffff',
+                          content=f'弹幕{i}' + '😀' * (i % 3), price=i * 0.1 if i % 10 == 0 else 0,
+                          recv_time=1700000000.25 + i, server_time=1700000000.125 + i)
+            for i in range(n)]
+
+
+def same(a, b):
+    return [x.todict() for x in a] == [x.todict() for x in b]
+
+
+def test_slots():
+    danmu = SimpleDanmaku(time=1, dtype='danmaku', content='a')
+    assert not hasattr(danmu, '__dict__')
+    with pytest.raises(AttributeError):
+        danmu.extra = 1
+
+
+def test_roundtrip(tmp_path):
+    src = danmakus(100)
+    table = DanmakuTable.from_danmakus(src)
+    assert len(table) == 100
+    assert same(table, src)
+    # 用户名和颜色去重保存
+    assert len(table.names) == 7 and sorted(table.colors) == ['ff0000', 'ffffff']
+    assert table.contents() == [d.content for d in src]
+
+    filename = str(tmp_path / 'a.dmt')
+    table.save(filename)
+    for mmap in (True, False):
+        loaded = DanmakuTable.load(filename, mmap=mmap)
+        assert same(loaded, src)
+    assert isinstance(DanmakuTable.load(filename).records, np.memmap)
+
+
+def test_empty(tmp_path):
+    table = DanmakuTable.from_danmakus([])
+    filename = str(tmp_path / 'a.dmt')
+    table.save(filename)
+    assert len(DanmakuTable.load(filename)) == 0
+
+
+def test_select_and_sort():
+    src = danmakus(50)
+    table = DanmakuTable.from_danmakus(src).sort()
+    times = table.records['time']
+    assert np.all(times[1:] >= times[:-1])
+    assert table[0].content == src[-1].content
+    sc = table.select(table.records['dtype'] == DTYPES.index('super_chat'))
+    assert [d.content for d in sc] == [d.content for d in sorted(src, key=lambda d: d.time) if d.dtype == 'super_chat']
+    assert same(table[:3], list(table)[:3])
+
+
+def test_bad_files(tmp_path):
+    filename = str(tmp_path / 'a.dmt')
+    with open(filename, 'wb') as f:
+        f.write(b'not a table')
+    with pytest.raises(ValueError):
+        DanmakuTable.load(filename)
+    DanmakuTable.from_danmakus(danmakus(10)).save(filename)
+    with open(filename, 'r+b') as f:
+        f.truncate(os.path.getsize(filename) - 1)
+    with pytest.raises(ValueError):
+        DanmakuTable.load(filename)
+
+
+def test_open_journal_uses_sidecar(tmp_path):
+    journal = str(tmp_path / 'a.dmj')
+    writer = JournalWriter()
+    writer.open(journal)
+    src = danmakus(20)
+    for danmu in src:
+        writer.add(danmu)
+    writer.close()
+
+    table = DanmakuTable.open(journal)
+    sidecar = DanmakuTable.sidecar_name(journal)
+    assert os.path.exists(sidecar)
+    assert [d.content for d in table] == [d.content for d in src]
+    assert [d.price for d in table] == [d.price for d in src]
+    # 之后直接读取.dmt文件
+    mtime = os.path.getmtime(sidecar)
+    assert len(DanmakuTable.open(journal)) == 20
+    assert os.path.getmtime(sidecar) == mtime
+    # 日志更新后重新生成
+    later = mtime + 10
+    os.utime(journal, (later, later))
+    DanmakuTable.open(journal)
+    assert os.path.getmtime(sidecar) > mtime
+
+
+def test_memory():
+    # 10万条弹幕：对象列表与弹幕表的内存占用
+    n = 100000
+    tracemalloc.start()
+    base = tracemalloc.get_traced_memory()[0]
+    objects = danmakus(n)
+    objects_size = tracemalloc.get_traced_memory()[0] - base
+    table = DanmakuTable.from_danmakus(objects)
+    del objects
+    tracemalloc.stop()
+    table_size = table.records.nbytes + table.blob.nbytes + sum(sys.getsizeof(x) for x in table.names + table.colors)
+    print(f'{n} danmaku: objects {objects_size / n:.0f}B/msg, table {table_size / n:.0f}B/msg')
+    assert table_size * 3 < objects_size
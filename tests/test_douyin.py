@@ -0,0 +1,127 @@
+import gzip
+import random
+import time
+
+from google.protobuf import json_format
+
+from DMR.LiveAPI.danmaku.douyin import Douyin
+from DMR.LiveAPI.danmaku.douyin.dy_pb2 import PushFrame, Response, ChatMessage, GiftMessage, LikeMessage
+
+
+def chat(i):
+    m = ChatMessage()
+    m.common.method = 'WebcastChatMessage'
+    m.common.createTime = 1700000000000 + i
+    m.user.id = 1000 + i
+    m.user.nickName = f'用户{i}'
+    m.content = f'弹幕{i}' * (i % 5 + 1)
+    m.backgroundImage.urlListList.extend([f'https://p3.douyinpic.com/{i}.png'] * 3)
+    return 'WebcastChatMessage', m.SerializeToString()
+
+
+def gift(i):
+    m = GiftMessage()
+    m.user.nickName = f'用户{i}'
+    m.gift.name = '小心心'
+    m.gift.diamondCount = 1
+    m.repeatCount = i
+    return 'WebcastGiftMessage', m.SerializeToString()
+
+
+def like(i):
+    m = LikeMessage()
+    m.user.nickName = f'用户{i}'
+    m.count = 3
+    return 'WebcastLikeMessage', m.SerializeToString()
+
+
+def member(i):
+    return 'WebcastMemberMessage', bytes(random.Random(i).randrange(256) for _ in range(200))
+
+
+def push_frame(messages, need_ack=False):
+    resp = Response()
+    for method, payload in messages:
+        m = resp.messagesList.add()
+        m.method = method
+        m.payload = payload
+    resp.needAck = need_ack
+    resp.internalExt = 'internal_src:dim'
+    frame = PushFrame()
+    frame.logId = 12345
+    frame.payload = gzip.compress(resp.SerializeToString())
+    return frame.SerializeToString()
+
+
+def fixture_frames(n=200):
+    rng = random.Random(0)
+    kinds = [chat, chat, chat, gift, like, member]
+    return [push_frame([rng.choice(kinds)(i * 10 + j) for j in range(rng.randrange(1, 15))]) for i in range(n)]
+
+
+# 原来的解码方式：ChatMessage转为字典再取出字段，作为对照
+def legacy_decode_msg(data):
+    frame = PushFrame()
+    frame.ParseFromString(data)
+    resp = Response()
+    resp.ParseFromString(gzip.decompress(frame.payload))
+    msgs = []
+    for msg in resp.messagesList:
+        if msg.method == 'WebcastChatMessage':
+            chat = ChatMessage()
+            chat.ParseFromString(msg.payload)
+            d = json_format.MessageToDict(chat, preserving_proto_field_name=True)
+            msgs.append({'name': d['user']['nickName'], 'content': d['content'], 'msg_type': 'danmaku'})
+        else:
+            msgs.append({'name': '', 'content': '', 'msg_type': 'other'})
+    return msgs
+
+
+def test_decode_fixture():
+    msgs, ack = Douyin.decode_msg(push_frame([chat(1), gift(2), like(3), member(4)], need_ack=True))
+    assert [m['msg_type'] for m in msgs] == ['danmaku', 'gift', 'like', 'other']
+    assert msgs[0]['name'] == '用户1' and msgs[0]['content'] == '弹幕1弹幕1'
+    assert msgs[0]['server_time'] == 1700000000.001 and msgs[0]['uid'] == 1001
+    assert msgs[1]['content'] == '小心心' and msgs[1]['count'] == 2 and msgs[1]['price'] == 1
+    assert msgs[2]['count'] == 3
+    ack_frame = PushFrame()
+    ack_frame.ParseFromString(ack)
+    assert ack_frame.logId == 12345 and ack_frame.payloadType == 'internal_src:dim'
+
+
+def test_matches_legacy_decoder():
+    for frame in fixture_frames(100):
+        msgs, _ = Douyin.decode_msg(frame)
+        legacy = legacy_decode_msg(frame)
+        assert len(msgs) == len(legacy)
+        for new, old in zip(msgs, legacy):
+            if old['msg_type'] == 'danmaku':
+                assert (new['name'], new['content'], new['msg_type']) == (old['name'], old['content'], 'danmaku')
+            else:
+                assert new['msg_type'] in ('gift', 'like', 'other')
+
+
+def test_subscribed_methods(monkeypatch):
+    monkeypatch.setattr(Douyin, 'methods', {'WebcastChatMessage'})
+    msgs, ack = Douyin.decode_msg(push_frame([chat(1), gift(2), like(3), member(4)]))
+    assert [m['msg_type'] for m in msgs] == ['danmaku']
+    assert ack is None
+
+
+def test_throughput(monkeypatch):
+    frames = fixture_frames(200)
+
+    def rate(func):
+        t = time.perf_counter()
+        for _ in range(3):
+            for f in frames:
+                func(f)
+        return len(frames) * 3 / (time.perf_counter() - t)
+
+    old = rate(legacy_decode_msg)
+    new = rate(Douyin.decode_msg)
+    monkeypatch.setattr(Douyin, 'methods', {'WebcastChatMessage'})
+    chat_only = rate(Douyin.decode_msg)
+    print(f'douyin decoder: {new:.0f} frames/s, chat only: {chat_only:.0f} frames/s, MessageToDict: {old:.0f} frames/s')
+    assert new > old * 0.8
+    assert chat_only > old * 0.8
@@ -0,0 +1,48 @@
+import time
+
+from DMR.Downloader import Downloader
+
+
+class Pipe:
+    def __init__(self):
+        self.msgs = []
+
+    def put(self, msg):
+        self.msgs.append(msg)
+
+
+class DanmakuWriter:
+    dm_file = None
+
+
+def make_downloader(live_render):
+    dl = Downloader.__new__(Downloader)
+    dl.taskname = 'test'
+    dl.sender = Pipe()
+    dl.danmaku = True
+    dl.live_render = live_render
+    dl.restream = None
+    dl.dmw = DanmakuWriter()
+    return dl
+
+
+def test_segment_start_disabled():
+    dl = make_downloader(live_render=False)
+    dl.segment_start_callback('a.flv')
+    time.sleep(0.1)
+    assert dl.sender.msgs == []
+
+
+def test_segment_start_does_not_block():
+    dl = make_downloader(live_render=True)
+    t = time.monotonic()
+    dl.segment_start_callback('a.flv')
+    # 弹幕文件还没有创建，等待在另一个线程中进行
+    assert time.monotonic() - t < 0.2
+    dl.dmw.dm_file = 'a.ass'
+    for _ in range(20):
+        if dl.sender.msgs:
+            break
+        time.sleep(0.1)
+    msg = dl.sender.msgs[0]
+    assert msg['type'] == 'segment_start' and msg['msg'] == 'a.flv' and msg['danmaku'] == 'a.ass'
@@ -0,0 +1,127 @@
+import hashlib
+import os
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+from DMR.Downloader.emoticon import EmoticonFetcher
+
+PNG = b'\x89PNG\r\n\x1a\n' + b'\x00' * 32
+
+
+class Handler(BaseHTTPRequestHandler):
+    requests = []
+
+    def do_GET(self):
+        Handler.requests.append(self.path)
+        if self.path.startswith('/slow'):
+            time.sleep(1)
+        if self.path.startswith('/missing'):
+            self.send_response(404)
+            self.end_headers()
+            return
+        self.send_response(200)
+        self.send_header('Content-Type', 'image/png')
+        self.send_header('Content-Length', str(len(PNG)))
+        self.end_headers()
+        self.wfile.write(PNG)
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def server():
+    Handler.requests = []
+    httpd = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+    thread = threading.Thread(target=httpd.serve_forever, daemon=True)
+    thread.start()
+    yield f'http://127.0.0.1:{httpd.server_address[1]}'
+    httpd.shutdown()
+    httpd.server_close()
+
+
+def test_fetch_and_cache_hit(server, tmp_path):
+    fetcher = EmoticonFetcher(str(tmp_path), max_workers=4)
+    urls = [f'{server}/emote/{i}.png' for i in range(8)]
+    paths = [fetcher.fetch(url) for url in urls]
+    fetcher.wait(timeout=5)
+
+    for url, path in zip(urls, paths):
+        digest = hashlib.sha1(url.encode('utf-8')).hexdigest()
+        assert os.path.basename(path) == digest + '.png'
+        with open(path, 'rb') as f:
+            assert f.read() == PNG
+    assert fetcher.downloaded == 8
+
+    # 再次请求同一个表情直接使用缓存
+    assert fetcher.fetch(urls[0]) == paths[0]
+    fetcher.wait(timeout=5)
+    assert fetcher.hits == 1
+    assert len(Handler.requests) == 8
+
+    # 新的下载器（例如重启之后）也会使用已经保存的图片
+    fetcher2 = EmoticonFetcher(str(tmp_path))
+    assert fetcher2.fetch(urls[1]) == paths[1]
+    assert fetcher2.hits == 1 and len(Handler.requests) == 8
+
+
+def test_concurrent_duplicate_fetch(server, tmp_path):
+    fetcher = EmoticonFetcher(str(tmp_path), max_workers=4)
+    url = f'{server}/slow/a.png'
+    results = []
+    threads = [threading.Thread(target=lambda: results.append(fetcher.fetch(url))) for _ in range(8)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    fetcher.wait(timeout=5)
+    assert len(set(results)) == 1
+    assert len(Handler.requests) == 1
+    assert fetcher.downloaded == 1
+
+
+def test_failure_is_not_retried_immediately(server, tmp_path):
+    fetcher = EmoticonFetcher(str(tmp_path))
+    url = f'{server}/missing/a.png'
+    path = fetcher.fetch(url)
+    fetcher.wait(timeout=5)
+    assert fetcher.failed == 1 and not os.path.exists(path)
+
+    fetcher.fetch(url)
+    fetcher.wait(timeout=5)
+    assert len(Handler.requests) == 1
+
+    fetcher._failed[url] -= fetcher.retry_interval
+    fetcher.fetch(url)
+    fetcher.wait(timeout=5)
+    assert len(Handler.requests) == 2 and fetcher.failed == 2
+
+
+def test_timeout(server, tmp_path):
+    fetcher = EmoticonFetcher(str(tmp_path), timeout=0.2)
+    path = fetcher.fetch(f'{server}/slow/b.png')
+    t = time.time()
+    fetcher.wait(timeout=5)
+    assert time.time() - t < 1
+    assert fetcher.failed == 1 and fetcher.downloaded == 0
+    assert not os.path.exists(path) and not os.path.exists(path + '.tmp')
+    # 完成回调在结果返回之后才执行
+    time.sleep(0.05)
+    assert fetcher.stats()['pending'] == 0
+
+
+def test_concurrent_downloads_share_one_thread(server, tmp_path):
+    fetcher = EmoticonFetcher(str(tmp_path), max_workers=8)
+    before = threading.active_count()
+    t = time.time()
+    paths = [fetcher.fetch(f'{server}/slow/{i}.png') for i in range(8)]
+    # fetch不等待下载
+    assert time.time() - t < 0.5
+    fetcher.wait(timeout=5)
+    # 8个下载在同一个事件循环中同时进行
+    assert time.time() - t < 2
+    assert all(os.path.exists(path) for path in paths)
+    assert threading.active_count() - before <= 1
@@ -0,0 +1,221 @@
+import os
+import shutil
+import subprocess
+import time
+
+import pytest
+
+from DMR.Render.chunks import (ChunkManifest, ass_intervals, chunks_dir, parse_event, plan_smart_render,
+                               shift_event, slice_ass, split_ranges)
+from DMR.Render.ffmpegrender import FFmpegRender
+from DMR.utils import FFprobe
+
+FFMPEG = shutil.which('ffmpeg')
+FFPROBE = shutil.which('ffprobe')
+needs_ffmpeg = pytest.mark.skipif(not (FFMPEG and FFPROBE), reason='ffmpeg not found')
+
+
+def make_render(**advanced_render_args):
+    return FFmpegRender(hwaccel_args=[], vencoder='libx264', vencoder_args=['-crf', '23'],
+                        aencoder='aac', aencoder_args=['-b:a', '320K'], output_resize=None,
+                        advanced_render_args=advanced_render_args, ffmpeg='ffmpeg')
+
+
+def test_settings_hash_ignores_render_path():
+    base = make_render().settings_hash()
+    # 只影响渲染方式的参数不改变哈希
+    assert make_render(chunks=4, chunk_workers=2, chunk_min_length=10, checkpoint_interval=60,
+                       smart_render=True, smart_min_copy=5, live_render=True, live_piece_length=5,
+                       live_delay=3, render_cache=False, priority=2).settings_hash() == base
+    # 与默认值相同的参数不改变哈希
+    assert make_render(gop=5, ass_optimize=True).settings_hash() == base
+
+
+def test_settings_hash_output_args():
+    base = make_render().settings_hash()
+    for args in ({'fps': 30}, {'gop': 2}, {'filter_complex': 'null'}, {'ass_optimize': False},
+                 {'ass_max_events': 50}, {'ass_event_window': 2}):
+        assert make_render(**args).settings_hash() != base
+
+
+# 分段渲染（chunks.py）
+
+def test_split_ranges_on_keyframes():
+    keyframes = list(range(0, 60, 2))
+    ranges = split_ranges(keyframes, 60, 4, min_length=10)
+    assert len(ranges) == 4
+    assert ranges[0][0] == 0 and ranges[-1][1] == 60
+    for (_, t1), (t0, _) in zip(ranges, ranges[1:]):
+        # 首尾相接，分段点都是关键帧
+        assert t1 == t0 and t0 in keyframes
+    assert all(abs((t1 - t0) - 15) <= 1 for t0, t1 in ranges)
+
+
+def test_split_ranges_min_length():
+    # 每段至少min_length秒，分段数量因此少于nchunks
+    assert split_ranges(list(range(0, 20, 2)), 20, 8, min_length=5) == [(0, 8), (8, 14), (14, 20)]
+    # 关键帧不够时不分段
+    assert split_ranges([0], 60, 4) == [(0, 60)]
+    assert split_ranges([], 60, 4) == [(0, 60)]
+    assert split_ranges(list(range(0, 60, 2)), 60, 1) == [(0, 60)]
+
+
+ASS_EVENTS = [
+    'Dialogue: 0,0:00:01.00,0:00:09.00,R2L,,0,0,0,,{\\move(320,20,-40,20)}早',
+    'Dialogue: 0,0:00:05.00,0:00:13.00,R2L,,0,0,0,,{\\move(320,20,-40,20)}跨越',
+    'Dialogue: 0,0:00:11.00,0:00:19.00,R2L,,0,0,0,,{\\move(320,20,-40,20)}中间',
+    'Dialogue: 0,0:00:12.00,0:00:14.00,message_box,,0,0,0,,醒目留言',
+    'Dialogue: 0,0:00:21.00,0:00:29.00,R2L,,0,0,0,,{\\move(320,20,-40,20)}晚',
+]
+
+
+def write_ass(filename, events=ASS_EVENTS):
+    from tests.test_restream import ASS_HEADER
+    with open(filename, 'w', encoding='utf-8') as f:
+        f.write('\n'.join(ASS_HEADER + events) + '\n')
+
+
+def test_shift_event_keeps_move_path():
+    _, fields, st, et = parse_event(ASS_EVENTS[1])
+    row = shift_event('Dialogue', fields, st, et, 10)
+    # 在分段开始之前出现的弹幕从分段开头显示，\move的t1为负数，保持原来的位置和速度
+    assert row == 'Dialogue: 0,00:00:00.00,00:00:03.00,R2L,,0,0,0,,{\\move(320,20,-40,20,-5000,3000)}跨越\n'
+    _, fields, st, et = parse_event(ASS_EVENTS[2])
+    assert shift_event('Dialogue', fields, st, et, 10) == \
+        'Dialogue: 0,00:00:01.00,00:00:09.00,R2L,,0,0,0,,{\\move(320,20,-40,20)}中间\n'
+    assert parse_event('Comment: 0,0:00:01.00,0:00:02.00,R2L,,0,0,0,,x') is None
+
+
+def test_slice_ass(tmp_path):
+    src, dst = str(tmp_path / 'a.ass'), str(tmp_path / 'b.ass')
+    write_ass(src)
+    assert slice_ass(src, dst, 10, 20) == 3
+    with open(dst, encoding='utf-8') as f:
+        text = f.read()
+    assert text.startswith('[Script Info]') and 'Style: R2L' in text
+    assert '早' not in text and '晚' not in text
+    assert '{\\move(320,20,-40,20,-5000,3000)}跨越' in text
+    assert 'Dialogue: 0,00:00:02.00,00:00:04.00,message_box' in text
+
+
+def test_ass_intervals(tmp_path):
+    src = str(tmp_path / 'a.ass')
+    write_ass(src)
+    assert ass_intervals(src) == [(1, 19), (21, 29)]
+    assert ass_intervals(src, gap=3) == [(1, 29)]
+
+
+def test_plan_smart_render():
+    keyframes = list(range(0, 40, 2))
+    plan = plan_smart_render(keyframes, 40, [(5, 7), (20.5, 21)], min_copy=2)
+    assert plan == [(0, 4, False), (4, 8, True), (8, 20, False), (20, 22, True), (22, 40, False)]
+    # 短于min_copy的复制段并入编码段
+    plan = plan_smart_render(keyframes, 40, [(5, 7), (9, 11)], min_copy=4)
+    assert plan == [(0, 4, False), (4, 12, True), (12, 40, False)]
+    # 第一个关键帧之前的部分必须重新编码
+    assert plan_smart_render([1, 20], 40, [], min_copy=0) == [(0, 1, True), (1, 40, False)]
+    assert plan_smart_render(keyframes, 40, [], min_copy=2) == [(0, 40, False)]
+
+
+def test_chunk_manifest_resume(tmp_path, monkeypatch):
+    durations = {}
+    monkeypatch.setattr(FFprobe, 'get_duration', lambda path: durations.get(os.path.basename(path), -1))
+    workdir = str(tmp_path / 'out.chunks')
+    os.makedirs(workdir)
+    key = {'video': 'v.mp4', 'settings': 'abc'}
+    manifest = ChunkManifest(workdir, key)
+    assert not manifest.load()
+    manifest.reset([(0, 10), (10, 20), (20, 30)])
+    for i in range(2):
+        filename = os.path.join(workdir, '%04d.mp4' % i)
+        with open(filename, 'wb') as f:
+            f.write(b'x' * (i + 1))
+        durations[os.path.basename(filename)] = 10
+        manifest.mark_done(i, filename)
+
+    resumed = ChunkManifest(workdir, key)
+    assert resumed.load()
+    assert resumed.ranges == [(0, 10), (10, 20), (20, 30)]
+    assert resumed.progress() == (2, 3)
+    assert [resumed.is_done(i) for i in range(3)] == [True, True, False]
+    # 文件大小或时长与记录不一致时需要重新渲染
+    with open(os.path.join(workdir, '0001.mp4'), 'ab') as f:
+        f.write(b'x')
+    durations['0000.mp4'] = 3
+    assert [resumed.is_done(i) for i in range(3)] == [False, False, False]
+    # 任务发生变化时之前的进度作废
+    assert not ChunkManifest(workdir, dict(key, settings='def')).load()
+
+
+# 使用ffmpeg实际渲染
+
+def render_env(tmp_path, duration=20):
+    from tools import ToolsList
+    ToolsList.set('ffmpeg', FFMPEG)
+    ToolsList.set('ffprobe', FFPROBE)
+    video = str(tmp_path / 'v.mp4')
+    subprocess.run([FFMPEG, '-y', '-v', 'error', '-f', 'lavfi', '-i', f'testsrc=size=320x240:rate=25:duration={duration}',
+                    '-f', 'lavfi', '-i', f'sine=duration={duration}', '-c:v', 'libx264', '-preset', 'ultrafast',
+                    '-g', '50', '-c:a', 'aac', '-shortest', video], check=True)
+    danmaku = str(tmp_path / 'v.ass')
+    events = ['Dialogue: 0,%s,%s,R2L,,0,0,0,,{\\move(320,20,-40,20)}弹幕%d' % (
+        '0:00:%05.2f' % (i * 0.5), '0:00:%05.2f' % (i * 0.5 + 4), i) for i in range(duration * 2 - 8)]
+    write_ass(danmaku, events)
+    return video, danmaku
+
+
+def make_chunk_render(**advanced_render_args):
+    args = dict(chunk_min_length=4)
+    args.update(advanced_render_args)
+    return FFmpegRender(hwaccel_args=[], vencoder='libx264', vencoder_args=['-preset', 'ultrafast'],
+                        aencoder='aac', aencoder_args=[], output_resize=None,
+                        advanced_render_args=args, ffmpeg=FFMPEG)
+
+
+@needs_ffmpeg
+def test_chunked_render_speed(tmp_path):
+    video, danmaku = render_env(tmp_path)
+    times = {}
+    for nchunks in (0, 4):
+        output = str(tmp_path / f'out{nchunks}.mp4')
+        t0 = time.perf_counter()
+        status, info = make_chunk_render(chunks=nchunks).render_one(video, danmaku, output)
+        times[nchunks] = time.perf_counter() - t0
+        assert status, info
+        assert abs(FFprobe.get_duration(output) - 20) < 0.5
+        assert not os.path.exists(chunks_dir(output))
+    print(f'single {times[0]:.2f}s, 4 chunks {times[4]:.2f}s, speedup {times[0] / times[4]:.2f}x on {os.cpu_count()} cpus')
+    if (os.cpu_count() or 1) >= 4:
+        assert times[4] < times[0]
+
+
+@needs_ffmpeg
+def test_chunked_render_resume(tmp_path):
+    video, danmaku = render_env(tmp_path)
+    output = str(tmp_path / 'out.mp4')
+    render = make_chunk_render(checkpoint_interval=5)
+    run_ffmpeg = render.run_ffmpeg
+    calls = []
+
+    def fail_third_chunk(args, *a, **kw):
+        calls.append(args)
+        if len(calls) == 3:
+            return 1
+        return run_ffmpeg(args, *a, **kw)
+
+    render.run_ffmpeg = fail_third_chunk
+    status, _ = render.render_one(video, danmaku, output)
+    assert not status
+    assert ChunkManifest.exists(output)
+    manifest = ChunkManifest(chunks_dir(output), render.render_key(video, danmaku))
+    assert manifest.load() and manifest.progress() == (3, 4)
+
+    # 继续渲染时只渲染失败的分段，然后拼接
+    render = make_chunk_render(checkpoint_interval=5)
+    calls.clear()
+    render.run_ffmpeg = lambda args, *a, **kw: (calls.append(args), run_ffmpeg(args, *a, **kw))[1]
+    status, info = render.render_one(video, danmaku, output, resume=True)
+    assert status, info
+    assert len(calls) == 2
+    assert abs(FFprobe.get_duration(output) - 20) < 0.5
+    assert not os.path.exists(chunks_dir(output))
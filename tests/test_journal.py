@@ -0,0 +1,115 @@
+import struct
+
+import pytest
+
+from DMR.danmaku import SimpleDanmaku
+from DMR.Downloader.dedup import DanmakuDeduplicator
+from DMR.Downloader.journal import JournalWriter, read_journal, replay_journal
+
+
+def write(filename, n):
+    writer = JournalWriter()
+    writer.open(filename)
+    for i in range(n):
+        writer.add(SimpleDanmaku(time=i, dtype='super_chat' if i % 3 == 0 else 'danmaku',
+                                 uname=f'用户{i}', color='ffffff', content=f'弹幕{i}' * i,
+                                 price=i * 0.5, recv_time=1000 + i, server_time=-1))
+    writer.close()
+
+
+def test_read_journal(tmp_path):
+    filename = str(tmp_path / 'test.dmj')
+    write(filename, 20)
+    danmus = list(read_journal(filename))
+    assert len(danmus) == 20
+    assert [d.content for d in danmus] == [f'弹幕{i}' * i for i in range(20)]
+    assert danmus[3].dtype == 'super_chat' and danmus[3].price == 1.5 and danmus[3].uname == '用户3'
+
+
+def test_truncated_tail(tmp_path):
+    filename = str(tmp_path / 'test.dmj')
+    write(filename, 5)
+    with open(filename, 'rb') as f:
+        data = f.read()
+    full = [d.content for d in read_journal(filename)]
+    # 在任意位置截断都只返回完整的记录
+    last = len(full)
+    for size in range(len(data), 3, -1):
+        with open(filename, 'wb') as f:
+            f.write(data[:size])
+        contents = [d.content for d in read_journal(filename)]
+        assert contents == full[:len(contents)]
+        assert len(contents) <= last
+        last = len(contents)
+    assert last == 0
+
+
+def test_not_journal(tmp_path):
+    filename = str(tmp_path / 'test.dmj')
+    with open(filename, 'wb') as f:
+        f.write(b'XXXX')
+    with pytest.raises(ValueError):
+        list(read_journal(filename))
+
+
+class Writer:
+    def __init__(self):
+        self.lines = []
+
+    def add(self, danmu):
+        self.lines.append((danmu.dtype, danmu.content))
+        return True
+
+    def add_super_chat(self, danmu):
+        self.lines.append(('super_chat', danmu.content, danmu.price))
+
+
+def test_price_and_emoticon(tmp_path):
+    filename = str(tmp_path / 'test.dmj')
+    writer = JournalWriter()
+    writer.open(filename)
+    writer.add(SimpleDanmaku(time=1, dtype='super_chat', uname='a', content='sc', price=30000.07))
+    writer.add(SimpleDanmaku(time=2, dtype='emoticon', uname='b',
+                             content='{"url": "http://x/1.png", "desc": "[笑]", "width": 20, "height": 10}'))
+    writer.close()
+    sc, emoticon = read_journal(filename)
+    assert sc.price == 30000.07
+    assert emoticon.dtype == 'emoticon'
+    # 没有表情下载器时写入表情的文字描述
+    out = Writer()
+    assert replay_journal(filename, out) == 2
+    assert out.lines == [('super_chat', 'sc', 30000.07), ('danmaku', '[笑]')]
+
+
+def test_read_v1_journal(tmp_path):
+    filename = str(tmp_path / 'old.dmj')
+    record = struct.pack('<dddBfHHH', 1.5, 100, -1, 0, 0, 1, 6, 2) + b'a' + b'ffffff' + b'hi'
+    with open(filename, 'wb') as f:
+        f.write(b'DMJ1' + struct.pack('<I', len(record)) + record)
+    danmu, = read_journal(filename)
+    assert (danmu.time, danmu.dtype, danmu.uname, danmu.content) == (1.5, 'danmaku', 'a', 'hi')
+
+
+def test_replay_with_dedup(tmp_path):
+    # 录制时的写入方式：每条弹幕之前写入到期的合并弹幕，分段结束时写入全部
+    filename = str(tmp_path / 'test.dmj')
+    danmus = [SimpleDanmaku(time=t, dtype='danmaku', uname='u', content=c)
+              for t, c in [(1, '哈哈哈'), (2, '哈哈哈哈'), (3, '哈哈哈'), (4, '好'), (5, '哈哈哈'), (20, '好')]]
+    live = Writer()
+    dedup = DanmakuDeduplicator('fold', window=10, threshold=2)
+    journal = JournalWriter()
+    journal.open(filename)
+    for danmu in danmus:
+        for folded in dedup.expire(danmu.time):
+            live.add(folded)
+        if dedup.add(danmu):
+            live.add(danmu)
+        journal.add(danmu)
+    for folded in dedup.expire(0, flush=True):
+        live.add(folded)
+    journal.close()
+
+    replay = Writer()
+    replay_journal(filename, replay, dedup=DanmakuDeduplicator('fold', window=10, threshold=2))
+    assert replay.lines == live.lines
+    assert ('danmaku', '哈哈哈×2') in replay.lines
@@ -0,0 +1,103 @@
+import time
+
+import pytest
+
+from DMR.danmaku import SimpleDanmaku
+from DMR.Downloader.asswriter import AssWriter
+from DMR.Downloader.journal import JournalWriter
+from DMR.Downloader.relayout import load_ass_events, relayout
+
+STYLE = dict(dst=0, dmrate=0.5, font='Microsoft YaHei', fontsize=36, margin_h=6, margin_w=20, dmduration=12,
+             opacity=0.8, auto_fontsize=False, outlinecolor='000000', outlinesize=1)
+
+
+def danmakus(n, rate=5):
+    return [SimpleDanmaku(time=i / rate + 1, dtype='danmaku', uname='u', color=['ffffff', 'ff8000'][i % 2],
+                          content=f'弹幕{i}' + 'a' * (i % 13))
+            for i in range(n)]
+
+
+def write_ass(filename, danmus, width=1920, height=1080, super_chats=(), images=(), **kwargs):
+    writer = AssWriter(description='test', width=width, height=height, **{**STYLE, **kwargs})
+    writer.open(filename)
+    for danmu in danmus:
+        writer.add(danmu)
+    for danmu, image, ratio in images:
+        writer.add_image(danmu, image, ratio)
+    for danmu in super_chats:
+        writer.add_super_chat(danmu)
+    writer.close()
+
+
+def events(filename):
+    with open(filename, encoding='utf-8') as f:
+        return sorted(row for row in f if row.startswith('Dialogue:') or row.startswith('Picture:'))
+
+
+def test_same_style_reproduces_writer(tmp_path):
+    src, out = str(tmp_path / 'a.ass'), str(tmp_path / 'b.ass')
+    write_ass(src, danmakus(500))
+    stats = relayout(src, out, **STYLE)
+    assert stats['total'] == stats['written'] == len(events(src))
+    assert events(out) == events(src)
+
+
+def test_new_resolution_matches_writer(tmp_path):
+    # 重新排版到720P的结果与直接用720P录制的结果相同（原文件中没有被丢弃的弹幕）
+    danmus = danmakus(300, rate=1)
+    src, out, ref = str(tmp_path / 'a.ass'), str(tmp_path / 'b.ass'), str(tmp_path / 'ref.ass')
+    write_ass(src, danmus)
+    style = dict(STYLE, fontsize=24, dmduration=10)
+    relayout(src, out, width=1280, height=720, **style)
+    write_ass(ref, danmus, width=1280, height=720, **style)
+    assert events(out) == events(ref)
+    info = load_ass_events(out)
+    assert (info['width'], info['height'], info['fontsize']) == (1280, 720, 24)
+
+
+def test_keeps_super_chat_and_images(tmp_path):
+    src, out = str(tmp_path / 'a.ass'), str(tmp_path / 'b.ass')
+    sc = SimpleDanmaku(time=5, dtype='super_chat', uname='u', content='醒目留言', price=30)
+    image = (SimpleDanmaku(time=100, dtype='emoticon', uname='u', content='[表情]'), '/cache/e.png', 2)
+    write_ass(src, danmakus(10), super_chats=[sc], images=[image])
+    info = load_ass_events(src)
+    assert info['ratios'][-1] == 2 and info['contents'][-1] == '/cache/e.png'
+    stats = relayout(src, out, **dict(STYLE, fontsize=48))
+    assert stats['others'] == len(info['others']) > 0
+    rows = events(out)
+    assert sum('醒目留言' in row for row in rows) == 1
+    picture = [row for row in rows if row.startswith('Picture:')]
+    # 图片宽度按新的字体大小计算
+    assert len(picture) == 1 and ',-96,' in picture[0] and picture[0].rstrip().endswith('/cache/e.png')
+
+
+def test_journal_source(tmp_path):
+    journal, out, ref = str(tmp_path / 'a.dmj'), str(tmp_path / 'b.ass'), str(tmp_path / 'ref.ass')
+    danmus = danmakus(200)
+    writer = JournalWriter()
+    writer.open(journal)
+    # 日志中的弹幕顺序不一定按时间排列
+    for danmu in reversed(danmus):
+        writer.add(danmu)
+    writer.close()
+    with pytest.raises(ValueError):
+        relayout(journal, out, **STYLE)
+    stats = relayout(journal, out, width=1920, height=1080, **STYLE)
+    write_ass(ref, danmus)
+    assert stats['total'] == 200
+    assert events(out) == events(ref)
+
+
+def test_speed(tmp_path):
+    # 与逐条调用AssWriter.add重新生成相比
+    danmus = danmakus(50000, rate=50)
+    src, out, ref = str(tmp_path / 'a.ass'), str(tmp_path / 'b.ass'), str(tmp_path / 'ref.ass')
+    write_ass(src, danmus)
+    t0 = time.perf_counter()
+    relayout(src, out, **STYLE)
+    t_relayout = time.perf_counter() - t0
+    t0 = time.perf_counter()
+    write_ass(ref, danmus)
+    t_writer = time.perf_counter() - t0
+    print(f'relayout {t_relayout:.2f}s (including parsing), AssWriter {t_writer:.2f}s')
+    assert events(out) == events(ref)
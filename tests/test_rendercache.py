@@ -0,0 +1,54 @@
+import os
+
+from DMR.Render.rendercache import RenderCache, video_fingerprint
+
+
+def write(path, data):
+    with open(path, 'wb') as f:
+        f.write(data)
+    return str(path)
+
+
+def test_index_independent_of_cwd(tmp_path, monkeypatch):
+    index = RenderCache().filename
+    assert os.path.isabs(index)
+    monkeypatch.chdir(tmp_path)
+    assert RenderCache().filename == index
+    # 相对路径在创建时转换为绝对路径
+    assert RenderCache('cache.json').filename == str(tmp_path / 'cache.json')
+
+
+def test_record_lookup_evict(tmp_path):
+    cache = RenderCache(str(tmp_path / 'index.json'))
+    video = write(tmp_path / 'v.flv', os.urandom(4096))
+    danmaku = write(tmp_path / 'v.ass', b'[Events]')
+    output = write(tmp_path / 'out.mp4', b'rendered')
+    key = video_fingerprint(video)
+    cache.record(key, video, danmaku, output)
+    assert cache.lookup(key) == os.path.abspath(output)
+
+    # 输出文件被移动时更新路径，被删除时记录失效
+    moved = str(tmp_path / 'moved.mp4')
+    os.rename(output, moved)
+    assert cache.evict(output, moved) == 1
+    assert cache.lookup(key) == moved
+    os.remove(moved)
+    assert cache.lookup(key) is None
+
+
+def test_modified_output_invalidates(tmp_path):
+    cache = RenderCache(str(tmp_path / 'index.json'))
+    output = write(tmp_path / 'out.mp4', b'rendered')
+    cache.record('key', output, output, output)
+    write(tmp_path / 'out.mp4', b'rendered again')
+    assert cache.lookup('key') is None
+
+
+def test_link(tmp_path):
+    src = write(tmp_path / 'out.mp4', b'rendered')
+    dst = write(tmp_path / 'new.mp4', b'old')
+    RenderCache.link(src, dst)
+    with open(dst, 'rb') as f:
+        assert f.read() == b'rendered'
+    # 硬链接不复制数据
+    assert os.stat(src).st_ino == os.stat(dst).st_ino
@@ -0,0 +1,105 @@
+import os
+import shutil
+import socket
+import subprocess
+import time
+
+import pytest
+
+from DMR.Render.restream import RestreamSink, flv_body
+
+FFMPEG = shutil.which('ffmpeg')
+needs_ffmpeg = pytest.mark.skipif(not FFMPEG, reason='ffmpeg not found')
+
+ASS_HEADER = [
+    '[Script Info]',
+    'ScriptType: v4.00+',
+    'PlayResX: 320',
+    'PlayResY: 240',
+    '',
+    '[V4+ Styles]',
+    'Format: Name, Fontname, Fontsize, PrimaryColour, SecondaryColour, OutlineColour, BackColour, Bold, Italic, '
+    'Underline, StrikeOut, ScaleX, ScaleY, Spacing, Angle, BorderStyle, Outline, Shadow, Alignment, MarginL, '
+    'MarginR, MarginV, Encoding',
+    'Style: R2L,Arial,20,&H00FFFFFF,&H00FFFFFF,&H00000000,&H00000000,0,0,0,0,100,100,0,0,1,1,0,7,0,0,0,0',
+    '',
+    '[Events]',
+    'Format: Layer, Start, End, Style, Name, MarginL, MarginR, MarginV, Effect, Text',
+]
+
+
+def flv_header(audio=True, video=True):
+    flags = (4 if audio else 0) | (1 if video else 0)
+    return b'FLV\x01' + bytes([flags]) + (9).to_bytes(4, 'big') + b'\x00\x00\x00\x00'
+
+
+def test_flv_body():
+    tags = b'\x12\x00\x00\x03abc\x00\x00\x00\x0e'
+    assert flv_body(flv_header() + tags) == tags
+    # 不是FLV文件头时原样返回
+    assert flv_body(tags) == tags
+    assert flv_body(b'FLV') == b'FLV'
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def frame_times(filename):
+    out = subprocess.run([FFMPEG, '-v', 'error', '-i', filename, '-map', '0:v', '-f', 'framecrc', '-'],
+                         capture_output=True, text=True).stdout
+    # framecrc每一行：stream, dts, pts, duration, size, crc，时间基为1/1000（FLV）
+    return [int(row.split(',')[2]) for row in out.splitlines() if row and not row.startswith('#')]
+
+
+@needs_ffmpeg
+def test_restream_to_local_rtmp(tmp_path):
+    video = str(tmp_path / 'rec.flv')
+    subprocess.run([FFMPEG, '-y', '-v', 'error',
+                    '-f', 'lavfi', '-i', 'testsrc=size=320x240:rate=25:duration=6',
+                    '-f', 'lavfi', '-i', 'sine=duration=6',
+                    '-c:v', 'libx264', '-preset', 'ultrafast', '-g', '25', '-c:a', 'aac', video], check=True)
+
+    # 本地RTMP服务器：ffmpeg -listen 1接收推流并保存为FLV
+    url = f'rtmp://127.0.0.1:{free_port()}/live/test'
+    received = str(tmp_path / 'received.flv')
+    server = subprocess.Popen([FFMPEG, '-y', '-v', 'error', '-listen', '1', '-timeout', '30',
+                               '-i', url, '-c', 'copy', received])
+    time.sleep(1)
+
+    sink = RestreamSink(url, render_config={
+        'vencoder': 'libx264', 'vencoder_args': ['-preset', 'ultrafast', '-g', '25'],
+        'advanced_render_args': {'gop': 0}, 'ffmpeg': FFMPEG,
+    }, piece_length=2, dm_wait=1, max_delay=60, workdir=str(tmp_path / 'work'))
+    try:
+        sink.start()
+        danmaku = str(tmp_path / 'rec.ass')
+        sink.ass_open(danmaku, ASS_HEADER)
+        for i in range(12):
+            sink.ass_event(danmaku, f'Dialogue: 0,0:00:0{i//2}.{i%2*5}0,0:00:0{i//2+2}.00,R2L,,0,0,0,,'
+                                    f'{{\\move(320,20,-40,20)}}弹幕{i}\n')
+        sink.add_segment(video, danmaku)
+        # 录制结束
+        deadline = time.time() + 60
+        while sink.follower is None and time.time() < deadline:
+            time.sleep(0.1)
+        sink.follower.finish()
+        while sink.stats['published'] < 5.5 and time.time() < deadline:
+            time.sleep(0.2)
+        assert sink.stats['published'] >= 5.5
+        assert sink.stats['dropped_pieces'] == 0
+        sink.segments.put(None)
+        sink._thread.join(30)
+    finally:
+        sink.stop()
+    server.wait(timeout=30)
+
+    # 多个小段连续推送（后面的小段去掉FLV文件头），接收到的是一个时间戳连续的流
+    times = frame_times(received)
+    assert len(times) >= 140
+    assert times == sorted(times)
+    assert max(b - a for a, b in zip(times, times[1:])) <= 80
+    with open(received, 'rb') as f:
+        assert f.read().count(b'FLV\x01') == 1
@@ -0,0 +1,123 @@
+import threading
+
+import pytest
+
+from DMR.Render import scheduler
+from DMR.Render.scheduler import RenderScheduler
+
+
+@pytest.fixture
+def cpu(monkeypatch):
+    usage = {'value': 10}
+    monkeypatch.setattr(scheduler, 'cpu_percent', lambda: usage['value'])
+    return usage
+
+
+def task(group, i, priority=None):
+    # 视频文件不存在，每个任务按1计算已渲染的量
+    t = {'group': group, 'video': f'{group}-{i}.flv'}
+    if priority is not None:
+        t['priority'] = priority
+    return t
+
+
+def run_all(sched, pid=0):
+    order = []
+    while any(sched.queues.values()):
+        t = sched.get(pid)
+        order.append(t['video'])
+        sched.finish(pid)
+        sched.task_done()
+    return order
+
+
+def test_fair_share(cpu):
+    sched = RenderScheduler(1)
+    for i in range(3):
+        sched.put(task('a', i))
+    for i in range(3):
+        sched.put(task('b', i))
+    # 两个直播间的任务轮流渲染，同一直播间内按先后顺序
+    assert run_all(sched) == ['a-0.flv', 'b-0.flv', 'a-1.flv', 'b-1.flv', 'a-2.flv', 'b-2.flv']
+
+
+def test_priority(cpu):
+    sched = RenderScheduler(1)
+    for i in range(3):
+        sched.put(task('a', i))
+    sched.put(task('b', 0), priority=1)
+    sched.put(task('c', 0, priority=2))
+    assert run_all(sched) == ['c-0.flv', 'b-0.flv', 'a-0.flv', 'a-1.flv', 'a-2.flv']
+
+
+def test_nrenders_not_gated(cpu):
+    # CPU使用率很高时，nrenders以内的任务仍然同时开始
+    cpu['value'] = 100
+    sched = RenderScheduler(3, max_renders=5, max_cpu=50, admit_interval=10)
+    for i in range(4):
+        sched.put(task('a', i))
+    assert [sched.get(pid)['video'] for pid in range(3)] == ['a-0.flv', 'a-1.flv', 'a-2.flv']
+    assert len(sched.running) == 3
+
+
+def test_cpu_admission(cpu):
+    sched = RenderScheduler(1, max_renders=2, max_cpu=50, admit_interval=0)
+    sched.limit = 2
+    for i in range(3):
+        sched.put(task('a', i))
+    assert sched.get(0)['video'] == 'a-0.flv'
+    cpu['value'] = 90
+    sched._cpu_time = 0
+    assert not sched._admit()
+    cpu['value'] = 20
+    sched._cpu_time = 0
+    assert sched._admit()
+    assert sched.get(1)['video'] == 'a-1.flv'
+
+
+def test_blocked_get_returns_on_exit(cpu):
+    sched = RenderScheduler(1)
+    result = []
+    thread = threading.Thread(target=lambda: result.append(sched.get(0)))
+    thread.start()
+    sched.put('exit')
+    thread.join(5)
+    assert result == ['exit']
+
+
+def test_auto_tune(cpu):
+    sched = RenderScheduler(1, max_renders=3, max_cpu=90, admit_interval=0)
+    sched.min_elapsed = 0
+    for i in range(10):
+        sched.put(task('a', i))
+
+    def finish(pid, elapsed, duration):
+        sched.running[pid]['start_time'] -= elapsed
+        sched.finish(pid, duration)
+        sched.task_done()
+
+    # 单个任务2倍速，还有任务排队，增加并发数
+    sched.get(0)
+    finish(0, 20, 40)
+    assert sched.limit == 2 and sched.throughput(1) == pytest.approx(2, rel=0.01)
+
+    # 两个任务同时渲染总速度只有1.8倍，比单个任务慢，减少并发数
+    sched.get(0)
+    sched.get(1)
+    finish(0, 20, 18)
+    assert sched.limit == 1
+    finish(1, 20, 18)
+    assert sched.stats()['limit'] == 1
+    assert len(sched.stats()['history']) == 3
+
+
+def test_auto_tune_respects_cpu(cpu):
+    sched = RenderScheduler(1, max_renders=3, max_cpu=90, admit_interval=0)
+    sched.min_elapsed = 0
+    cpu['value'] = 95
+    for i in range(3):
+        sched.put(task('a', i))
+    sched.get(0)
+    sched.running[0]['start_time'] -= 20
+    sched.finish(0, 40)
+    assert sched.limit == 1
@@ -0,0 +1,122 @@
+import importlib
+import io
+import random
+import time
+
+import pytest
+
+from DMR.Downloader.tracks import TrackAllocator, TextMeasurer, find_font
+
+WIDTH, DURATION = 1920, 15
+GAP, MARGIN = 0.2 * WIDTH, 20
+
+
+class LinearTracks:
+    """原来AssWriter中的轨道分配：每条弹幕遍历所有轨道，作为对照"""
+    def __init__(self, ntracks):
+        self.tails = [None] * ntracks
+
+    def find(self, tic):
+        tid, max_dist = 0, -1e5
+        for i, tail in enumerate(self.tails):
+            if not tail:
+                dist = 1e5
+            else:
+                tail_time, tail_length = tail
+                dist = (tic - tail_time) * (tail_length + WIDTH) / DURATION - tail_length
+            if dist > GAP and dist > MARGIN:
+                return i, dist
+            if dist > max_dist:
+                max_dist = dist
+                tid = i
+        return tid, max_dist
+
+    def place(self, tid, tic, length):
+        self.tails[tid] = (tic, length)
+
+
+def messages(n, rate, seed=0):
+    rng = random.Random(seed)
+    tic = 0
+    for _ in range(n):
+        tic += rng.expovariate(rate)
+        yield tic, rng.randrange(40, 800)
+
+
+@pytest.mark.parametrize('rate', [0.5, 50])
+def test_matches_linear_scan(rate):
+    # 两种分配方式使用相同的轨道状态，比较每一条弹幕的结果
+    tracks = TrackAllocator(12, WIDTH, DURATION, GAP, MARGIN)
+    linear = LinearTracks(12)
+    saturated = 0
+    for tic, length in messages(5000, rate):
+        tid, ok = tracks.find(tic)
+        ltid, dist = linear.find(tic)
+        if dist > GAP:
+            assert (tid, ok) == (ltid, True)
+        else:
+            saturated += 1
+            assert ok == (dist >= MARGIN)
+        if ok:
+            tracks.place(tid, tic, length)
+            linear.place(tid, tic, length)
+    assert saturated if rate > 1 else not saturated
+
+
+def test_no_tracks():
+    assert TrackAllocator(0, WIDTH, DURATION, GAP, MARGIN).find(1) == (-1, False)
+
+
+def test_throughput():
+    def run(allocator, msgs):
+        t = time.perf_counter()
+        for tic, length in msgs:
+            tid, ok = allocator.find(tic)
+            if ok:
+                allocator.place(tid, tic, length)
+        return len(msgs) / (time.perf_counter() - t)
+
+    msgs = list(messages(1000000, 50))
+    new = run(TrackAllocator(25, WIDTH, DURATION, GAP, MARGIN), msgs)
+    old = run(LinearTracks(25), msgs[:200000])
+    print(f'track allocator: {new:.0f} msgs/s, linear scan: {old:.0f} msgs/s')
+    assert new > old
+
+
+@pytest.fixture
+def font_dir(tmp_path):
+    # Pillow自带的Aileron字体
+    from PIL import ImageFont
+    data = ImageFont.load_default(20).path
+    (tmp_path / 'aileron.otf').write_bytes(data.getvalue() if isinstance(data, io.BytesIO) else b'')
+    return tmp_path
+
+
+def test_find_font(font_dir):
+    path = str(font_dir / 'aileron.otf')
+    assert find_font(path) == path
+    # 字体名称（不区分大小写）
+    assert find_font('aileron', (str(font_dir),)) == path
+    assert find_font('No Such Font', (str(font_dir),)) is None
+
+
+def test_measure_with_font_name(font_dir, monkeypatch):
+    tracks = importlib.import_module('DMR.Downloader.tracks')
+    monkeypatch.setattr(tracks, '_font_dirs', lambda: [str(font_dir)])
+    monkeypatch.setattr(tracks.shutil, 'which', lambda name: None)
+    tracks.find_font.cache_clear()
+    try:
+        measurer = TextMeasurer(40, [None, 'Aileron'])
+    finally:
+        tracks.find_font.cache_clear()
+    assert measurer.font is not None
+    # 实际字宽：i比W窄
+    assert measurer.width('iiii') < measurer.width('WWWW')
+
+
+def test_measure_estimate():
+    measurer = TextMeasurer(40, ['No Such Font'])
+    assert measurer.font is None
+    assert measurer.width('ab') == 40
+    assert measurer.width('弹幕') == 80
+    assert measurer.width('😀') == 40
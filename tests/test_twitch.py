@@ -0,0 +1,99 @@
+import asyncio
+
+from aiohttp import web, WSMsgType
+from aiohttp.test_utils import TestServer
+
+from DMR.Downloader.dmqueue import DanmakuQueue
+from DMR.LiveAPI.danmaku.twitch import Twitch, TwitchIRCPool, parse_irc
+
+
+def test_parse_irc_malformed_tags():
+    line = '@tmi-sent-ts=abc;bits=1x;user-id=42;display-name=Foo\\sBar :foo!foo@foo PRIVMSG #Chan :hi'
+    command, channel, msg = parse_irc(line)
+    assert command == 'PRIVMSG' and channel == 'chan'
+    assert msg['name'] == 'Foo Bar' and msg['uid'] == '42' and msg['content'] == 'hi'
+    assert 'server_time' not in msg and 'bits' not in msg
+
+    _, _, msg = parse_irc('@tmi-sent-ts=1700000000123;bits=100 :foo!foo@foo PRIVMSG #chan :cheer100')
+    assert msg['server_time'] == 1700000000.123 and msg['bits'] == 100
+
+
+class FakeIRC:
+    """本地的IRC websocket服务器，记录收到的命令，加入频道后发送lines中的消息"""
+    def __init__(self, lines) -> None:
+        self.lines = lines
+        self.received = []
+        self.connections = 0
+        self.pong = asyncio.Event()
+
+    async def handler(self, request):
+        ws = web.WebSocketResponse()
+        await ws.prepare(request)
+        self.connections += 1
+        async for msg in ws:
+            if msg.type != WSMsgType.TEXT:
+                continue
+            self.received.append(msg.data)
+            if msg.data.startswith('JOIN'):
+                await ws.send_str('\r\n'.join(self.lines) + '\r\n')
+                await ws.send_str('PING :tmi.twitch.tv')
+            elif msg.data.startswith('PONG'):
+                self.pong.set()
+        return ws
+
+
+def test_fake_irc_server():
+    async def run():
+        lines = [
+            '@tmi-sent-ts=bad;display-name=a :a!a@a PRIVMSG #chan :first',
+            '@bits=oops;display-name=b :b!b@b PRIVMSG #chan :second',
+            '@tmi-sent-ts=1700000000000;display-name=c :c!c@c PRIVMSG #chan :third',
+            '@display-name=d :d!d@d PRIVMSG #other :not mine',
+        ]
+        irc = FakeIRC(lines)
+        app = web.Application()
+        app.router.add_get('/', irc.handler)
+        server = TestServer(app)
+        await server.start_server()
+
+        pool = TwitchIRCPool()
+        pool.url = str(server.make_url('/')).replace('http://', 'ws://')
+        TwitchIRCPool._instance = pool
+        q = DanmakuQueue(100, 'drop_type')
+        room = Twitch(rid='Chan', q=q)
+        task = asyncio.create_task(room.start())
+        try:
+            msgs = [await asyncio.wait_for(q.get(), 5) for _ in range(3)]
+            await asyncio.wait_for(irc.pong.wait(), 5)
+            assert [m['content'] for m in msgs] == ['first', 'second', 'third']
+            assert msgs[2]['server_time'] == 1700000000
+            # 格式错误的标签没有导致重连
+            assert irc.connections == 1
+            assert 'JOIN #chan' in irc.received
+            assert room.first_active is not None
+            await asyncio.sleep(0.1)
+            assert q.empty()
+        finally:
+            await room.stop()
+            task.cancel()
+            await asyncio.gather(task, return_exceptions=True)
+            TwitchIRCPool._instance = None
+            await server.close()
+    asyncio.run(run())
+
+
+def test_block_policy_does_not_drop():
+    async def run():
+        loop = asyncio.get_running_loop()
+        q = DanmakuQueue(2, 'block')
+        room = Twitch(rid='chan', q=q)
+        room._loop = loop
+        # 连接池在其他线程中调用回调
+        await loop.run_in_executor(None, lambda: [room._put({'msg_type': 'danmaku', 'content': str(i)}) for i in range(5)])
+        got = []
+        for _ in range(5):
+            got.append((await asyncio.wait_for(q.get(), 1))['content'])
+            q.task_done()
+        assert got == ['0', '1', '2', '3', '4']
+        assert q.dropped == {}
+    asyncio.run(run())
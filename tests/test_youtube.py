@@ -0,0 +1,102 @@
+import asyncio
+
+from aiohttp import web
+from aiohttp.test_utils import TestServer
+
+from DMR.LiveAPI.danmaku.youtube import Youtube
+
+
+def action(i):
+    return {'addChatItemAction': {'item': {'liveChatTextMessageRenderer': {
+        'authorName': {'simpleText': f'user{i}'},
+        'authorExternalChannelId': f'uid{i}',
+        'message': {'runs': [{'text': f'hello {i}'}]},
+        'timestampUsec': str(1700000000000000 + i),
+    }}}}
+
+
+async def start_server(responses):
+    """本地的聊天接口，依次返回responses中的(timeoutMs, 消息数量)"""
+    calls = []
+
+    async def get_live_chat(request):
+        body = await request.json()
+        calls.append(body['continuation'])
+        timeout, count = responses[min(len(calls), len(responses)) - 1]
+        data = {'continuation': f'ctn{len(calls)}'}
+        if timeout is not None:
+            data['timeoutMs'] = timeout
+        return web.json_response({'continuationContents': {'liveChatContinuation': {
+            'continuations': [{'timedContinuationData': data}],
+            'actions': [action(i) for i in range(count)],
+        }}})
+
+    app = web.Application()
+    app.router.add_post('/youtubei/v1/live_chat/get_live_chat', get_live_chat)
+    server = TestServer(app)
+    await server.start_server()
+    return server, calls
+
+
+def make_client(server, q=None):
+    yt = Youtube(rid='UCtest', q=q or asyncio.Queue())
+    yt.base_url = str(server.make_url('')).rstrip('/')
+    yt.ctn = 'ctn0'
+    yt.client = Youtube._acquire_session()
+    return yt
+
+
+def test_timeout_clamping():
+    async def run():
+        server, calls = await start_server([(100, 0), (60000, 0), (None, 0), (2500, 1)])
+        yt = make_client(server)
+        try:
+            intervals = []
+            for _ in range(4):
+                msgs, interval = await yt.get_chat_single()
+                intervals.append(interval)
+            assert intervals == [0.5, 10, Youtube.default_interval, 2.5]
+            assert calls == ['ctn0', 'ctn1', 'ctn2', 'ctn3']
+            assert msgs[0]['content'] == 'hello 0' and msgs[0]['uid'] == 'uid0'
+            assert yt.first_active is not None
+        finally:
+            await Youtube._release_session()
+            await server.close()
+    asyncio.run(run())
+
+
+def test_shared_session_refcount():
+    async def run():
+        s1 = Youtube._acquire_session()
+        s2 = Youtube._acquire_session()
+        assert s1 is s2
+        await Youtube._release_session()
+        assert not s1.closed
+        await Youtube._release_session()
+        assert s1.closed
+        # 全部释放之后重新创建
+        s3 = Youtube._acquire_session()
+        assert s3 is not s1 and not s3.closed
+        await Youtube._release_session()
+        assert s3.closed
+    asyncio.run(run())
+
+
+def test_batch_spread_over_interval():
+    async def run():
+        server, _ = await start_server([(1000, 4), (1000, 0)])
+        q = asyncio.Queue()
+        yt = make_client(server, q)
+        task = asyncio.create_task(yt.get_chat())
+        try:
+            msgs = [await asyncio.wait_for(q.get(), 3) for _ in range(4)]
+        finally:
+            yt._stop = True
+            task.cancel()
+            await asyncio.gather(task, return_exceptions=True)
+            await Youtube._release_session()
+            await server.close()
+        gaps = [b['recv_mono'] - a['recv_mono'] for a, b in zip(msgs, msgs[1:])]
+        # 4条消息分布在1秒内，间隔约0.25秒
+        assert all(0.2 <= g <= 0.4 for g in gaps), gaps
+    asyncio.run(run())